@@ -0,0 +1,174 @@
+"""
+Admission control for the face verification API.
+
+A verification ties up a detector, an embedding slot and a voter API download for
+about a second. When more arrive than the models can serve, queueing them all only
+turns a surge into timeouts at every booth. The controller admits a bounded number of
+verifications at a time, lets a bounded queue wait behind them, and turns the rest
+away at once with an honest estimate of when to retry: a request is rejected up front
+if the predicted wait means it could not finish before its deadline.
+
+Healthchecks and answers from the result cache never pass through it. Background work
+(bulk enrollment, voting slot prefetch) goes through it too, but only ever holds a capped share of the slots
+and waits out overload instead of failing.
+"""
+import asyncio
+import contextlib
+import math
+import time
+from collections import deque
+
+
+class Overloaded(Exception):
+    """Raised when a request cannot be served before its deadline"""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """Bounded concurrency plus a bounded, deadline-aware FIFO queue"""
+
+    def __init__(self, max_concurrency, max_queue=64, deadline=10.0, initial_service_time=1.0, smoothing=0.2):
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_queue = max(0, max_queue)
+        self.deadline = deadline
+        self.smoothing = smoothing
+        self._service_time = initial_service_time
+        self._in_flight = 0
+        self._waiters = deque()
+        self.admitted = 0
+        self.rejected_queue_full = 0
+        self.rejected_deadline = 0
+        self.timed_out = 0
+
+    @property
+    def queue_depth(self):
+        return len(self._waiters)
+
+    def predicted_wait(self):
+        """Seconds a request arriving now is expected to wait for a slot"""
+        if self._in_flight < self.max_concurrency and not self._waiters:
+            return 0.0
+        # Slots free up in waves of max_concurrency, each taking about one service time
+        return math.ceil((len(self._waiters) + 1) / self.max_concurrency) * self._service_time
+
+    def retry_after(self):
+        """Whole seconds a rejected client should wait before retrying"""
+        return max(1, math.ceil(self.predicted_wait()))
+
+    def deadline_from(self, timeout=None):
+        """Absolute deadline for a request, optionally shortened by a client timeout in seconds"""
+        budget = self.deadline if timeout is None else min(timeout, self.deadline)
+        return time.monotonic() + budget
+
+    @contextlib.asynccontextmanager
+    async def admit(self, deadline=None):
+        """
+        Hold an admission slot for the duration of the block
+
+        Args:
+            deadline: time.monotonic() by which the request has to finish
+
+        Raises:
+            Overloaded: If the queue is full or the request would miss its deadline
+        """
+        if deadline is None:
+            deadline = self.deadline_from()
+        await self._acquire(deadline)
+        self.admitted += 1
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - started
+            self._service_time += self.smoothing * (elapsed - self._service_time)
+            self._release()
+
+    async def _acquire(self, deadline):
+        if self._in_flight < self.max_concurrency and not self._waiters:
+            self._in_flight += 1
+            return
+
+        if len(self._waiters) >= self.max_queue:
+            self.rejected_queue_full += 1
+            raise Overloaded("Admission queue is full", self.retry_after())
+
+        # Leave enough time to actually serve the request once it is admitted
+        max_wait = deadline - time.monotonic() - self._service_time
+        if self.predicted_wait() > max_wait:
+            self.rejected_deadline += 1
+            raise Overloaded("Predicted wait exceeds the request deadline", self.retry_after())
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        try:
+            await asyncio.wait_for(future, max_wait)
+        except BaseException as e:
+            if future.done() and not future.cancelled():
+                # The slot was handed over just as the wait ended: pass it on
+                self._release()
+            else:
+                with contextlib.suppress(ValueError):
+                    self._waiters.remove(future)
+            if isinstance(e, asyncio.TimeoutError):
+                self.timed_out += 1
+                raise Overloaded("Timed out waiting for a free slot", self.retry_after()) from None
+            raise
+
+    def _release(self):
+        # Hand the slot straight to the oldest live waiter, so newcomers cannot jump the queue
+        while self._waiters:
+            future = self._waiters.popleft()
+            if not future.done():
+                future.set_result(None)
+                return
+        self._in_flight -= 1
+
+    def stats(self):
+        return {
+            "in_flight": self._in_flight,
+            "max_concurrency": self.max_concurrency,
+            "queue_depth": len(self._waiters),
+            "max_queue": self.max_queue,
+            "service_time_ms": round(self._service_time * 1000, 1),
+            "predicted_wait_ms": round(self.predicted_wait() * 1000, 1),
+            "admitted": self.admitted,
+            "rejected_queue_full": self.rejected_queue_full,
+            "rejected_deadline": self.rejected_deadline,
+            "timed_out": self.timed_out
+        }
+
+
+class AdmittedPool:
+    """
+    Inference pool view for background jobs, admitted alongside live requests
+
+    Every call takes an admission slot, at most `share` of them at a time. When the
+    controller turns a call away, it sleeps for the suggested retry delay and tries
+    again, so the job slows down under load instead of queueing ahead of verifications.
+    """
+
+    def __init__(self, pool, admission, share):
+        self.pool = pool
+        self.admission = admission
+        self.share = max(1, share)
+        self._slots = asyncio.Semaphore(self.share)
+        self.backoffs = 0
+
+    async def run(self, fn, *args):
+        """Run fn(*args) in the inference pool once admitted"""
+        return await self.call(self.pool.run, fn, *args)
+
+    async def call(self, coroutine_fn, *args):
+        """Await coroutine_fn(*args) once admitted, for background work that drives the pool itself"""
+        async with self._slots:
+            while True:
+                try:
+                    async with self.admission.admit():
+                        return await coroutine_fn(*args)
+                except Overloaded as e:
+                    self.backoffs += 1
+                    await asyncio.sleep(e.retry_after)
@@ -0,0 +1,326 @@
+"""
+Post-election audit: re-run every recorded face check against the reference photos.
+
+Reads a manifest of recorded checks, one row per check with the voter ID, the path of
+the captured image and the decision taken at the booth, as CSV (with a header row) or
+JSONL:
+
+    voter_id,image,verified,id
+    123456,captures/booth7/0001.jpg,true,booth7-0001
+
+Image paths are relative to the manifest. Reference embeddings come from the
+reference embedding store, so voters enrolled before polling day are not embedded
+again; the others are fetched from the voter database API once per voter. The
+captured images are re-verified in a pool of worker processes that preload the models,
+with the same quality and anti-spoofing checks as the live API, and each result is
+appended to a JSONL report as soon as it is ready.
+
+The report doubles as the checkpoint: rerunning the same command skips the rows it
+already holds, so an interrupted audit resumes where it stopped. A summary with
+agreement counts and throughput is written next to the report.
+
+Usage:
+    python audit.py manifest.csv --report audit.jsonl
+    python audit.py manifest.jsonl --report audit.jsonl --workers 16
+"""
+import argparse
+import asyncio
+import csv
+import json
+import logging
+import os
+import sys
+import time
+from pathlib import Path
+
+import face_pipeline
+from coalescing import SingleFlight
+from embedding_store import ReferenceEmbeddingStore, photo_version
+from inference_pool import InferencePool
+from settings import EMBEDDINGS_DIR, REFERENCE_CACHE_SIZE, INFERENCE_WORKERS, VOTER_API_URL
+from voter_api import VoterApiClient
+
+logger = logging.getLogger(__name__)
+
+TRUE_DECISIONS = {"true", "1", "yes", "verified", "accepted", "match"}
+FALSE_DECISIONS = {"false", "0", "no", "not_verified", "rejected", "no_match"}
+
+
+class AuditProgress:
+    """Counters and throughput of an audit run"""
+
+    def __init__(self):
+        self.submitted = 0
+        self.resumed = 0
+        self.agreed = 0
+        self.newly_rejected = 0
+        self.newly_verified = 0
+        self.failed = 0
+        self.started_at = time.time()
+        self.finished_at = None
+
+    @property
+    def processed(self):
+        return self.agreed + self.newly_rejected + self.newly_verified + self.failed
+
+    @property
+    def elapsed(self):
+        return (self.finished_at or time.time()) - self.started_at
+
+    def to_dict(self):
+        rate = self.processed / self.elapsed if self.elapsed else 0
+        return {
+            "submitted": self.submitted,
+            "processed": self.processed,
+            "resumed_rows": self.resumed,
+            "agreed": self.agreed,
+            "disagreed": self.newly_rejected + self.newly_verified,
+            "verified_at_booth_now_rejected": self.newly_rejected,
+            "rejected_at_booth_now_verified": self.newly_verified,
+            "failed": self.failed,
+            "elapsed_seconds": round(self.elapsed, 2),
+            "rows_per_second": round(rate, 2),
+            "finished": self.finished_at is not None
+        }
+
+
+def parse_decision(value):
+    """Turn a recorded booth decision into True/False, or None if it is missing or unknown"""
+    if isinstance(value, bool):
+        return value
+    value = str(value or "").strip().lower()
+    if value in TRUE_DECISIONS:
+        return True
+    if value in FALSE_DECISIONS:
+        return False
+    return None
+
+
+def read_manifest(manifest_path):
+    """
+    Yield the rows of a CSV or JSONL manifest
+
+    Yields:
+        Dicts with "row" (1-based), "id", "voter_id", "image" (resolved path) and "original_verified"
+    """
+    manifest_path = Path(manifest_path)
+    with open(manifest_path, newline="") as f:
+        if manifest_path.suffix.lower() in (".jsonl", ".ndjson"):
+            records = (json.loads(line) for line in f if line.strip())
+        else:
+            records = csv.DictReader(f)
+        for row, record in enumerate(records, start=1):
+            image = record.get("image") or record.get("image_path") or ""
+            yield {
+                "row": row,
+                "id": record.get("id") or None,
+                "voter_id": str(record.get("voter_id") or "").strip(),
+                "image": str(manifest_path.parent / image) if image else "",
+                "original_verified": parse_decision(record.get("verified", record.get("decision")))
+            }
+
+
+def load_report(report_path):
+    """Return the manifest rows a previous run already wrote to the report"""
+    done = set()
+    if Path(report_path).exists():
+        with open(report_path) as f:
+            for line in f:
+                try:
+                    done.add(json.loads(line)["row"])
+                except (ValueError, KeyError):
+                    # A line cut short by an interrupted run
+                    continue
+    return done
+
+
+def audit_image(image_path, reference_embedding):
+    """
+    Re-verify one captured image in an inference worker
+
+    Runs the same pipeline as the live API: quality checks, detection, anti-spoofing
+    on every detected face, embedding and comparison with the main model.
+
+    Returns:
+        Comparison from face_pipeline.compare_embeddings
+    """
+    face, img, facial_areas, _ = face_pipeline.detect_probe(Path(image_path).read_bytes())
+    face_pipeline.check_spoofing(img, facial_areas)
+    return face_pipeline.compare_embeddings(face_pipeline.embed_faces([face])[0], reference_embedding)
+
+
+async def reference_embedding(voter_id, voter_api, pool, store):
+    """Return a voter's stored reference embedding, embedding their photo if it is not stored yet"""
+    voter_image_url = await voter_api.get_voter_image_url(voter_id)
+    if not voter_image_url:
+        raise ValueError(f"Could not retrieve image for voter ID: {voter_id}")
+
+    version = photo_version(voter_image_url)
+    embedding = store.get(voter_id, version)
+    if embedding is None:
+        reference_bytes = await voter_api.download_image(voter_image_url)
+        if not reference_bytes:
+            raise ValueError(f"Could not download reference image for voter ID: {voter_id}")
+        embedding = await pool.run(face_pipeline.embed_reference, reference_bytes)
+        store.put(voter_id, version, embedding)
+    return embedding
+
+
+async def audit_rows(rows, voter_api, pool, store, report_path, concurrency=8, log_interval=30):
+    """
+    Re-verify a stream of manifest rows and append one report line per row
+
+    Args:
+        rows: Iterable of manifest rows from read_manifest (consumed lazily)
+        voter_api: VoterApiClient used to fetch reference photos
+        pool: InferencePool re-verifying the captured images
+        store: ReferenceEmbeddingStore holding the reference embeddings
+        report_path: JSONL report, also read to resume an interrupted run
+        concurrency: Rows processed at the same time
+        log_interval: Seconds between progress log lines
+
+    Returns:
+        The AuditProgress of the run
+    """
+    progress = AuditProgress()
+    done = load_report(report_path)
+    progress.resumed = len(done)
+    if done:
+        logger.info(f"Resuming audit, {len(done)} rows already in the report")
+
+    report = open(report_path, "a")
+    if report.tell() > 0:
+        with open(report_path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                # Terminate a line cut short by an interrupted run before appending
+                report.write("\n")
+    references = SingleFlight()
+    queue = asyncio.Queue(maxsize=concurrency * 2)
+    last_log = time.monotonic()
+
+    def record(row, entry):
+        nonlocal last_log
+        report.write(json.dumps({**row, **entry}) + "\n")
+        report.flush()
+        if time.monotonic() - last_log >= log_interval:
+            last_log = time.monotonic()
+            stats = progress.to_dict()
+            logger.info(
+                f"Audit progress: {stats['processed']}/{stats['submitted']} rows, {stats['agreed']} agreed, "
+                f"{stats['disagreed']} disagreed, {stats['failed']} failed ({stats['rows_per_second']} rows/s)"
+            )
+
+    async def worker():
+        while True:
+            row = await queue.get()
+            if row is None:
+                return
+            started = time.perf_counter()
+            try:
+                if not row["voter_id"] or not row["image"]:
+                    raise ValueError("The row needs a voter_id and an image")
+                embedding = await references.do(
+                    row["voter_id"], lambda: reference_embedding(row["voter_id"], voter_api, pool, store)
+                )
+                result = await pool.run(audit_image, row["image"], embedding)
+            except Exception as e:
+                progress.failed += 1
+                record(row, {"outcome": "error", "error": str(e), "seconds": round(time.perf_counter() - started, 3)})
+                continue
+
+            if row["original_verified"] is None or result["verified"] == row["original_verified"]:
+                progress.agreed += 1
+                outcome = "agree"
+            else:
+                outcome = "disagree"
+                if row["original_verified"]:
+                    progress.newly_rejected += 1
+                else:
+                    progress.newly_verified += 1
+            record(row, {
+                "outcome": outcome,
+                "verified": result["verified"],
+                "distance": result["distance"],
+                "threshold": result["threshold"],
+                "model": result["model"],
+                "seconds": round(time.perf_counter() - started, 3)
+            })
+
+    workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+    try:
+        for row in rows:
+            if row["row"] in done:
+                continue
+            progress.submitted += 1
+            await queue.put(row)
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers)
+    finally:
+        for task in workers:
+            task.cancel()
+        report.close()
+        progress.finished_at = time.time()
+
+    stats = progress.to_dict()
+    logger.info(
+        f"Audit finished: {stats['processed']} rows, {stats['agreed']} agreed, {stats['disagreed']} disagreed, "
+        f"{stats['failed']} failed in {stats['elapsed_seconds']}s ({stats['rows_per_second']} rows/s)"
+    )
+    return progress
+
+
+async def main(args):
+    report_path = Path(args.report)
+    report_path.parent.mkdir(parents=True, exist_ok=True)
+    if args.restart and report_path.exists():
+        report_path.unlink()
+
+    store = ReferenceEmbeddingStore(args.embeddings_dir, memory_size=REFERENCE_CACHE_SIZE)
+    voter_api = VoterApiClient(base_url=args.voter_api_url, pool_per_host=args.concurrency)
+    pool = InferencePool(mode="process", workers=args.workers)
+    # Split the cores between the worker processes instead of letting each of them use all
+    threads = str(max(1, (os.cpu_count() or 2) // args.workers))
+    for name in ("INFERENCE_THREADS", "TF_NUM_INTRAOP_THREADS", "OMP_NUM_THREADS"):
+        os.environ.setdefault(name, threads)
+
+    pool.start()
+    await voter_api.start()
+    try:
+        await pool.warm_up()
+        progress = await audit_rows(
+            read_manifest(args.manifest),
+            voter_api,
+            pool,
+            store,
+            report_path,
+            concurrency=args.concurrency
+        )
+    finally:
+        await voter_api.close()
+        pool.shutdown()
+
+    summary = {"manifest": str(args.manifest), "report": str(report_path), "workers": args.workers, **progress.to_dict()}
+    summary_path = report_path.with_name(f"{report_path.stem}.summary.json")
+    with open(summary_path, "w") as f:
+        json.dump(summary, f, indent=2)
+    print(json.dumps(summary, indent=2))
+    return 1 if progress.failed else 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description="Re-verify recorded face checks against the voters' reference photos")
+    parser.add_argument("manifest", help="CSV or JSONL manifest with voter_id, image and verified columns")
+    parser.add_argument("--report", default="audit-report.jsonl", help="JSONL report, also used to resume")
+    parser.add_argument("--restart", action="store_true", help="Discard an existing report instead of resuming it")
+    parser.add_argument("--workers", type=int, default=INFERENCE_WORKERS, help="Inference worker processes")
+    parser.add_argument("--concurrency", type=int, help="Rows in flight (default: twice the workers)")
+    parser.add_argument("--voter-api-url", default=VOTER_API_URL, help="Base URL of the voter database API")
+    parser.add_argument("--embeddings-dir", default=str(EMBEDDINGS_DIR), help="Reference embedding store directory")
+    args = parser.parse_args()
+    args.concurrency = args.concurrency or args.workers * 2
+
+    sys.exit(asyncio.run(main(args)))
@@ -0,0 +1,43 @@
+"""
+Benchmark fixtures shared by the stub voter API and the load generator.
+
+Both sides derive the same voter roster from a directory of face photos: voter IDs
+bench-000000, bench-000001, ... are assigned to the photos in turn, so any number of
+benchmark voters can be simulated from a handful of images. Every voter gets its own
+photo URL, so the API embeds and caches each one separately, as it would for real
+voters.
+"""
+from pathlib import Path
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png"}
+
+# Voter photos uploaded through the ID locker backend
+DEFAULT_FIXTURES_DIR = Path(__file__).resolve().parents[2] / "idlocker" / "backend" / "uploads"
+
+VOTER_ID_PREFIX = "bench-"
+
+
+def load_photos(directory):
+    """Return the image files in a fixture directory, in a stable order"""
+    photos = sorted(
+        path for path in Path(directory).iterdir()
+        if path.is_file() and path.suffix.lower() in IMAGE_EXTENSIONS
+    )
+    if not photos:
+        raise ValueError(f"No fixture photos found in {directory}")
+    return photos
+
+
+def voter_roster(directory, voters):
+    """
+    Assign fixture photos to benchmark voters
+
+    Args:
+        directory: Directory of face photos
+        voters: Number of benchmark voters
+
+    Returns:
+        List of (voter_id, photo path) pairs
+    """
+    photos = load_photos(directory)
+    return [(f"{VOTER_ID_PREFIX}{i:06d}", photos[i % len(photos)]) for i in range(voters)]
@@ -0,0 +1,261 @@
+"""
+Load generator for the face verification API.
+
+Drives /api/verify, /api/verify-base64 and/or /api/verify-raw with a closed loop
+of concurrent clients at each requested concurrency level, and reports throughput,
+latency percentiles, response statuses and error classes. The API's /metrics
+endpoint is scraped before and after each level, so the report also breaks the
+latency down by stage (voter API lookup, reference download, detection,
+anti-spoofing, embedding...).
+
+Results are saved as JSON so runs can be compared; pass --compare with an earlier
+result file to print the differences.
+
+Start the stub voter API and the face verification API first (with the result cache
+disabled, otherwise repeated probes are answered from it):
+
+    python benchmark/stub_voter_api.py --voters 1000
+    RESULT_DEDUP_TTL=0 python main.py
+    python benchmark/load_test.py --concurrency 1 4 16 --requests 200
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import platform
+import re
+import sys
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from pathlib import Path
+
+import aiohttp
+import numpy as np
+
+from fixtures import DEFAULT_FIXTURES_DIR, voter_roster
+
+ENDPOINTS = ["verify", "verify-base64", "verify-raw"]
+
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+
+STAGE_METRIC = re.compile(r'^face_api_stage_seconds_(sum|count)\{stage="([^"]+)"\} (\S+)$')
+
+
+async def scrape_stages(session, api_url):
+    """
+    Read the per-stage latency totals from the API's /metrics endpoint
+
+    Returns:
+        Dict of {stage: (total seconds, count)}, empty if metrics are unavailable
+    """
+    try:
+        async with session.get(f"{api_url}/metrics") as response:
+            if response.status != 200:
+                return {}
+            text = await response.text()
+    except aiohttp.ClientError:
+        return {}
+
+    totals = {}
+    for line in text.splitlines():
+        match = STAGE_METRIC.match(line)
+        if match:
+            kind, stage, value = match.groups()
+            seconds, count = totals.get(stage, (0.0, 0.0))
+            if kind == "sum":
+                seconds = float(value)
+            else:
+                count = float(value)
+            totals[stage] = (seconds, count)
+    return totals
+
+
+def stage_breakdown(before, after):
+    """Mean milliseconds per stage between two scrapes"""
+    breakdown = {}
+    for stage, (seconds, count) in sorted(after.items()):
+        seconds_before, count_before = before.get(stage, (0.0, 0.0))
+        calls = count - count_before
+        if calls > 0:
+            breakdown[stage] = {
+                "calls": int(calls),
+                "mean_ms": round((seconds - seconds_before) / calls * 1000, 2)
+            }
+    return breakdown
+
+
+def build_request(endpoint, api_url, voter_id, photo):
+    """Return (url, body, headers) for one verification request"""
+    name, data = photo
+    if endpoint == "verify-raw":
+        return f"{api_url}/api/verify-raw/{voter_id}", data, {"Content-Type": "image/jpeg"}
+
+    form = aiohttp.FormData()
+    if endpoint == "verify":
+        form.add_field("uploaded_image", data, filename=name, content_type="image/jpeg")
+    else:
+        form.add_field("uploaded_image", base64.b64encode(data).decode("ascii"))
+    form.add_field("voter_id", voter_id)
+    return f"{api_url}/api/{endpoint}", form, None
+
+
+async def run_level(session, args, roster, photos, concurrency):
+    """
+    Run one concurrency level
+
+    Returns:
+        Dict with throughput, latency percentiles, statuses, errors and stage breakdown
+    """
+    endpoints = ENDPOINTS if args.endpoint == "all" else [args.endpoint]
+    latencies = []
+    statuses = Counter()
+    errors = Counter()
+    next_request = 0
+
+    async def client():
+        nonlocal next_request
+        while next_request < args.requests:
+            i = next_request
+            next_request += 1
+            voter_id, photo_path = roster[i % len(roster)]
+            url, body, headers = build_request(endpoints[i % len(endpoints)], args.api_url, voter_id, photos[photo_path])
+
+            started = time.perf_counter()
+            try:
+                async with session.post(url, data=body, headers=headers) as response:
+                    result = await response.json(content_type=None)
+                    statuses[str(response.status)] += 1
+                    if not result.get("success"):
+                        errors[result.get("error", "Unknown error")] += 1
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                statuses["client_error"] += 1
+                errors[type(e).__name__] += 1
+            latencies.append(time.perf_counter() - started)
+
+    stages_before = await scrape_stages(session, args.api_url)
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    stages_after = await scrape_stages(session, args.api_url)
+
+    latencies_ms = np.asarray(latencies) * 1000
+    return {
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "elapsed_seconds": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 2),
+        "latency_ms": {
+            "mean": round(float(latencies_ms.mean()), 1),
+            "p50": round(float(np.percentile(latencies_ms, 50)), 1),
+            "p95": round(float(np.percentile(latencies_ms, 95)), 1),
+            "p99": round(float(np.percentile(latencies_ms, 99)), 1),
+            "max": round(float(latencies_ms.max()), 1)
+        },
+        "statuses": dict(statuses),
+        "errors": dict(errors),
+        "stages": stage_breakdown(stages_before, stages_after)
+    }
+
+
+def print_level(level):
+    latency = level["latency_ms"]
+    print(
+        f"concurrency {level['concurrency']:>4}: {level['throughput_rps']:>8.2f} req/s  "
+        f"p50 {latency['p50']:>8.1f} ms  p95 {latency['p95']:>8.1f} ms  p99 {latency['p99']:>8.1f} ms  "
+        f"statuses {level['statuses']}"
+    )
+    if level["errors"]:
+        print(f"{'':>18}errors {level['errors']}")
+    for stage, numbers in level["stages"].items():
+        print(f"{'':>18}{stage:<28} {numbers['mean_ms']:>9.2f} ms x {numbers['calls']}")
+
+
+def print_comparison(current, baseline_path):
+    """Print throughput and latency changes against an earlier result file"""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    previous = {level["concurrency"]: level for level in baseline["levels"]}
+
+    print(f"\nCompared with {baseline_path} ({baseline.get('label') or baseline['started_at']}):")
+    for level in current["levels"]:
+        old = previous.get(level["concurrency"])
+        if old is None:
+            continue
+        changes = [f"throughput {_change(old['throughput_rps'], level['throughput_rps'])}"]
+        for percentile in ("p50", "p95", "p99"):
+            changes.append(f"{percentile} {_change(old['latency_ms'][percentile], level['latency_ms'][percentile])}")
+        print(f"concurrency {level['concurrency']:>4}: " + "  ".join(changes))
+
+
+def _change(old, new):
+    if not old:
+        return "n/a"
+    return f"{(new - old) / old * 100:+.1f}%"
+
+
+async def main(args):
+    roster = voter_roster(args.fixtures, args.voters)
+    photos = {path: (path.name, path.read_bytes()) for _, path in roster}
+
+    timeout = aiohttp.ClientTimeout(total=args.timeout)
+    connector = aiohttp.TCPConnector(limit=max(args.concurrency) + 1)
+    async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+        if args.warmup:
+            # Reference embeddings and model graphs are prepared here, not in the measured levels
+            print(f"Warming up with {args.warmup} requests...")
+            warmup_args = argparse.Namespace(**{**vars(args), "requests": args.warmup})
+            await run_level(session, warmup_args, roster, photos, min(args.concurrency))
+
+        result = {
+            "label": args.label,
+            "started_at": datetime.now(timezone.utc).isoformat(),
+            "config": {
+                "api_url": args.api_url,
+                "endpoint": args.endpoint,
+                "voters": args.voters,
+                "requests_per_level": args.requests,
+                "warmup": args.warmup,
+                "fixtures": str(args.fixtures)
+            },
+            "host": {
+                "platform": platform.platform(),
+                "python": platform.python_version(),
+                "cpu_count": os.cpu_count()
+            },
+            "levels": []
+        }
+        for concurrency in args.concurrency:
+            level = await run_level(session, args, roster, photos, concurrency)
+            print_level(level)
+            result["levels"].append(level)
+
+    output = Path(args.output) if args.output else RESULTS_DIR / (
+        f"{datetime.now().strftime('%Y%m%d-%H%M%S')}{'-' + args.label if args.label else ''}.json"
+    )
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(result, f, indent=2)
+    print(f"\nSaved results to {output}")
+
+    if args.compare:
+        print_comparison(result, args.compare)
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the face verification API")
+    parser.add_argument("--api-url", default="http://localhost:8000", help="Face verification API base URL")
+    parser.add_argument("--endpoint", choices=ENDPOINTS + ["all"], default="all", help="Endpoint to drive, or all in turn")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16], help="Concurrency levels to run")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per concurrency level")
+    parser.add_argument("--warmup", type=int, default=20, help="Unmeasured requests sent first")
+    parser.add_argument("--voters", type=int, default=1000, help="Benchmark voters (must match the stub voter API)")
+    parser.add_argument("--fixtures", default=str(DEFAULT_FIXTURES_DIR), help="Directory of face photos")
+    parser.add_argument("--timeout", type=float, default=60, help="Per-request timeout in seconds")
+    parser.add_argument("--label", default="", help="Name stored with the results, e.g. a branch or hardware")
+    parser.add_argument("--output", help="Result file (default: benchmark/results/<timestamp>-<label>.json)")
+    parser.add_argument("--compare", help="Earlier result file to compare against")
+
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -0,0 +1,116 @@
+"""
+Stand-in for the voter database API, for benchmarks.
+
+Serves the two endpoints the face verification API calls:
+
+    GET /api/voters/id/{voter_id}     voter record with a photoUrl
+    GET /uploads/{voter_id}/{name}    the voter's photo
+
+Photos come from a fixture directory (see fixtures.py). Both endpoints send an ETag
+and answer conditional requests with 304, like a caching-friendly backend would. An
+optional delay simulates the network and database latency of the real service.
+
+Usage:
+    python benchmark/stub_voter_api.py --voters 1000 --latency-ms 20
+"""
+import argparse
+import asyncio
+import hashlib
+import logging
+import mimetypes
+
+from aiohttp import web
+
+from fixtures import DEFAULT_FIXTURES_DIR, voter_roster
+
+logger = logging.getLogger(__name__)
+
+
+class StubVoterApi:
+    """Serves voter records and photos from a fixture roster"""
+
+    def __init__(self, roster, latency=0.0):
+        self.latency = latency
+        self.voters = {}
+        self.photos = {}
+        files = {}
+        for voter_id, path in roster:
+            # Voters sharing a fixture photo share its bytes
+            if path not in files:
+                files[path] = path.read_bytes()
+            data = files[path]
+            self.voters[voter_id] = path.name
+            etag = f'"{hashlib.sha1(data).hexdigest()[:16]}-{voter_id}"'
+            self.photos[voter_id] = (data, etag, mimetypes.guess_type(path.name)[0] or "image/jpeg")
+        self.lookups = 0
+        self.downloads = 0
+        self.not_modified = 0
+
+    async def _delay(self):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    async def get_voter(self, request):
+        await self._delay()
+        self.lookups += 1
+        voter_id = request.match_info["voter_id"]
+        photo_name = self.voters.get(voter_id)
+        if photo_name is None:
+            return web.json_response({"message": "Voter not found"}, status=404)
+
+        etag = f'"voter-{voter_id}"'
+        if request.headers.get("If-None-Match") == etag:
+            self.not_modified += 1
+            return web.Response(status=304, headers={"ETag": etag})
+        return web.json_response(
+            {
+                "voterId": voter_id,
+                "fullName": f"Benchmark Voter {voter_id}",
+                "photoUrl": f"/uploads/{voter_id}/{photo_name}"
+            },
+            headers={"ETag": etag}
+        )
+
+    async def get_photo(self, request):
+        await self._delay()
+        self.downloads += 1
+        photo = self.photos.get(request.match_info["voter_id"])
+        if photo is None:
+            raise web.HTTPNotFound()
+
+        data, etag, content_type = photo
+        if request.headers.get("If-None-Match") == etag:
+            self.not_modified += 1
+            return web.Response(status=304, headers={"ETag": etag})
+        return web.Response(body=data, content_type=content_type, headers={"ETag": etag})
+
+    async def get_stats(self, request):
+        return web.json_response({
+            "voters": len(self.voters),
+            "lookups": self.lookups,
+            "downloads": self.downloads,
+            "not_modified": self.not_modified
+        })
+
+    def app(self):
+        app = web.Application()
+        app.router.add_get("/api/voters/id/{voter_id}", self.get_voter)
+        app.router.add_get("/uploads/{voter_id}/{name}", self.get_photo)
+        app.router.add_get("/stats", self.get_stats)
+        return app
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description="Stand-in voter database API serving fixture photos")
+    parser.add_argument("--fixtures", default=str(DEFAULT_FIXTURES_DIR), help="Directory of face photos")
+    parser.add_argument("--voters", type=int, default=1000, help="Number of benchmark voters")
+    parser.add_argument("--latency-ms", type=float, default=0, help="Delay added to every response")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9001)
+    args = parser.parse_args()
+
+    stub = StubVoterApi(voter_roster(args.fixtures, args.voters), latency=args.latency_ms / 1000)
+    logger.info(f"Serving {len(stub.voters)} benchmark voters from {args.fixtures}")
+    web.run_app(stub.app(), host=args.host, port=args.port, access_log=None)
@@ -0,0 +1,105 @@
+"""
+Request coalescing for the face verification API.
+
+Voters retry quickly and booths sometimes double-submit, so several requests for the
+same voter often arrive together. SingleFlight lets them share one in-flight
+reference preparation, and ResultCache answers identical retries (same voter, same
+image bytes) with the earlier result instead of running the model again.
+"""
+import asyncio
+import time
+from collections import OrderedDict
+
+
+class SingleFlight:
+    """Runs at most one coroutine per key at a time, sharing its result with concurrent callers"""
+
+    def __init__(self):
+        self._calls = {}
+        self.started = 0
+        self.shared = 0
+
+    def __len__(self):
+        return len(self._calls)
+
+    async def do(self, key, fn):
+        """
+        Await fn() for this key, or join the call already in flight
+
+        Args:
+            key: Hashable key identifying the work
+            fn: Zero-argument callable returning a coroutine
+        """
+        future = self._calls.get(key)
+        if future is not None:
+            self.shared += 1
+        else:
+            self.started += 1
+            future = asyncio.ensure_future(fn())
+            self._calls[key] = future
+            future.add_done_callback(lambda done: self._forget(key, done))
+
+        # Shield the shared work so one caller going away does not cancel it for the others
+        return await asyncio.shield(future)
+
+    def _forget(self, key, future):
+        if self._calls.get(key) is future:
+            del self._calls[key]
+        if not future.cancelled():
+            # Mark the exception as retrieved even if every caller went away
+            future.exception()
+
+    def stats(self):
+        return {
+            "in_flight": len(self._calls),
+            "started": self.started,
+            "shared": self.shared
+        }
+
+
+class ResultCache:
+    """Short-lived cache of verification results keyed by (voter_id, image digest)"""
+
+    def __init__(self, ttl, max_entries=10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self.hits = 0
+
+    @property
+    def enabled(self):
+        return self.ttl > 0
+
+    def get(self, key):
+        """Return a copy of the cached result, or None if missing or expired"""
+        if not self.enabled:
+            return None
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, result = entry
+        if time.monotonic() >= expires_at:
+            del self._entries[key]
+            return None
+        self.hits += 1
+        return dict(result)
+
+    def put(self, key, result):
+        if not self.enabled:
+            return
+        self._entries[key] = (time.monotonic() + self.ttl, dict(result))
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, voter_id):
+        """Drop every cached result for a voter"""
+        for key in [key for key in self._entries if key[0] == voter_id]:
+            del self._entries[key]
+
+    def stats(self):
+        return {
+            "ttl": self.ttl,
+            "entries": len(self._entries),
+            "hits": self.hits
+        }
@@ -0,0 +1,88 @@
+"""
+Dynamic micro-batching of face embeddings.
+
+Concurrent verifications each produce one aligned face crop. Instead of running one
+forward pass per crop, the batcher collects the crops that arrive within a short
+window (or until the batch is full) and embeds them with a single batched model call,
+which is much faster per face on CPU-only hosts.
+"""
+import asyncio
+import logging
+
+import face_pipeline
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingBatcher:
+    """Collects face crops from concurrent requests and embeds them in batches"""
+
+    def __init__(self, pool, max_batch_size=16, max_wait_ms=10, model_name=face_pipeline.MODEL_NAME):
+        self.pool = pool
+        self.model_name = model_name
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000
+        self._pending = []
+        self._timer = None
+        self._tasks = set()
+        self.batches = 0
+        self.faces = 0
+
+    async def embed(self, face):
+        """Embed one aligned face crop, sharing a model call with concurrent requests"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((face, future))
+
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        # Faces whose request was cancelled (e.g. by a spoof verdict) are not embedded
+        batch = [(face, future) for face, future in self._pending if not future.cancelled()]
+        self._pending = []
+        if not batch:
+            return
+
+        task = asyncio.ensure_future(self._run_batch(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run_batch(self, batch):
+        faces = [face for face, _ in batch]
+        self.batches += 1
+        self.faces += len(faces)
+
+        try:
+            embeddings = await self.pool.run(face_pipeline.embed_faces, faces, self.model_name)
+        except Exception as e:
+            logger.error(f"Error embedding batch of {len(faces)} faces: {e}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), embedding in zip(batch, embeddings):
+            # The caller may have gone away (e.g. client disconnected)
+            if not future.done():
+                future.set_result(embedding)
+
+    def stats(self):
+        """Return batching configuration and average batch size"""
+        return {
+            "model": self.model_name,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+            "pending": len(self._pending),
+            "batches": self.batches,
+            "faces": self.faces,
+            "average_batch_size": self.faces / self.batches if self.batches else 0
+        }
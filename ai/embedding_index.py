@@ -0,0 +1,320 @@
+"""
+Vectorized 1:N search over the reference embeddings of every enrolled voter.
+
+Embeddings are L2-normalized and kept in contiguous matrices, so cosine similarity
+against the whole voter roll is a blocked matrix-vector product. Once the roll is
+large enough, an IVF (inverted file) index is trained with spherical k-means: the
+search then only scans the lists of the closest centroids, plus any rows added or
+updated since training.
+
+The index can sit on top of a read-only base matrix (the memory-mapped voter roll
+shared by every worker); embeddings added later go to a small private matrix.
+
+Rows are never rewritten once added (an update retires the old row and appends a
+new one), so searches and training scan a snapshot taken under the lock and do not
+block updates while they run.
+"""
+import logging
+import threading
+import time
+from collections import namedtuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Consistent view of the index rows, scanned without holding the lock
+_Snapshot = namedtuple("_Snapshot", ["base", "base_size", "matrix", "size", "ids", "live"])
+
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-10)
+
+
+class EmbeddingIndex:
+    """Cosine top-k search over voter embeddings, exact or IVF-accelerated"""
+
+    def __init__(self, dtype="float16", block_size=8192, ivf_threshold=100000, nprobe=16):
+        self.dtype = np.dtype(dtype)
+        self.block_size = block_size
+        self.ivf_threshold = ivf_threshold
+        self.nprobe = nprobe
+        self._lock = threading.RLock()
+        self._reset()
+
+    def _reset(self):
+        # Rows [0, base_size) live in the read-only base matrix, the rest in the private matrix
+        self._generation = getattr(self, "_generation", 0) + 1
+        self._base = None
+        self._base_size = 0
+        self._matrix = None
+        self._size = 0
+        self._ids = []
+        self._rows = {}
+        self._live = np.zeros(0, dtype=bool)
+        # IVF state
+        self._centroids = None
+        self._list_order = None
+        self._list_bounds = None
+        self._trained_size = 0
+        self._unindexed = []
+
+    def __len__(self):
+        return len(self._rows)
+
+    @property
+    def mode(self):
+        return "ivf" if self._centroids is not None else "exact"
+
+    @property
+    def needs_training(self):
+        """Whether (re)training the IVF index would pay off"""
+        if len(self._rows) < self.ivf_threshold:
+            return False
+        return self._centroids is None or len(self._unindexed) > max(1000, self._trained_size // 10)
+
+    def _snapshot(self):
+        """Capture the current rows; must be called with the lock held"""
+        return _Snapshot(
+            self._base, self._base_size, self._matrix, self._size, self._ids, self._live[:self._size].copy()
+        )
+
+    @staticmethod
+    def _segments(snapshot):
+        """Yield (matrix, first row, row count) for the base and private matrices"""
+        if snapshot.base_size:
+            yield snapshot.base, 0, min(snapshot.base_size, snapshot.size)
+        if snapshot.size > snapshot.base_size:
+            yield snapshot.matrix, snapshot.base_size, snapshot.size - snapshot.base_size
+
+    @staticmethod
+    def _vectors(snapshot, rows):
+        """Gather the given rows from both matrices as float32"""
+        dim = (snapshot.base if snapshot.base is not None else snapshot.matrix).shape[1]
+        vectors = np.empty((len(rows), dim), dtype=np.float32)
+        in_base = rows < snapshot.base_size
+        if in_base.any():
+            vectors[in_base] = snapshot.base[rows[in_base]]
+        if not in_base.all():
+            vectors[~in_base] = snapshot.matrix[rows[~in_base] - snapshot.base_size]
+        return vectors
+
+    def _reserve(self, dim):
+        used = self._size - self._base_size
+        if self._matrix is None:
+            capacity = 1024
+            self._matrix = np.zeros((capacity, dim), dtype=self.dtype)
+        elif used == len(self._matrix):
+            capacity = len(self._matrix) * 2
+            matrix = np.zeros((capacity, dim), dtype=self.dtype)
+            matrix[:used] = self._matrix[:used]
+            self._matrix = matrix
+        if len(self._live) < self._base_size + len(self._matrix):
+            live = np.zeros(self._base_size + len(self._matrix), dtype=bool)
+            live[:self._size] = self._live[:self._size]
+            self._live = live
+
+    def load_base(self, voter_ids, matrix, exclude=()):
+        """
+        Replace the index content with a read-only matrix of normalized embeddings
+
+        Embeddings added since the previous base was loaded are carried over.
+
+        Args:
+            voter_ids: Voter ID of each matrix row
+            matrix: Matrix of L2-normalized embeddings, e.g. a memory-mapped voter roll
+            exclude: Voter IDs whose matrix rows are stale and must not be searched
+        """
+        with self._lock:
+            added = [
+                (voter_id, self._matrix[row - self._base_size].copy())
+                for voter_id, row in self._rows.items()
+                if row >= self._base_size
+            ]
+            self._reset()
+            self._base = matrix
+            self._base_size = len(voter_ids)
+            self._size = self._base_size
+            self._ids = list(voter_ids)
+            self._rows = {voter_id: row for row, voter_id in enumerate(self._ids)}
+            self._live = np.ones(self._base_size, dtype=bool)
+            for voter_id in exclude:
+                row = self._rows.pop(voter_id, None)
+                if row is not None:
+                    self._live[row] = False
+            for voter_id, embedding in added:
+                self.add(voter_id, embedding)
+
+    def add(self, voter_id, embedding):
+        """Insert or replace the embedding of a voter"""
+        vector = _normalize(embedding)
+        with self._lock:
+            row = self._rows.get(voter_id)
+            if row is not None:
+                # Rows are never rewritten while a search may be scanning them:
+                # retire the old row and append a new one
+                self._live[row] = False
+            self._reserve(vector.shape[0])
+            row = self._size
+            self._matrix[row - self._base_size] = vector
+            self._size += 1
+            self._ids.append(voter_id)
+            self._rows[voter_id] = row
+            self._live[row] = True
+            if self._centroids is not None:
+                self._unindexed.append(row)
+
+    def add_many(self, items):
+        """Insert or replace many (voter_id, embedding) pairs"""
+        for voter_id, embedding in items:
+            self.add(voter_id, embedding)
+
+    def remove(self, voter_id):
+        """Remove a voter from the index"""
+        with self._lock:
+            row = self._rows.pop(voter_id, None)
+            if row is not None:
+                self._live[row] = False
+
+    def _top_k(self, sims, rows, k):
+        if len(sims) > k:
+            keep = np.argpartition(-sims, k - 1)[:k]
+            sims, rows = sims[keep], rows[keep]
+        return sims, rows
+
+    def _merge(self, best, sims, rows, k):
+        sims, rows = self._top_k(sims, rows, k)
+        return self._top_k(np.concatenate([best[0], sims]), np.concatenate([best[1], rows]), k)
+
+    def _search_rows(self, snapshot, query, rows, k):
+        """Exact search restricted to the given rows"""
+        best = (np.empty(0, dtype=np.float32), np.empty(0, dtype=np.int64))
+        for start in range(0, len(rows), self.block_size):
+            block_rows = rows[start:start + self.block_size]
+            block_rows = block_rows[snapshot.live[block_rows]]
+            if len(block_rows) == 0:
+                continue
+            best = self._merge(best, self._vectors(snapshot, block_rows) @ query, block_rows, k)
+        return best
+
+    def _search_all(self, snapshot, query, k):
+        """Exact search over every row, one contiguous block at a time"""
+        best = (np.empty(0, dtype=np.float32), np.empty(0, dtype=np.int64))
+        for matrix, first_row, count in self._segments(snapshot):
+            for start in range(0, count, self.block_size):
+                end = min(start + self.block_size, count)
+                sims = matrix[start:end].astype(np.float32) @ query
+                sims[~snapshot.live[first_row + start:first_row + end]] = -np.inf
+                best = self._merge(best, sims, np.arange(first_row + start, first_row + end), k)
+        return best
+
+    def search(self, embedding, k=5, exclude=None):
+        """
+        Find the enrolled voters closest to an embedding
+
+        Args:
+            embedding: Query embedding
+            k: Number of matches to return
+            exclude: Optional voter ID to leave out of the results
+
+        Returns:
+            List of (voter_id, cosine distance) pairs, closest first
+        """
+        query = _normalize(embedding)
+        # Fetch one extra candidate so excluding a voter still leaves k results
+        fetch = k + 1 if exclude is not None else k
+
+        with self._lock:
+            if self._size == 0:
+                return []
+            snapshot = self._snapshot()
+            centroids = self._centroids
+            list_order = self._list_order
+            list_bounds = self._list_bounds
+            unindexed = np.asarray(self._unindexed, dtype=np.int64)
+
+        if centroids is not None:
+            centroid_sims = centroids @ query
+            probes = np.argsort(-centroid_sims)[:self.nprobe]
+            candidates = [list_order[list_bounds[p]:list_bounds[p + 1]] for p in probes]
+            candidates.append(unindexed)
+            rows = np.unique(np.concatenate(candidates))
+            sims, rows = self._search_rows(snapshot, query, rows, fetch)
+        else:
+            sims, rows = self._search_all(snapshot, query, fetch)
+
+        order = np.argsort(-sims)
+        results = []
+        for i in order:
+            if not np.isfinite(sims[i]):
+                continue
+            voter_id = snapshot.ids[rows[i]]
+            if voter_id == exclude:
+                continue
+            results.append((voter_id, max(0.0, float(1 - sims[i]))))
+        return results[:k]
+
+    def train(self, iterations=8, seed=0):
+        """Train the IVF index with spherical k-means over the current embeddings"""
+        with self._lock:
+            snapshot = self._snapshot()
+            size = snapshot.size
+            live_rows = np.flatnonzero(snapshot.live)
+            updates_seen = len(self._unindexed)
+            generation = self._generation
+        if len(live_rows) == 0:
+            return
+
+        started = time.perf_counter()
+        rng = np.random.default_rng(seed)
+        nlist = max(1, int(np.sqrt(len(live_rows))))
+        sample_rows = rng.choice(live_rows, size=min(len(live_rows), nlist * 32), replace=False)
+        sample = self._vectors(snapshot, np.sort(sample_rows))
+
+        centroids = sample[rng.choice(len(sample), size=nlist, replace=False)]
+        for _ in range(iterations):
+            assignment = self._assign(sample, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, sample)
+            empty = np.linalg.norm(sums, axis=1) == 0
+            # Re-seed empty clusters with random samples
+            sums[empty] = sample[rng.choice(len(sample), size=int(empty.sum()))]
+            centroids = _normalize(sums)
+
+        assignment = np.concatenate([
+            self._assign(matrix[:count], centroids) for matrix, _, count in self._segments(snapshot)
+        ])
+        list_order = np.argsort(assignment, kind="stable")
+        list_bounds = np.searchsorted(assignment[list_order], np.arange(nlist + 1))
+
+        with self._lock:
+            if self._generation != generation:
+                # A new base was loaded while training, this result is stale
+                return
+            self._centroids = centroids
+            self._list_order = list_order
+            self._list_bounds = list_bounds
+            # Rows added or updated while training are searched exhaustively
+            self._unindexed = list(range(size, self._size)) + self._unindexed[updates_seen:]
+            self._trained_size = size
+
+        logger.info(f"Trained IVF index with {nlist} lists over {size} embeddings in {time.perf_counter() - started:.2f}s")
+
+    def _assign(self, vectors, centroids):
+        assignment = np.empty(len(vectors), dtype=np.int64)
+        for start in range(0, len(vectors), self.block_size):
+            block = vectors[start:start + self.block_size].astype(np.float32)
+            assignment[start:start + self.block_size] = np.argmax(block @ centroids.T, axis=1)
+        return assignment
+
+    def stats(self):
+        return {
+            "mode": self.mode,
+            "enrolled": len(self._rows),
+            "shared_rows": self._base_size,
+            "dtype": self.dtype.name,
+            "ivf_lists": len(self._centroids) if self._centroids is not None else 0,
+            "unindexed": len(self._unindexed)
+        }
@@ -0,0 +1,350 @@
+"""
+Reference embedding store for the face verification API.
+
+Embeddings of voters' reference photos are kept in an in-memory LRU tier backed by
+an on-disk tier (one .npz file per voter), keyed by voter ID and photo version. The
+photo version changes whenever the voter database points to a different photo, so a
+replaced photo is never compared against a stale embedding.
+
+For multi-worker deployments the per-voter files can be packed into a compact voter
+roll: one float16/float32 matrix plus a voter_id index, published with an atomic
+manifest swap. Workers memory-map it read-only, so they all share one page-cache
+copy of the roll instead of each holding their own.
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+ROLL_MANIFEST = "current.json"
+
+
+def photo_version(photo_url):
+    """Derive a short version tag for a voter photo from its URL"""
+    return hashlib.sha1(photo_url.encode("utf-8")).hexdigest()[:16]
+
+
+def embedding_files(directory):
+    """Per-voter embedding files in a directory, without the temporary files of writes in progress"""
+    return [path for path in Path(directory).glob("*.npz") if not path.name.endswith(".tmp.npz")]
+
+
+class ReferenceEmbeddingStore:
+    """Two-tier (memory LRU + disk) store of reference face embeddings"""
+
+    def __init__(self, directory, memory_size=4096, roll=None):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.memory_size = memory_size
+        self.roll = roll
+        self._memory = OrderedDict()
+        # Pinned entries live outside the LRU until released (see pin)
+        self._pinned = {}
+        self._pins = {}
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.roll_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _file_path(self, voter_id):
+        safe_id = re.sub(r"[^A-Za-z0-9_.-]", "_", str(voter_id))
+        return self.directory / f"{safe_id}.npz"
+
+    def _remember(self, voter_id, version, embedding):
+        with self._lock:
+            if voter_id in self._pins:
+                self._pinned[voter_id] = (version, embedding)
+                return
+            self._memory[voter_id] = (version, embedding)
+            self._memory.move_to_end(voter_id)
+            while len(self._memory) > self.memory_size:
+                self._memory.popitem(last=False)
+
+    def get(self, voter_id, version):
+        """Return the cached embedding for this voter and photo version, or None"""
+        with self._lock:
+            entry = self._pinned.get(voter_id)
+            if entry is not None and entry[0] == version:
+                self.memory_hits += 1
+                return entry[1]
+            entry = self._memory.get(voter_id)
+            if entry is not None and entry[0] == version:
+                self._memory.move_to_end(voter_id)
+                self.memory_hits += 1
+                return entry[1]
+
+        if self.roll is not None:
+            embedding = self.roll.get(voter_id, version)
+            if embedding is not None:
+                self._remember(voter_id, version, embedding)
+                self.roll_hits += 1
+                return embedding
+
+        file_path = self._file_path(voter_id)
+        if file_path.exists():
+            try:
+                with np.load(file_path, allow_pickle=False) as data:
+                    if str(data["voter_id"]) == str(voter_id) and str(data["version"]) == version:
+                        embedding = data["embedding"].astype(np.float32)
+                        self._remember(voter_id, version, embedding)
+                        self.disk_hits += 1
+                        return embedding
+            except Exception as e:
+                logger.error(f"Error reading cached embedding {file_path}: {e}")
+
+        self.misses += 1
+        return None
+
+    def put(self, voter_id, version, embedding):
+        """Store an embedding in both tiers"""
+        embedding = np.asarray(embedding, dtype=np.float32)
+        self._remember(voter_id, version, embedding)
+
+        file_path = self._file_path(voter_id)
+        tmp_path = file_path.with_name(f"{file_path.stem}.{os.getpid()}.{threading.get_ident()}.tmp.npz")
+        try:
+            np.savez(tmp_path, voter_id=str(voter_id), version=version, embedding=embedding)
+            # Atomic replace so readers never see a partially written file
+            os.replace(tmp_path, file_path)
+        except Exception as e:
+            logger.error(f"Error writing cached embedding {file_path}: {e}")
+            if tmp_path.exists():
+                tmp_path.unlink()
+
+    def pin(self, voter_id):
+        """
+        Keep a voter's embedding in memory, out of LRU eviction, until unpin is called
+
+        Pins are counted, so a voter can be pinned by several overlapping time slots.
+        An embedding stored or read while the voter is pinned goes to the pinned tier.
+        """
+        with self._lock:
+            self._pins[voter_id] = self._pins.get(voter_id, 0) + 1
+            entry = self._memory.pop(voter_id, None)
+            if entry is not None:
+                self._pinned[voter_id] = entry
+
+    def unpin(self, voter_id):
+        """Release a pin; the embedding leaves memory with the last pin (the disk tier keeps it)"""
+        with self._lock:
+            count = self._pins.get(voter_id, 0) - 1
+            if count > 0:
+                self._pins[voter_id] = count
+                return
+            self._pins.pop(voter_id, None)
+            self._pinned.pop(voter_id, None)
+
+    def invalidate(self, voter_id, remove_file=True):
+        """
+        Drop a voter's embedding from every tier
+
+        Args:
+            voter_id: Voter whose embedding is dropped
+            remove_file: Also delete the disk tier file; workers sharing the directory
+                only need one of them to do it
+        """
+        with self._lock:
+            self._memory.pop(voter_id, None)
+            self._pinned.pop(voter_id, None)
+        if self.roll is not None:
+            self.roll.invalidate(voter_id)
+        if remove_file:
+            self._file_path(voter_id).unlink(missing_ok=True)
+
+    def iter_embeddings(self, newer_than=None):
+        """
+        Yield (voter_id, version, embedding) for every embedding in the disk tier
+
+        Args:
+            newer_than: Optional timestamp; only files modified after it are read
+        """
+        for file_path in embedding_files(self.directory):
+            try:
+                if newer_than is not None and file_path.stat().st_mtime <= newer_than:
+                    continue
+                with np.load(file_path, allow_pickle=False) as data:
+                    yield str(data["voter_id"]), str(data["version"]), data["embedding"].astype(np.float32)
+            except Exception as e:
+                logger.error(f"Error reading cached embedding {file_path}: {e}")
+
+    def stats(self):
+        """Return cache occupancy and hit counters"""
+        return {
+            "memory_entries": len(self._memory),
+            "memory_size": self.memory_size,
+            "pinned_entries": len(self._pinned),
+            "memory_hits": self.memory_hits,
+            "roll_hits": self.roll_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses
+        }
+
+
+def publish_embedding_roll(store, directory, dtype="float16"):
+    """
+    Pack every embedding in the store's disk tier into a new voter roll and publish it
+
+    The matrix is written through a memory map, so memory use stays flat however
+    large the roll is. Readers switch over when the manifest is atomically replaced.
+
+    Returns:
+        Number of voters in the published roll
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    started = time.perf_counter()
+    created_at = time.time()
+    generation = f"{int(created_at * 1000)}-{os.getpid()}"
+    matrix_name = f"roll-{generation}.npy"
+    ids_name = f"roll-{generation}.ids.json"
+
+    files = sorted(embedding_files(store.directory))
+    matrix = None
+    voter_ids = []
+    for file_path in files:
+        try:
+            with np.load(file_path, allow_pickle=False) as data:
+                voter_id, version = str(data["voter_id"]), str(data["version"])
+                embedding = data["embedding"].astype(np.float32)
+        except Exception as e:
+            logger.error(f"Skipping unreadable embedding {file_path}: {e}")
+            continue
+        if matrix is None:
+            matrix = np.lib.format.open_memmap(
+                directory / matrix_name, mode="w+", dtype=dtype, shape=(len(files), embedding.shape[0])
+            )
+        # Rows are stored L2-normalized so they can be searched directly
+        matrix[len(voter_ids)] = embedding / max(float(np.linalg.norm(embedding)), 1e-10)
+        voter_ids.append([voter_id, version])
+
+    if matrix is None:
+        logger.info("No embeddings to publish")
+        return 0
+    matrix.flush()
+    if len(voter_ids) < len(files):
+        # Some files could not be read: copy the loaded rows into a matrix of the right size
+        full_name = f"roll-{generation}.full.npy"
+        del matrix
+        os.replace(directory / matrix_name, directory / full_name)
+        full = np.load(directory / full_name, mmap_mode="r")
+        matrix = np.lib.format.open_memmap(
+            directory / matrix_name, mode="w+", dtype=dtype, shape=(len(voter_ids), full.shape[1])
+        )
+        for start in range(0, len(voter_ids), 65536):
+            matrix[start:start + 65536] = full[start:min(start + 65536, len(voter_ids))]
+        matrix.flush()
+        del full
+        (directory / full_name).unlink()
+    del matrix
+
+    with open(directory / ids_name, "w") as f:
+        json.dump(voter_ids, f)
+
+    manifest = {
+        "generation": generation,
+        "matrix": matrix_name,
+        "ids": ids_name,
+        "count": len(voter_ids),
+        "dtype": dtype,
+        "created_at": created_at
+    }
+    tmp_manifest = directory / f"{ROLL_MANIFEST}.{generation}.tmp"
+    with open(tmp_manifest, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_manifest, directory / ROLL_MANIFEST)
+
+    # Keep the previous generation for workers that are switching over right now
+    generations = sorted({path.name.split(".")[0] for path in directory.glob("roll-*")})
+    for old_generation in generations[:-2]:
+        for path in directory.glob(f"{old_generation}.*"):
+            path.unlink()
+
+    logger.info(f"Published voter roll with {len(voter_ids)} embeddings in {time.perf_counter() - started:.2f}s")
+    return len(voter_ids)
+
+
+class SharedEmbeddingRoll:
+    """Read-only, memory-mapped view of the latest published voter roll"""
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        self.generation = None
+        self.created_at = None
+        self.matrix = None
+        self.voter_ids = []
+        self._rows = {}
+        # Voters invalidated since the mapped roll was published: {voter_id: time.time() of invalidation}
+        self._tombstones = {}
+        self._tombstones_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.voter_ids)
+
+    def invalidate(self, voter_id):
+        """Stop serving a voter's embedding from this roll until a roll published later is mapped"""
+        with self._tombstones_lock:
+            self._tombstones[voter_id] = time.time()
+
+    def tombstones(self):
+        """Voter IDs whose rows in the mapped roll are stale"""
+        with self._tombstones_lock:
+            return set(self._tombstones)
+
+    def refresh(self):
+        """
+        Map the latest published roll
+
+        Returns:
+            True if a new generation was loaded
+        """
+        try:
+            with open(self.directory / ROLL_MANIFEST) as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            return False
+        if manifest["generation"] == self.generation:
+            return False
+
+        matrix = np.load(self.directory / manifest["matrix"], mmap_mode="r")
+        with open(self.directory / manifest["ids"]) as f:
+            entries = json.load(f)
+
+        # Swap in the new generation in one go; readers holding the old matrix keep it mapped
+        self._rows = {voter_id: (row, version) for row, (voter_id, version) in enumerate(entries)}
+        self.voter_ids = [voter_id for voter_id, _ in entries]
+        self.matrix = matrix
+        self.generation = manifest["generation"]
+        self.created_at = manifest["created_at"]
+        # A roll published after an invalidation was built without the dropped embedding
+        with self._tombstones_lock:
+            self._tombstones = {
+                voter_id: invalidated_at
+                for voter_id, invalidated_at in self._tombstones.items()
+                if invalidated_at >= self.created_at
+            }
+        logger.info(f"Mapped voter roll {self.generation} with {len(entries)} embeddings")
+        return True
+
+    def get(self, voter_id, version):
+        """Return the embedding for this voter and photo version, or None"""
+        entry = self._rows.get(voter_id)
+        if entry is None or entry[1] != version or voter_id in self._tombstones:
+            return None
+        return np.array(self.matrix[entry[0]], dtype=np.float32)
+
+    def stats(self):
+        return {
+            "generation": self.generation,
+            "voters": len(self.voter_ids),
+            "invalidated": len(self._tombstones)
+        }
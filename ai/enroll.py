@@ -0,0 +1,294 @@
+"""
+Bulk pre-enrollment of voter reference embeddings.
+
+Fetches voters' photos from the voter database API with bounded concurrency, detects
+and embeds the faces across the inference workers, and writes the results to the
+reference embedding store. Running it before polling day takes all reference
+processing off the verification hot path.
+
+Progress is appended to a JSONL checkpoint file, so an interrupted run can be resumed
+without re-processing voters that were already enrolled.
+
+Usage:
+    python enroll.py voter_ids.txt
+    cat voter_ids.txt | python enroll.py - --workers 8 --concurrency 32
+    python enroll.py --publish-only
+"""
+import argparse
+import asyncio
+import json
+import logging
+import sys
+import time
+from pathlib import Path
+
+import face_pipeline
+from embedding_store import ReferenceEmbeddingStore, photo_version, publish_embedding_roll
+from inference_pool import InferencePool
+from settings import (
+    EMBEDDINGS_DIR, REFERENCE_CACHE_SIZE, INFERENCE_WORKERS, VOTER_API_URL,
+    EMBEDDING_ROLL_DIR, EMBEDDING_ROLL_DTYPE, CASCADE_MODEL
+)
+from voter_api import VoterApiClient
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_NAME = "enroll-checkpoint.jsonl"
+
+
+class EnrollmentProgress:
+    """Counters and throughput of an enrollment run"""
+
+    def __init__(self):
+        self.submitted = 0
+        self.enrolled = 0
+        self.skipped = 0
+        self.failed = 0
+        self.started_at = time.time()
+        self.finished_at = None
+        self.errors = []
+
+    @property
+    def processed(self):
+        return self.enrolled + self.skipped + self.failed
+
+    @property
+    def elapsed(self):
+        return (self.finished_at or time.time()) - self.started_at
+
+    def to_dict(self):
+        return {
+            "submitted": self.submitted,
+            "processed": self.processed,
+            "enrolled": self.enrolled,
+            "skipped": self.skipped,
+            "failed": self.failed,
+            "elapsed_seconds": round(self.elapsed, 2),
+            "voters_per_second": round(self.processed / self.elapsed, 2) if self.elapsed else 0,
+            "finished": self.finished_at is not None,
+            "recent_errors": self.errors[-20:]
+        }
+
+
+def load_checkpoint(checkpoint_path):
+    """Return the voter IDs a previous run already enrolled"""
+    done = set()
+    if checkpoint_path and Path(checkpoint_path).exists():
+        with open(checkpoint_path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A line cut short by an interrupted run
+                    continue
+                if record.get("status") in ("enrolled", "skipped"):
+                    done.add(record["voter_id"])
+    return done
+
+
+async def enroll_voter(voter_id, voter_api, pool, store, cascade_store=None):
+    """
+    Prepare and store the reference embedding of one voter
+
+    Args:
+        cascade_store: Optional store for the embedding of the fast cascade model
+
+    Returns:
+        Tuple of (status, main model embedding or None), status being "enrolled" or "skipped"
+    """
+    voter_image_url = await voter_api.get_voter_image_url(voter_id)
+    if not voter_image_url:
+        raise ValueError(f"Could not retrieve image for voter ID: {voter_id}")
+
+    version = photo_version(voter_image_url)
+    stores = {face_pipeline.MODEL_NAME: store}
+    if cascade_store is not None:
+        stores[CASCADE_MODEL] = cascade_store
+    missing = [model_name for model_name, model_store in stores.items() if model_store.get(voter_id, version) is None]
+    if not missing:
+        return "skipped", None
+
+    reference_bytes = await voter_api.download_image(voter_image_url)
+    if not reference_bytes:
+        raise ValueError(f"Could not download reference image for voter ID: {voter_id}")
+
+    embeddings = await pool.run(face_pipeline.embed_reference_models, reference_bytes, missing)
+    for model_name, embedding in embeddings.items():
+        stores[model_name].put(voter_id, version, embedding)
+    return "enrolled", embeddings.get(face_pipeline.MODEL_NAME)
+
+
+async def enroll_voters(
+    voter_ids,
+    voter_api,
+    pool,
+    store,
+    cascade_store=None,
+    concurrency=16,
+    checkpoint_path=None,
+    progress=None,
+    on_enrolled=None,
+    log_interval=10
+):
+    """
+    Enroll a list or stream of voter IDs
+
+    Args:
+        voter_ids: Iterable of voter IDs (consumed lazily)
+        voter_api: VoterApiClient used to fetch voter photos
+        pool: InferencePool running detection and embedding
+        store: ReferenceEmbeddingStore receiving the embeddings
+        cascade_store: Optional ReferenceEmbeddingStore for the fast cascade model's embeddings
+        concurrency: Number of voters processed at the same time
+        checkpoint_path: JSONL file recording finished voters, used to resume
+        progress: Optional EnrollmentProgress updated while running
+        on_enrolled: Optional callback(voter_id, embedding) for each new embedding
+        log_interval: Seconds between progress log lines
+
+    Returns:
+        The EnrollmentProgress of the run
+    """
+    progress = progress or EnrollmentProgress()
+    done = load_checkpoint(checkpoint_path)
+    if done:
+        logger.info(f"Resuming enrollment, {len(done)} voters already enrolled")
+
+    checkpoint = open(checkpoint_path, "a") if checkpoint_path else None
+    queue = asyncio.Queue(maxsize=concurrency * 2)
+    last_log = time.monotonic()
+
+    def record(voter_id, status, error=None):
+        nonlocal last_log
+        if checkpoint:
+            entry = {"voter_id": voter_id, "status": status}
+            if error:
+                entry["error"] = error
+            checkpoint.write(json.dumps(entry) + "\n")
+            checkpoint.flush()
+        if time.monotonic() - last_log >= log_interval:
+            last_log = time.monotonic()
+            stats = progress.to_dict()
+            logger.info(
+                f"Enrollment progress: {stats['processed']}/{stats['submitted']} processed, "
+                f"{stats['enrolled']} enrolled, {stats['skipped']} skipped, {stats['failed']} failed "
+                f"({stats['voters_per_second']} voters/s)"
+            )
+
+    async def worker():
+        while True:
+            voter_id = await queue.get()
+            if voter_id is None:
+                return
+            try:
+                status, embedding = await enroll_voter(voter_id, voter_api, pool, store, cascade_store)
+                if status == "enrolled":
+                    progress.enrolled += 1
+                    if on_enrolled and embedding is not None:
+                        on_enrolled(voter_id, embedding)
+                else:
+                    progress.skipped += 1
+                record(voter_id, status)
+            except Exception as e:
+                progress.failed += 1
+                progress.errors.append({"voter_id": voter_id, "error": str(e)})
+                logger.error(f"Error enrolling voter ID {voter_id}: {str(e)}")
+                record(voter_id, "failed", str(e))
+
+    workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+    try:
+        for voter_id in voter_ids:
+            voter_id = str(voter_id).strip()
+            if not voter_id or voter_id in done:
+                continue
+            done.add(voter_id)
+            progress.submitted += 1
+            await queue.put(voter_id)
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers)
+    finally:
+        for task in workers:
+            task.cancel()
+        if checkpoint:
+            checkpoint.close()
+        progress.finished_at = time.time()
+
+    stats = progress.to_dict()
+    logger.info(
+        f"Enrollment finished: {stats['enrolled']} enrolled, {stats['skipped']} skipped, "
+        f"{stats['failed']} failed in {stats['elapsed_seconds']}s ({stats['voters_per_second']} voters/s)"
+    )
+    return progress
+
+
+def read_voter_ids(source):
+    """Yield voter IDs from a file (one per line) or stdin"""
+    f = sys.stdin if source == "-" else open(source)
+    try:
+        for line in f:
+            if line.strip():
+                yield line.strip()
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+async def main(args):
+    store = ReferenceEmbeddingStore(args.embeddings_dir, memory_size=REFERENCE_CACHE_SIZE)
+    if args.publish_only:
+        publish_embedding_roll(store, args.roll_dir, args.roll_dtype)
+        return 0
+    if not args.voter_ids:
+        print("A voter ID file (or - for stdin) is required unless --publish-only is given")
+        return 2
+
+    cascade_store = None
+    if CASCADE_MODEL:
+        cascade_store = ReferenceEmbeddingStore(Path(args.embeddings_dir) / "cascade" / CASCADE_MODEL, memory_size=REFERENCE_CACHE_SIZE)
+
+    voter_api = VoterApiClient(base_url=args.voter_api_url, pool_per_host=args.concurrency)
+    pool = InferencePool(mode=args.executor, workers=args.workers)
+    checkpoint_path = None if args.no_checkpoint else Path(args.checkpoint or Path(args.embeddings_dir) / CHECKPOINT_NAME)
+
+    pool.start()
+    await voter_api.start()
+    try:
+        await pool.warm_up()
+        progress = await enroll_voters(
+            read_voter_ids(args.voter_ids),
+            voter_api,
+            pool,
+            store,
+            cascade_store=cascade_store,
+            concurrency=args.concurrency,
+            checkpoint_path=checkpoint_path
+        )
+    finally:
+        await voter_api.close()
+        pool.shutdown()
+
+    if progress.enrolled and not args.no_publish:
+        publish_embedding_roll(store, args.roll_dir, args.roll_dtype)
+
+    print(json.dumps(progress.to_dict(), indent=2))
+    return 1 if progress.failed else 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description="Precompute reference embeddings for a list of voters")
+    parser.add_argument("voter_ids", nargs="?", help="File with one voter ID per line, or - for stdin")
+    parser.add_argument("--concurrency", type=int, default=16, help="Voters processed at the same time")
+    parser.add_argument("--workers", type=int, default=INFERENCE_WORKERS, help="Inference worker count")
+    parser.add_argument("--executor", choices=["thread", "process"], default="process", help="Inference executor")
+    parser.add_argument("--voter-api-url", default=VOTER_API_URL, help="Base URL of the voter database API")
+    parser.add_argument("--embeddings-dir", default=str(EMBEDDINGS_DIR), help="Embedding store directory")
+    parser.add_argument("--checkpoint", help=f"Checkpoint file used to resume (default: <embeddings-dir>/{CHECKPOINT_NAME})")
+    parser.add_argument("--no-checkpoint", action="store_true", help="Do not read or write a checkpoint")
+    parser.add_argument("--roll-dir", default=str(EMBEDDING_ROLL_DIR), help="Directory of the shared voter roll")
+    parser.add_argument("--roll-dtype", choices=["float16", "float32"], default=EMBEDDING_ROLL_DTYPE, help="Voter roll storage type")
+    parser.add_argument("--no-publish", action="store_true", help="Do not publish a new voter roll after enrolling")
+    parser.add_argument("--publish-only", action="store_true", help="Only pack the stored embeddings into a new voter roll")
+
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -0,0 +1,243 @@
+"""
+Evaluate the model cascade on a labelled local face dataset.
+
+The dataset is a directory with one sub-directory of face photos per person:
+
+    dataset/
+        alice/1.jpg, alice/2.jpg, ...
+        bob/1.jpg, ...
+
+Every face is detected once and embedded with both the fast model and the main model,
+timing each step. Genuine pairs (two photos of the same person) and impostor pairs
+(two different people) are then scored with both models. For each cascade margin the
+report gives the false accept rate (FAR) and false reject rate (FRR) of the main
+model alone and of the cascade, the share of pairs escalated to the main model, and
+the resulting speedup of the embedding stage and of detection plus embedding.
+
+Usage:
+    python evaluate_cascade.py dataset/ --fast-model SFace
+    python evaluate_cascade.py dataset/ --fast-model Facenet --margins 0.05 0.1 0.2 --output cascade.json
+"""
+import argparse
+import itertools
+import json
+import logging
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+import face_pipeline
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png"}
+
+
+def load_dataset(directory):
+    """Return {person: [image paths]} for every person directory with at least one image"""
+    people = {}
+    for person_dir in sorted(path for path in Path(directory).iterdir() if path.is_dir()):
+        images = sorted(path for path in person_dir.iterdir() if path.suffix.lower() in IMAGE_EXTENSIONS)
+        if images:
+            people[person_dir.name] = images
+    return people
+
+
+def embed_dataset(people, model_names):
+    """
+    Detect every face once and embed it with each model
+
+    Returns:
+        Tuple of ({model: {path: embedding}}, {step: [seconds per image]}, [failed paths])
+    """
+    embeddings = {model_name: {} for model_name in model_names}
+    timings = {"detection": [], **{model_name: [] for model_name in model_names}}
+    failures = []
+
+    for images in people.values():
+        for path in images:
+            started = time.perf_counter()
+            try:
+                face = face_pipeline.detect_face(path.read_bytes())
+            except ValueError as e:
+                logger.warning(f"Skipping {path}: {e}")
+                failures.append(str(path))
+                continue
+            timings["detection"].append(time.perf_counter() - started)
+
+            for model_name in model_names:
+                started = time.perf_counter()
+                embeddings[model_name][path] = face_pipeline.embed_faces([face], model_name)[0]
+                timings[model_name].append(time.perf_counter() - started)
+
+    return embeddings, timings, failures
+
+
+def make_pairs(people, embedded, max_impostor_pairs, seed=0):
+    """
+    Build genuine and impostor pairs of successfully embedded images
+
+    Returns:
+        Tuple of (list of (path, path) pairs, boolean array marking genuine pairs)
+    """
+    images = {person: [path for path in paths if path in embedded] for person, paths in people.items()}
+    genuine = [pair for paths in images.values() for pair in itertools.combinations(paths, 2)]
+
+    labelled = [(person, path) for person, paths in images.items() for path in paths]
+    rng = np.random.default_rng(seed)
+    impostor = set()
+    attempts = 0
+    while len(impostor) < max_impostor_pairs and attempts < max_impostor_pairs * 20:
+        attempts += 1
+        i, j = rng.choice(len(labelled), size=2, replace=False)
+        if labelled[i][0] != labelled[j][0]:
+            impostor.add(tuple(sorted((labelled[i][1], labelled[j][1]))))
+
+    pairs = genuine + sorted(impostor)
+    is_genuine = np.zeros(len(pairs), dtype=bool)
+    is_genuine[:len(genuine)] = True
+    return pairs, is_genuine
+
+
+def pair_distances(embeddings, pairs):
+    """Cosine distances of every pair, from L2-normalized embeddings"""
+    first = np.stack([embeddings[a] for a, _ in pairs])
+    second = np.stack([embeddings[b] for _, b in pairs])
+    return 1 - np.sum(first * second, axis=1)
+
+
+def error_rates(accepted, is_genuine):
+    """Return (FAR, FRR) of a set of decisions"""
+    far = float(accepted[~is_genuine].mean()) if (~is_genuine).any() else 0.0
+    frr = float((~accepted[is_genuine]).mean()) if is_genuine.any() else 0.0
+    return far, frr
+
+
+def evaluate(fast_distances, main_distances, is_genuine, fast_threshold, main_threshold, margins, seconds):
+    """
+    Compare the main model alone with the cascade at each margin
+
+    Args:
+        seconds: Mean seconds per image for "detection", "fast" and "main"
+
+    Returns:
+        Report dict
+    """
+    main_accepted = main_distances <= main_threshold
+    main_far, main_frr = error_rates(main_accepted, is_genuine)
+    fast_far, fast_frr = error_rates(fast_distances <= fast_threshold, is_genuine)
+
+    results = []
+    for margin in margins:
+        clear = np.abs(fast_distances - fast_threshold) > margin * fast_threshold
+        accepted = np.where(clear, fast_distances <= fast_threshold, main_accepted)
+        far, frr = error_rates(accepted, is_genuine)
+        escalated = 1 - float(clear.mean())
+        cascade_seconds = seconds["fast"] + escalated * seconds["main"]
+        results.append({
+            "margin": margin,
+            "far": far,
+            "frr": frr,
+            "escalated": escalated,
+            "decisions_changed": int((accepted != main_accepted).sum()),
+            "embedding_speedup": seconds["main"] / cascade_seconds,
+            "pipeline_speedup": (seconds["detection"] + seconds["main"]) / (seconds["detection"] + cascade_seconds)
+        })
+
+    return {
+        "pairs": {"genuine": int(is_genuine.sum()), "impostor": int((~is_genuine).sum())},
+        "thresholds": {"fast": fast_threshold, "main": main_threshold},
+        "seconds_per_image": seconds,
+        "main_model": {"far": main_far, "frr": main_frr},
+        "fast_model": {"far": fast_far, "frr": fast_frr},
+        "cascade": results
+    }
+
+
+def print_report(report, fast_model, main_model):
+    seconds = report["seconds_per_image"]
+    print(f"Pairs: {report['pairs']['genuine']} genuine, {report['pairs']['impostor']} impostor")
+    print(
+        f"Mean time per image: detection {seconds['detection'] * 1000:.1f} ms, "
+        f"{fast_model} {seconds['fast'] * 1000:.1f} ms, {main_model} {seconds['main'] * 1000:.1f} ms"
+    )
+    print(f"{main_model} alone: FAR {report['main_model']['far']:.4%}  FRR {report['main_model']['frr']:.4%}")
+    print(f"{fast_model} alone: FAR {report['fast_model']['far']:.4%}  FRR {report['fast_model']['frr']:.4%}")
+    print()
+    print(f"{'margin':>8} {'FAR':>9} {'FRR':>9} {'escalated':>10} {'changed':>8} {'embed x':>8} {'pipeline x':>11}")
+    for row in report["cascade"]:
+        print(
+            f"{row['margin']:>8.2f} {row['far']:>9.4%} {row['frr']:>9.4%} {row['escalated']:>10.1%} "
+            f"{row['decisions_changed']:>8} {row['embedding_speedup']:>8.2f} {row['pipeline_speedup']:>11.2f}"
+        )
+
+
+def main(args):
+    people = load_dataset(args.dataset)
+    if len(people) < 2:
+        print("The dataset needs at least two people, each in their own directory")
+        return 2
+
+    main_model = face_pipeline.MODEL_NAME
+    model_names = [args.fast_model, main_model]
+
+    # Build and warm up both models so the first image is not timed with graph construction
+    for model_name in model_names:
+        face_pipeline.embed_faces([np.zeros((224, 224, 3), dtype=np.float32)], model_name)
+
+    embeddings, timings, failures = embed_dataset(people, model_names)
+    if failures:
+        logger.warning(f"No face detected in {len(failures)} images, they are left out")
+
+    pairs, is_genuine = make_pairs(people, embeddings[main_model], args.max_impostor_pairs, args.seed)
+    if not is_genuine.any() or is_genuine.all():
+        print("Not enough images to build both genuine and impostor pairs")
+        return 2
+
+    seconds = {
+        "detection": float(np.mean(timings["detection"])),
+        "fast": float(np.mean(timings[args.fast_model])),
+        "main": float(np.mean(timings[main_model]))
+    }
+    report = evaluate(
+        pair_distances(embeddings[args.fast_model], pairs),
+        pair_distances(embeddings[main_model], pairs),
+        is_genuine,
+        face_pipeline.find_threshold(args.fast_model),
+        face_pipeline.find_threshold(main_model),
+        args.margins,
+        seconds
+    )
+    report.update({
+        "dataset": str(args.dataset),
+        "fast_model": args.fast_model,
+        "main_model": main_model,
+        "people": len(people),
+        "images_skipped": failures
+    })
+
+    print_report(report, args.fast_model, main_model)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nSaved report to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description="Measure speedup and accuracy of the model cascade")
+    parser.add_argument("dataset", help="Directory with one sub-directory of face photos per person")
+    parser.add_argument("--fast-model", default="SFace", help="Fast DeepFace model scoring pairs first")
+    parser.add_argument(
+        "--margins", type=float, nargs="+", default=[0.0, 0.05, 0.1, 0.15, 0.2, 0.3],
+        help="Cascade margins to evaluate, as fractions of the fast model's threshold"
+    )
+    parser.add_argument("--max-impostor-pairs", type=int, default=20000, help="Impostor pairs sampled")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for impostor pair sampling")
+    parser.add_argument("--output", help="Write the report as JSON to this file")
+
+    sys.exit(main(parser.parse_args()))
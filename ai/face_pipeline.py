@@ -0,0 +1,331 @@
+"""
+Face detection, embedding and comparison helpers built on DeepFace.
+
+DeepFace.verify() detects, aligns and embeds both images on every call. Splitting
+those steps apart lets the API embed a voter's reference photo once and reuse the
+vector, so a verification only has to embed the uploaded face.
+
+DeepFace is imported on first use because importing it pulls in TensorFlow, which
+takes seconds; the API preloads it in the background at startup instead.
+"""
+import logging
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+import image_quality
+from settings import (
+    IMAGE_MAX_SIDE, IMAGE_REDUCED_DECODE, MIN_SHARPNESS, MIN_BRIGHTNESS, MAX_BRIGHTNESS, MIN_FACE_SIZE,
+    CASCADE_MODEL, INFERENCE_BACKEND, ONNX_MODEL_DIR, ONNX_INT8, INFERENCE_THREADS
+)
+
+logger = logging.getLogger(__name__)
+
+MODEL_NAME = "VGG-Face"
+DETECTOR_BACKEND = "opencv"
+DISTANCE_METRIC = "cosine"
+ANTI_SPOOFING_MODEL = "Fasnet"
+
+_DeepFace = None
+_models_ready = False
+# DeepFace caches one OpenCV CascadeClassifier per process and detectMultiScale is not
+# thread-safe, so inference threads take turns detecting (processes have their own)
+_detector_lock = threading.Lock()
+
+
+class NoFaceDetected(ValueError):
+    """
+    No face could be detected in an image
+
+    The message keeps DeepFace.verify's wording, so the HTTP API maps it like any other
+    detection failure; callers that need to tell it apart check the type.
+    """
+
+
+def _deepface():
+    """Import DeepFace (and TensorFlow) on first use"""
+    global _DeepFace
+    if _DeepFace is None:
+        started = time.perf_counter()
+        from deepface import DeepFace
+        _DeepFace = DeepFace
+        logger.info(f"Imported DeepFace in {time.perf_counter() - started:.2f}s")
+    return _DeepFace
+
+
+def _embedding_model(model_name):
+    """Recognition model of the configured inference backend"""
+    if INFERENCE_BACKEND == "onnx":
+        import onnx_backend
+        return onnx_backend.load_embedding_model(ONNX_MODEL_DIR, model_name, ONNX_INT8, INFERENCE_THREADS)
+    return _deepface().build_model(model_name)
+
+
+def _spoofing_model():
+    """Anti-spoofing model of the configured inference backend"""
+    if INFERENCE_BACKEND == "onnx":
+        import onnx_backend
+        return onnx_backend.load_spoofing_model(ONNX_MODEL_DIR, ONNX_INT8, INFERENCE_THREADS)
+    return _deepface().build_model(ANTI_SPOOFING_MODEL, task="spoofing")
+
+
+def decode_image(data):
+    """Decode encoded image bytes (JPEG, PNG, ...) into a BGR numpy array, scaled down to IMAGE_MAX_SIDE"""
+    return image_quality.decode_image(data, max_side=IMAGE_MAX_SIDE, reduced_decode=IMAGE_REDUCED_DECODE)
+
+
+def detect_face(img, anti_spoofing=False, label="img1_path", check_quality=False):
+    """
+    Detect and align the face in an image
+
+    Args:
+        img: Encoded image bytes, image path or BGR numpy array
+        anti_spoofing: Reject the image if the detected face looks spoofed
+        label: Name used in error messages ("img1_path" for the upload, "img2_path" for the reference)
+        check_quality: Reject blurry, badly exposed images and small faces before the heavy models run
+
+    Returns:
+        The aligned face crop of the largest detected face (RGB, scaled to [0, 1])
+    """
+    return detect_face_timed(img, anti_spoofing, label, check_quality)[0]
+
+
+def detect_face_timed(img, anti_spoofing=False, label="img1_path", check_quality=False):
+    """
+    Same as detect_face, also reporting where the time went
+
+    Anti-spoofing runs the same check extract_faces(anti_spoofing=True) does, on the
+    original image for every detected face, but as a separate step so it can be timed.
+
+    Returns:
+        Tuple of (face crop, {"preprocessing": seconds, "face_detection": seconds, "anti_spoofing": seconds})
+    """
+    face, img, facial_areas, timings = detect_probe(img, label, check_quality)
+    if anti_spoofing:
+        started = time.perf_counter()
+        check_spoofing(img, facial_areas)
+        timings["anti_spoofing"] = time.perf_counter() - started
+    return face, timings
+
+
+def detect_probe(img, label="img1_path", check_quality=True):
+    """
+    Detect and align the face in an image, leaving anti-spoofing to the caller
+
+    The staged verification pipeline runs check_spoofing on the returned image and
+    facial areas concurrently with embedding the returned face crop.
+
+    Returns:
+        Tuple of (face crop of the largest face, decoded BGR image, facial areas of every detected face,
+        {"preprocessing": seconds, "face_detection": seconds})
+    """
+    started = time.perf_counter()
+    try:
+        if isinstance(img, (bytes, bytearray, memoryview)):
+            img = decode_image(img)
+        elif isinstance(img, np.ndarray):
+            img = image_quality.downscale(img, IMAGE_MAX_SIDE)
+        else:
+            img = decode_image(Path(img).read_bytes())
+    except ValueError as err:
+        raise ValueError(f"Exception while processing {label}") from err
+    if check_quality:
+        image_quality.check_image_quality(img, MIN_SHARPNESS, MIN_BRIGHTNESS, MAX_BRIGHTNESS)
+    prepared = time.perf_counter()
+    timings = {"preprocessing": prepared - started}
+
+    try:
+        with _detector_lock:
+            face_objs = _deepface().extract_faces(
+                img_path=img,
+                detector_backend=DETECTOR_BACKEND,
+                enforce_detection=True,
+                align=True
+            )
+    except ValueError as err:
+        # Same wording as DeepFace.verify so the API keeps classifying errors the same way
+        error_type = NoFaceDetected if "could not be detected" in str(err).lower() else ValueError
+        raise error_type(f"Exception while processing {label}") from err
+    face_obj = max(face_objs, key=lambda obj: obj["facial_area"]["w"] * obj["facial_area"]["h"])
+    if check_quality and MIN_FACE_SIZE:
+        image_quality.check_face_size(face_obj["facial_area"], MIN_FACE_SIZE)
+    timings["face_detection"] = time.perf_counter() - prepared
+
+    return face_obj["face"], img, [obj["facial_area"] for obj in face_objs], timings
+
+
+def check_spoofing(img, facial_areas):
+    """
+    Run the anti-spoofing model on every detected face of an image
+
+    Raises:
+        ValueError: If any face looks spoofed
+    """
+    spoofing_model = _spoofing_model()
+    for area in facial_areas:
+        is_real, _ = spoofing_model.analyze(img=img, facial_area=(area["x"], area["y"], area["w"], area["h"]))
+        if not is_real:
+            raise ValueError("Spoof detected in given image.")
+
+
+def embed_faces(faces, model_name=MODEL_NAME, model=None):
+    """
+    Compute embeddings for a list of aligned face crops in a single forward pass
+
+    Args:
+        faces: Face crops as returned by detect_face
+        model_name: DeepFace recognition model to use
+        model: Model instance to run instead of the configured backend's (used by the parity check)
+
+    Returns:
+        List of L2-normalized embedding vectors (float32)
+    """
+    from deepface.modules import preprocessing
+
+    if model is None:
+        model = _embedding_model(model_name)
+    target_size = model.input_shape
+
+    batch = []
+    for face in faces:
+        # extract_faces returns RGB, DeepFace.represent flips it back before the model
+        img = face[:, :, ::-1]
+        img = preprocessing.resize_image(img=img, target_size=(target_size[1], target_size[0]))
+        img = preprocessing.normalize_input(img=img, normalization="base")
+        batch.append(img)
+
+    if hasattr(model, "forward_batch"):
+        embeddings = np.asarray(model.forward_batch(np.concatenate(batch)), dtype=np.float32)
+    elif hasattr(model.model, "predict"):
+        embeddings = np.asarray(model.model(np.concatenate(batch), training=False), dtype=np.float32)
+    else:
+        # Models that are not Keras models (e.g. SFace, run by OpenCV) embed one face at a time
+        embeddings = np.asarray([np.ravel(model.forward(img)) for img in batch], dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return list(embeddings / np.maximum(norms, 1e-10))
+
+
+def embed_reference(img):
+    """Detect and embed the face in a voter's reference photo (trusted, so not checked for spoofing)"""
+    return embed_faces([detect_face(img, label="img2_path")])[0]
+
+
+def embed_reference_models(img, model_names):
+    """
+    Detect the face in a voter's reference photo once and embed it with several models
+
+    Returns:
+        Dict of {model name: embedding}
+    """
+    face = detect_face(img, label="img2_path")
+    return {model_name: embed_faces([face], model_name)[0] for model_name in model_names}
+
+
+def embed_probe(img):
+    """Detect and embed the face in an uploaded image, checking it for spoofing"""
+    return embed_faces([detect_face(img, anti_spoofing=True, label="img1_path", check_quality=True)])[0]
+
+
+def find_threshold(model_name=MODEL_NAME):
+    """Return the distance threshold below which two faces are the same person"""
+    from deepface.modules import verification
+
+    return verification.find_threshold(model_name, DISTANCE_METRIC)
+
+
+def compare_embeddings(probe_embedding, reference_embedding, model_name=MODEL_NAME):
+    """
+    Compare two embeddings with cosine distance
+
+    Args:
+        probe_embedding: Embedding of the uploaded face
+        reference_embedding: Embedding of the reference face, from the same model
+        model_name: Model both embeddings come from, which sets the threshold
+
+    Returns:
+        Dict with the same keys DeepFace.verify reports
+    """
+    probe = np.asarray(probe_embedding, dtype=np.float32)
+    reference = np.asarray(reference_embedding, dtype=np.float32)
+    similarity = np.dot(probe, reference) / (np.linalg.norm(probe) * np.linalg.norm(reference))
+    distance = float(1 - similarity)
+    threshold = find_threshold(model_name)
+
+    return {
+        "verified": distance <= threshold,
+        "distance": distance,
+        "threshold": threshold,
+        "model": model_name,
+        "detector_backend": DETECTOR_BACKEND,
+        "similarity_metric": DISTANCE_METRIC
+    }
+
+
+def is_clear_decision(result, margin):
+    """
+    Whether a comparison is far enough from its threshold to be trusted without a second model
+
+    Args:
+        result: Comparison from compare_embeddings
+        margin: Half-width of the uncertain band, as a fraction of the threshold
+    """
+    return abs(result["distance"] - result["threshold"]) > margin * result["threshold"]
+
+
+def preload_libraries():
+    """Import DeepFace and TensorFlow without running any model"""
+    _deepface()
+
+
+def load_models():
+    """Build the recognition, detection and anti-spoofing models"""
+    import cv2
+
+    # The OpenCV detector gets the same per-call thread budget as the models
+    cv2.setNumThreads(INFERENCE_THREADS)
+    DeepFace = _deepface()
+    _embedding_model(MODEL_NAME)
+    if CASCADE_MODEL:
+        _embedding_model(CASCADE_MODEL)
+    DeepFace.build_model(DETECTOR_BACKEND, task="face_detector")
+    _spoofing_model()
+
+
+def warm_up():
+    """Run a synthetic inference through every model so graphs are built before real traffic"""
+    frame = np.zeros((480, 640, 3), dtype=np.uint8)
+    with _detector_lock:
+        _deepface().extract_faces(
+            img_path=frame,
+            detector_backend=DETECTOR_BACKEND,
+            enforce_detection=False,
+            align=True
+        )
+    _spoofing_model().analyze(img=frame, facial_area=(220, 140, 200, 200))
+    embed_faces([np.zeros((224, 224, 3), dtype=np.float32)])
+    if CASCADE_MODEL:
+        embed_faces([np.zeros((224, 224, 3), dtype=np.float32)], CASCADE_MODEL)
+
+
+def prepare_models():
+    """
+    Load and warm up every model once per process
+
+    Returns:
+        Seconds spent, or 0 if the models were already prepared
+    """
+    global _models_ready
+    if _models_ready:
+        return 0.0
+
+    started = time.perf_counter()
+    load_models()
+    loaded = time.perf_counter()
+    warm_up()
+    finished = time.perf_counter()
+    _models_ready = True
+
+    logger.info(f"Loaded models in {loaded - started:.2f}s, warm-up inference took {finished - loaded:.2f}s")
+    return finished - started
@@ -0,0 +1,128 @@
+"""
+Cheap image pre-processing run before the face models.
+
+Phone and webcam uploads arrive at full resolution, while the detector and the
+recognition model only need a few hundred pixels. Images are scaled down to a
+maximum side as they are decoded (JPEGs are decoded at 1/2, 1/4 or 1/8 scale by
+libjpeg directly when that is still large enough), then checked for blur and
+exposure with a couple of OpenCV passes, so unusable images are rejected in
+milliseconds instead of after detection, anti-spoofing and embedding.
+"""
+import cv2
+import numpy as np
+
+# Decode flags for libjpeg's DCT-domain downscaling, by reduction factor
+_REDUCED_DECODE_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8
+}
+
+# JPEG start-of-frame markers, which carry the image dimensions
+_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+class ImageQualityError(ValueError):
+    """Raised when an image is rejected before inference"""
+
+
+def jpeg_size(data):
+    """Read (width, height) from a JPEG header without decoding it, or None if not a JPEG"""
+    if data[:2] != b"\xff\xd8":
+        return None
+    i = 2
+    while i + 9 < len(data):
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF:
+            # Fill byte before a marker
+            i += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+            # Markers without a length field
+            i += 2
+            continue
+        if marker in _SOF_MARKERS:
+            height = int.from_bytes(data[i + 5:i + 7], "big")
+            width = int.from_bytes(data[i + 7:i + 9], "big")
+            return width, height
+        i += 2 + int.from_bytes(data[i + 2:i + 4], "big")
+    return None
+
+
+def decode_image(data, max_side=None, reduced_decode=True):
+    """
+    Decode encoded image bytes into a BGR numpy array no larger than max_side
+
+    Args:
+        data: Encoded image bytes (JPEG, PNG, ...)
+        max_side: Longest side of the returned image in pixels, None to keep the original size
+        reduced_decode: Let libjpeg decode large JPEGs at a reduced scale
+
+    Returns:
+        The decoded BGR image
+    """
+    flags = cv2.IMREAD_COLOR
+    if max_side and reduced_decode:
+        size = jpeg_size(data)
+        if size is not None:
+            factor = 1
+            while factor < 8 and max(size) / (factor * 2) >= max_side:
+                factor *= 2
+            flags = _REDUCED_DECODE_FLAGS[factor]
+
+    img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), flags)
+    if img is None:
+        raise ValueError("Image data could not be decoded")
+    return downscale(img, max_side)
+
+
+def downscale(img, max_side):
+    """Shrink an image so its longest side is at most max_side pixels"""
+    height, width = img.shape[:2]
+    if not max_side or max(height, width) <= max_side:
+        return img
+    scale = max_side / max(height, width)
+    return cv2.resize(img, (max(1, round(width * scale)), max(1, round(height * scale))), interpolation=cv2.INTER_AREA)
+
+
+def check_image_quality(img, min_sharpness=0, min_brightness=0, max_brightness=255):
+    """
+    Reject blurry, underexposed or overexposed images
+
+    Sharpness is the variance of the Laplacian of the grayscale image: low values mean
+    few edges, i.e. a blurred or out-of-focus photo. Brightness is the mean gray level.
+
+    Raises:
+        ImageQualityError: If a check fails
+    """
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+
+    brightness = float(gray.mean())
+    if brightness < min_brightness:
+        raise ImageQualityError(f"Image is too dark (brightness {brightness:.0f}, minimum {min_brightness:.0f})")
+    if brightness > max_brightness:
+        raise ImageQualityError(f"Image is overexposed (brightness {brightness:.0f}, maximum {max_brightness:.0f})")
+
+    if min_sharpness:
+        sharpness = float(cv2.Laplacian(gray, cv2.CV_64F).var())
+        if sharpness < min_sharpness:
+            raise ImageQualityError(f"Image is too blurry (sharpness {sharpness:.1f}, minimum {min_sharpness:.1f})")
+
+
+def check_face_size(facial_area, min_face_size):
+    """
+    Reject faces too small to be recognized reliably
+
+    Args:
+        facial_area: Detected face box with "w" and "h" in pixels
+        min_face_size: Smallest accepted face side in pixels
+
+    Raises:
+        ImageQualityError: If the face is smaller than min_face_size
+    """
+    face_size = min(facial_area["w"], facial_area["h"])
+    if face_size < min_face_size:
+        raise ImageQualityError(f"Face is too small ({face_size} px, minimum {min_face_size} px)")
@@ -0,0 +1,85 @@
+"""
+Bounded worker pool for running the face models off the event loop.
+
+DeepFace calls are CPU-bound and block for the whole TensorFlow forward pass. Running
+them in a pool lets the API keep accepting uploads, answering healthchecks and
+downloading reference images for other voters while inference is in progress.
+"""
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import face_pipeline
+
+logger = logging.getLogger(__name__)
+
+
+class InferencePool:
+    """Thread or process pool that async handlers await for model work"""
+
+    def __init__(self, mode="thread", workers=1):
+        if mode not in ("thread", "process"):
+            raise ValueError(f"Unknown inference executor: {mode}")
+        self.mode = mode
+        self.workers = workers
+        self._executor = None
+        self.in_flight = 0
+        self.completed = 0
+
+    def start(self):
+        """Create the underlying executor"""
+        if self._executor is not None:
+            return
+        if self.mode == "process":
+            # Spawn instead of fork: TensorFlow is not fork-safe once it has been imported
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=face_pipeline.prepare_models
+            )
+        else:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.workers,
+                thread_name_prefix="inference"
+            )
+        logger.info(f"Started {self.mode} inference pool with {self.workers} workers")
+
+    async def warm_up(self):
+        """Load and warm up the models in the workers before real traffic arrives"""
+        # Thread workers share one copy of the models, process workers each load their own
+        calls = self.workers if self.mode == "process" else 1
+        await asyncio.gather(*(self.run(face_pipeline.prepare_models) for _ in range(calls)))
+
+    def shutdown(self):
+        """Stop the executor, waiting for running work to finish"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    @property
+    def queue_depth(self):
+        """Number of submitted calls waiting for a free worker"""
+        return max(0, self.in_flight - self.workers)
+
+    async def run(self, fn, *args):
+        """Run fn(*args) in the pool and await its result"""
+        if self._executor is None:
+            self.start()
+        loop = asyncio.get_running_loop()
+        self.in_flight += 1
+        try:
+            return await loop.run_in_executor(self._executor, fn, *args)
+        finally:
+            self.in_flight -= 1
+            self.completed += 1
+
+    def stats(self):
+        """Return pool size and load"""
+        return {
+            "mode": self.mode,
+            "workers": self.workers,
+            "in_flight": self.in_flight,
+            "queue_depth": self.queue_depth,
+            "completed": self.completed
+        }
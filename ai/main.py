@@ -1,34 +1,151 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException, Form
-from fastapi.responses import JSONResponse
+import time
+
+_import_started = time.perf_counter()
+
+from fastapi import FastAPI, File, UploadFile, HTTPException, Form, Header, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, Response
+from starlette.requests import ClientDisconnect
 from fastapi.middleware.cors import CORSMiddleware
 import uvicorn
-from deepface import DeepFace
-import numpy as np
-import cv2
 import os
 import logging
 import base64
-import aiohttp
+import hashlib
+import hmac
+import json
+import math
 import asyncio
-from pathlib import Path
-import aiofiles
+import signal
+import socket
 import sys
+import uuid
+
+import face_pipeline
+import metrics
+from admission import AdmissionController, AdmittedPool, Overloaded
+from coalescing import ResultCache, SingleFlight
+from embedding_batcher import EmbeddingBatcher
+from embedding_index import EmbeddingIndex
+from embedding_store import ReferenceEmbeddingStore, SharedEmbeddingRoll, photo_version, publish_embedding_roll
+from enroll import EnrollmentProgress, enroll_voters
+from inference_pool import InferencePool
+from profiler import ProfilerBusy, SamplingProfiler, format_collapsed
+from slot_prefetch import SlotPrefetcher, schedule_loader
+from voter_api import VoterApiClient
+from worker_state import InvalidationLog, read_job_status, write_job_status
+from settings import (
+    ROOT_DIR, TEMP_DIR, EMBEDDINGS_DIR, REFERENCE_CACHE_SIZE,
+    INFERENCE_EXECUTOR, INFERENCE_WORKERS, EMBEDDING_BATCH_SIZE, EMBEDDING_BATCH_WAIT_MS,
+    VOTER_API_URL, VOTER_API_POOL_SIZE, VOTER_API_POOL_PER_HOST, VOTER_API_DNS_CACHE_TTL,
+    VOTER_API_KEEPALIVE, VOTER_API_CONNECT_TIMEOUT, VOTER_API_TIMEOUT,
+    VOTER_CACHE_TTL, VOTER_CACHE_SIZE, IMAGE_CACHE_TTL, IMAGE_CACHE_MAX_BYTES,
+    RESULT_DEDUP_TTL, IDENTIFY_INDEX_DTYPE, IDENTIFY_BLOCK_SIZE, IDENTIFY_IVF_THRESHOLD, IDENTIFY_NPROBE,
+    ENROLL_CONCURRENCY, EMBEDDING_ROLL_DIR, EMBEDDING_ROLL_DTYPE, EMBEDDING_ROLL_REFRESH, API_WORKERS,
+    WORKER_STATE_DIR, WORKER_SYNC_INTERVAL,
+    ADMISSION_MAX_CONCURRENCY, ADMISSION_QUEUE_SIZE, ADMISSION_DEADLINE, ENROLL_ADMISSION_SHARE, MAX_UPLOAD_BYTES,
+    SESSION_TIMEOUT, SESSION_MAX_FRAMES, CASCADE_MODEL, CASCADE_MARGIN,
+    INFERENCE_BACKEND, ONNX_INT8, INFERENCE_THREADS,
+    SLOT_SCHEDULE_SOURCE, SLOT_SCHEDULE_TOKEN, SLOT_PREFETCH_LEAD_TIME, SLOT_SCHEDULE_REFRESH, SLOT_PREFETCH_CONCURRENCY,
+    BATCH_VERIFY_CONCURRENCY, SERVER_TIMING, ADMIN_TOKEN, PROFILE_MAX_SECONDS
+)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Define application root directory for consistent path resolution
-ROOT_DIR = Path(os.path.dirname(os.path.abspath(__file__)))
+logger.info(f"Imported API modules in {time.perf_counter() - _import_started:.2f}s")
 logger.info(f"Application root directory: {ROOT_DIR}")
 
-# Define temp directory
-TEMP_DIR = ROOT_DIR / "temp"
-
 # Create temp directory if it doesn't exist
 TEMP_DIR.mkdir(exist_ok=True)
 logger.info(f"Temp directory: {TEMP_DIR}")
 
+# Reference embeddings are computed once per voter photo and reused across requests
+# The published voter roll is memory-mapped read-only and shared by every worker process
+embedding_roll = SharedEmbeddingRoll(EMBEDDING_ROLL_DIR)
+reference_store = ReferenceEmbeddingStore(EMBEDDINGS_DIR, memory_size=REFERENCE_CACHE_SIZE, roll=embedding_roll)
+logger.info(f"Reference embedding store: {EMBEDDINGS_DIR}")
+
+# With a model cascade, reference embeddings of the fast model are stored alongside
+reference_stores = {face_pipeline.MODEL_NAME: reference_store}
+if CASCADE_MODEL:
+    reference_stores[CASCADE_MODEL] = ReferenceEmbeddingStore(
+        EMBEDDINGS_DIR / "cascade" / CASCADE_MODEL,
+        memory_size=REFERENCE_CACHE_SIZE
+    )
+    logger.info(f"Model cascade: {CASCADE_MODEL} first, {face_pipeline.MODEL_NAME} within {CASCADE_MARGIN:.0%} of the threshold")
+
+# Every enrolled reference embedding, searched by /api/identify
+identify_index = EmbeddingIndex(
+    dtype=IDENTIFY_INDEX_DTYPE,
+    block_size=IDENTIFY_BLOCK_SIZE,
+    ivf_threshold=IDENTIFY_IVF_THRESHOLD,
+    nprobe=IDENTIFY_NPROBE
+)
+index_tasks = set()
+
+# Model inference runs in a worker pool so it never blocks the event loop
+inference_pool = InferencePool(mode=INFERENCE_EXECUTOR, workers=INFERENCE_WORKERS)
+
+# Face crops from concurrent requests are embedded together in batched model calls
+embedding_batcher = EmbeddingBatcher(
+    inference_pool,
+    max_batch_size=EMBEDDING_BATCH_SIZE,
+    max_wait_ms=EMBEDDING_BATCH_WAIT_MS
+)
+embedding_batchers = {face_pipeline.MODEL_NAME: embedding_batcher}
+if CASCADE_MODEL:
+    embedding_batchers[CASCADE_MODEL] = EmbeddingBatcher(
+        inference_pool,
+        max_batch_size=EMBEDDING_BATCH_SIZE,
+        max_wait_ms=EMBEDDING_BATCH_WAIT_MS,
+        model_name=CASCADE_MODEL
+    )
+
+# One keep-alive connection pool to the voter database API for the whole app
+voter_api = VoterApiClient(
+    base_url=VOTER_API_URL,
+    pool_size=VOTER_API_POOL_SIZE,
+    pool_per_host=VOTER_API_POOL_PER_HOST,
+    dns_cache_ttl=VOTER_API_DNS_CACHE_TTL,
+    keepalive_timeout=VOTER_API_KEEPALIVE,
+    connect_timeout=VOTER_API_CONNECT_TIMEOUT,
+    timeout=VOTER_API_TIMEOUT,
+    voter_cache_ttl=VOTER_CACHE_TTL,
+    voter_cache_size=VOTER_CACHE_SIZE,
+    image_cache_ttl=IMAGE_CACHE_TTL,
+    image_cache_max_bytes=IMAGE_CACHE_MAX_BYTES
+)
+
+# Concurrent requests for the same voter share one reference preparation
+reference_flights = SingleFlight()
+
+# Identical retries (same voter, same image bytes) reuse the earlier result
+result_cache = ResultCache(RESULT_DEDUP_TTL)
+
+# Model-bound requests are admitted through a bounded, deadline-aware queue;
+# healthchecks and result cache hits bypass it
+admission = AdmissionController(
+    max_concurrency=ADMISSION_MAX_CONCURRENCY,
+    max_queue=ADMISSION_QUEUE_SIZE,
+    deadline=ADMISSION_DEADLINE
+)
+
+# Bulk enrollment jobs share the inference pool with verifications through admission control
+enrollment_pool = AdmittedPool(inference_pool, admission, ENROLL_ADMISSION_SHARE)
+
+# Reference embeddings of each voting slot's voters are prepared and pinned before the slot opens
+# (with several workers only the first prepares them, see startup_event), admitted like enrollment
+prefetch_pool = AdmittedPool(inference_pool, admission, SLOT_PREFETCH_CONCURRENCY)
+slot_prefetcher = SlotPrefetcher(
+    load_schedule=schedule_loader(SLOT_SCHEDULE_SOURCE, voter_api, SLOT_SCHEDULE_TOKEN),
+    prepare=lambda voter_id: prefetch_pool.call(prepare_reference, voter_id),
+    stores=reference_stores.values(),
+    lead_time=SLOT_PREFETCH_LEAD_TIME,
+    refresh=SLOT_SCHEDULE_REFRESH,
+    concurrency=SLOT_PREFETCH_CONCURRENCY
+) if SLOT_SCHEDULE_SOURCE else None
+
 # Create FastAPI app with increased file size limits
 app = FastAPI(
     title="SmartBallot Face Verification API",
@@ -43,6 +160,39 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Per-request stage breakdown in a Server-Timing response header
+if SERVER_TIMING:
+    app.add_middleware(metrics.ServerTimingMiddleware)
+
+# Sampling profiler started on demand through /admin/profile
+profiler = SamplingProfiler()
+
+# Load gauges, read at scrape time
+metrics.track_gauge("face_api_admission_in_flight", "Requests holding an admission slot", lambda: admission.stats()["in_flight"])
+metrics.track_gauge("face_api_admission_queue_depth", "Requests waiting for an admission slot", lambda: admission.queue_depth)
+metrics.track_gauge("face_api_inference_in_flight", "Calls running or queued in the inference pool", lambda: inference_pool.in_flight)
+metrics.track_gauge("face_api_inference_queue_depth", "Calls waiting for a free inference worker", lambda: inference_pool.queue_depth)
+metrics.track_gauge("face_api_embedding_batch_pending", "Face crops waiting for the next embedding batch", lambda: embedding_batcher.stats()["pending"])
+metrics.track_gauge("face_api_reference_flights", "Reference preparations in flight", lambda: len(reference_flights))
+
+# Background bulk enrollment jobs started through /api/enroll; their status is also written to
+# ENROLLMENT_JOBS_DIR so a poll answered by another worker finds them
+enrollment_jobs = {}
+ENROLLMENT_JOBS_DIR = WORKER_STATE_DIR / "enroll-jobs"
+
+# Index of this process among the pre-forked workers (set after the fork)
+worker_index = 0
+
+# With several workers, invalidations are passed on to the others through a shared log
+invalidation_log = InvalidationLog(WORKER_STATE_DIR / "invalidations.log") if API_WORKERS > 1 else None
+
+# Readiness of the models, reported by /readyz
+readiness = {
+    "status": "starting",
+    "startup_seconds": None,
+    "details": None
+}
+
 def cleanup_temp_files():
     """Clean up temporary files periodically"""
     try:
@@ -60,16 +210,138 @@ def cleanup_temp_files():
     except Exception as e:
         logger.error(f"Error cleaning temp directory: {e}")
 
+async def warm_up_models():
+    """Preload and warm up the models, then mark the API as ready"""
+    started = time.perf_counter()
+    readiness["status"] = "warming_up"
+    try:
+        await inference_pool.warm_up()
+    except Exception as e:
+        logger.error(f"Model warm-up failed: {str(e)}")
+        readiness["status"] = "failed"
+        readiness["details"] = str(e)
+        return
+    readiness["startup_seconds"] = time.perf_counter() - started
+    readiness["status"] = "ready"
+    logger.info(f"Models preloaded and warmed up in {readiness['startup_seconds']:.2f}s, API is ready")
+
+async def train_identify_index():
+    """Train the IVF index in a background thread if the voter roll has grown enough"""
+    if identify_index.needs_training:
+        await asyncio.to_thread(identify_index.train)
+
+def schedule_identify_index_training():
+    """Start background index training unless it is already running"""
+    if not index_tasks and identify_index.needs_training:
+        task = asyncio.create_task(train_identify_index())
+        index_tasks.add(task)
+        task.add_done_callback(identify_index_training_done)
+
+def identify_index_training_done(task):
+    """Forget a finished training task and log why it failed, if it did"""
+    index_tasks.discard(task)
+    if task.cancelled():
+        return
+    error = task.exception()
+    if error is not None:
+        logger.error(f"Error training the identification index: {str(error)}")
+
+async def load_identify_index():
+    """Load the voter roll and any newer stored embeddings into the identification index"""
+    started = time.perf_counter()
+    await asyncio.to_thread(embedding_roll.refresh)
+    if embedding_roll.matrix is not None:
+        identify_index.load_base(embedding_roll.voter_ids, embedding_roll.matrix, embedding_roll.tombstones())
+    # Embeddings stored since the roll was published (all of them if there is no roll)
+    await asyncio.to_thread(
+        identify_index.add_many,
+        (
+            (voter_id, embedding)
+            for voter_id, _, embedding in reference_store.iter_embeddings(newer_than=embedding_roll.created_at)
+        )
+    )
+    logger.info(f"Loaded {len(identify_index)} embeddings into the identification index in {time.perf_counter() - started:.2f}s")
+    await train_identify_index()
+
+async def watch_embedding_roll():
+    """Switch to a newly published voter roll without restarting"""
+    while True:
+        await asyncio.sleep(EMBEDDING_ROLL_REFRESH)
+        try:
+            if await asyncio.to_thread(embedding_roll.refresh):
+                await asyncio.to_thread(
+                    identify_index.load_base, embedding_roll.voter_ids, embedding_roll.matrix, embedding_roll.tombstones()
+                )
+                schedule_identify_index_training()
+        except Exception as e:
+            logger.error(f"Error refreshing voter roll: {str(e)}")
+
+def drop_cached_voter(voter_id, remove_files=True):
+    """
+    Drop everything this worker caches for a voter
+    
+    Args:
+        voter_id: The voter ID whose cached data should be dropped
+        remove_files: Also delete the embedding files shared by every worker; only the
+            worker that received the invalidation does it
+    """
+    voter_api.invalidate(voter_id)
+    for store in reference_stores.values():
+        store.invalidate(voter_id, remove_file=remove_files)
+    result_cache.invalidate(voter_id)
+    identify_index.remove(voter_id)
+
+async def sync_workers():
+    """Apply cache invalidations made by the other workers and publish this worker's load gauges"""
+    while True:
+        await asyncio.sleep(WORKER_SYNC_INTERVAL)
+        try:
+            voter_ids = await asyncio.to_thread(invalidation_log.poll)
+        except Exception as e:
+            logger.error(f"Error reading invalidations from the other workers: {str(e)}")
+            voter_ids = []
+        # The log offset has already moved past these, so one failure must not lose the rest
+        for voter_id in voter_ids:
+            try:
+                logger.info(f"Invalidating cached data for voter ID {voter_id} (requested on another worker)")
+                drop_cached_voter(voter_id, remove_files=False)
+            except Exception as e:
+                logger.error(f"Error invalidating cached data for voter ID {voter_id}: {str(e)}")
+        try:
+            metrics.refresh_gauges()
+        except Exception as e:
+            logger.error(f"Error publishing worker load gauges: {str(e)}")
+
 @app.on_event("startup")
 async def startup_event():
     """Initialize app on startup"""
     logger.info("Starting Face Verification API")
     cleanup_temp_files()
+    inference_pool.start()
+    await voter_api.start()
+    # Warm up in the background so /healthcheck answers while /readyz reports not ready
+    app.state.warm_up_task = asyncio.create_task(warm_up_models())
+    app.state.index_task = asyncio.create_task(load_identify_index())
+    app.state.roll_task = asyncio.create_task(watch_embedding_roll())
+    if invalidation_log is not None:
+        app.state.sync_task = asyncio.create_task(sync_workers())
+    if slot_prefetcher is not None:
+        if worker_index > 0:
+            # The first worker downloads and embeds each slot's references into the shared disk
+            # tier; the others only pin them, loading them from disk on first use
+            slot_prefetcher.prepare = None
+        app.state.prefetch_task = asyncio.create_task(slot_prefetcher.run())
 
 @app.on_event("shutdown")
 async def shutdown_event():
     """Clean up on shutdown"""
     logger.info("Shutting down Face Verification API")
+    if slot_prefetcher is not None:
+        app.state.prefetch_task.cancel()
+    if invalidation_log is not None:
+        app.state.sync_task.cancel()
+    await voter_api.close()
+    inference_pool.shutdown()
     cleanup_temp_files()
 
 @app.get("/healthcheck")
@@ -81,86 +353,505 @@ async def healthcheck():
             "name": "SmartBallot Face Verification API",
             "directories": {
                 "root": str(ROOT_DIR),
-                "temp": str(TEMP_DIR)
-            }
+                "temp": str(TEMP_DIR),
+                "embeddings": str(EMBEDDINGS_DIR)
+            },
+            "reference_cache": reference_store.stats(),
+            "cascade_reference_cache": reference_stores[CASCADE_MODEL].stats() if CASCADE_MODEL else None,
+            "inference": inference_pool.stats(),
+            "inference_backend": {
+                "backend": INFERENCE_BACKEND,
+                "int8": INFERENCE_BACKEND == "onnx" and ONNX_INT8,
+                "threads": INFERENCE_THREADS
+            },
+            "embedding_batches": [batcher.stats() for batcher in embedding_batchers.values()],
+            "voter_api": voter_api.stats(),
+            "reference_flights": reference_flights.stats(),
+            "result_cache": result_cache.stats(),
+            "admission": admission.stats(),
+            "identify_index": identify_index.stats(),
+            "embedding_roll": embedding_roll.stats(),
+            "slot_prefetch": slot_prefetcher.stats() if slot_prefetcher is not None else None
         }
     }
 
-async def download_image(url, file_path):
-    """Download an image from a URL and save it to a file path"""
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Per-stage latency histograms, error counters and load gauges in the Prometheus text format"""
+    body, content_type = metrics.render()
+    return Response(content=body, media_type=content_type)
+
+@app.get("/readyz")
+async def readyz():
+    """Readiness probe: only succeeds once the models are loaded and warmed up"""
+    content = {
+        "status": readiness["status"],
+        "startup_seconds": readiness["startup_seconds"]
+    }
+    if readiness["details"]:
+        content["details"] = readiness["details"]
+    return JSONResponse(
+        status_code=200 if readiness["status"] == "ready" else 503,
+        content=content
+    )
+
+@app.post("/api/cache/invalidate/{voter_id}")
+async def invalidate_voter_cache(voter_id: str):
+    """
+    Drop everything cached for a voter, e.g. after the backend replaced their photo
+    
+    Args:
+        voter_id: The voter ID whose cached photo URL, image and embedding should be dropped
+        
+    Returns:
+        JSON confirming the invalidation
+    """
+    logger.info(f"Invalidating cached data for voter ID: {voter_id}")
+    drop_cached_voter(voter_id)
+    if invalidation_log is not None:
+        # The other workers drop their copies within WORKER_SYNC_INTERVAL
+        await asyncio.to_thread(invalidation_log.publish, voter_id)
+    return {
+        "success": True,
+        "voter_id": voter_id,
+        "message": "Cached voter data invalidated."
+    }
+
+@app.post("/admin/profile")
+async def profile(seconds: float = 10, interval_ms: float = 5, x_admin_token: str = Header(None)):
+    """
+    Sample the stacks of every thread of this worker for a while and return them collapsed
+    
+    Requires the ADMIN_TOKEN in the X-Admin-Token header. The output is one
+    "thread;outer;...;inner count" line per distinct stack, ready for flamegraph.pl
+    or speedscope.
+    
+    Args:
+        seconds: How long to sample, at most PROFILE_MAX_SECONDS
+        interval_ms: Milliseconds between samples
+        
+    Returns:
+        Collapsed stacks as text/plain
+    """
+    if not ADMIN_TOKEN:
+        return error_response(
+            status_code=404,
+            content={
+                "success": False,
+                "error": "Not found",
+                "message": "Admin endpoints are disabled; set ADMIN_TOKEN to enable them."
+            }
+        )
+    if not x_admin_token or not hmac.compare_digest(x_admin_token.encode(), ADMIN_TOKEN.encode()):
+        return error_response(
+            status_code=403,
+            content={
+                "success": False,
+                "error": "Forbidden",
+                "message": "A valid X-Admin-Token header is required."
+            }
+        )
+    if not 0 < seconds <= PROFILE_MAX_SECONDS or not 1 <= interval_ms <= 1000:
+        return error_response(
+            status_code=400,
+            content={
+                "success": False,
+                "error": "Invalid parameter",
+                "message": f"seconds must be between 0 and {PROFILE_MAX_SECONDS:g}, interval_ms between 1 and 1000."
+            }
+        )
+    
+    logger.info(f"Sampling profile started for {seconds:g}s every {interval_ms:g} ms")
     try:
-        async with aiohttp.ClientSession() as session:
-            try:
-                async with session.get(url, timeout=5) as response:
-                    if response.status != 200:
-                        logger.error(f"Error downloading image. Status: {response.status}, URL: {url}")
-                        return False
-                    
-                    content = await response.read()
-                    
-                    async with aiofiles.open(file_path, 'wb') as f:
-                        await f.write(content)
-                    
-                    return True
-            except aiohttp.ClientConnectorError:
-                logger.error(f"Failed to connect to image server at {url}. The service may be down.")
-                return False
-            except aiohttp.ClientError as e:
-                logger.error(f"HTTP client error when downloading image: {str(e)}")
-                return False
-            except asyncio.TimeoutError:
-                logger.error(f"Timeout when downloading image from {url}")
-                return False
-    except Exception as e:
-        logger.error(f"Error downloading image from {url}: {str(e)}")
-        return False
+        samples, stacks = await asyncio.to_thread(profiler.profile, seconds, interval_ms / 1000)
+    except ProfilerBusy as e:
+        return error_response(
+            status_code=409,
+            content={
+                "success": False,
+                "error": "Profile already running",
+                "message": str(e)
+            }
+        )
+    return Response(
+        content=format_collapsed(stacks),
+        media_type="text/plain",
+        headers={"X-Profile-Samples": str(samples), "X-Profile-Pid": str(os.getpid())}
+    )
+
+def error_response(status_code, content, headers=None):
+    """Build an error response and count it by error class"""
+    metrics.count_error(content["error"])
+    return JSONResponse(status_code=status_code, content=content, headers=headers)
 
-async def get_voter_image_url(voter_id):
-    """Get the image URL for a voter from the voter database API"""
+def verification_error_response(error_message):
+    """Map a face verification error to the API's error response"""
+    # Check for spoofing detection
+    if ("spoofed image" in error_message.lower() or 
+        "fake face" in error_message.lower() or
+        "spoof detected" in error_message.lower()):
+        logger.warning(f"Explicit spoofing detected: {error_message}")
+        return error_response(
+            status_code=400,
+            content={
+                "success": False,
+                "error": "Spoofing detected",
+                "message": "Please use a real face image, not a photo of a display or printed image.",
+                "details": error_message
+            }
+        )
+    
+    # Images rejected by the quality checks before inference
+    elif "too blurry" in error_message.lower():
+        return error_response(
+            status_code=400,
+            content={
+                "success": False,
+                "error": "Image too blurry",
+                "message": "The image is too blurry. Please hold the camera still and try again.",
+                "details": error_message
+            }
+        )
+    elif "too dark" in error_message.lower() or "overexposed" in error_message.lower():
+        return error_response(
+            status_code=400,
+            content={
+                "success": False,
+                "error": "Poor lighting",
+                "message": "The image is too dark or too bright. Please retake it in even lighting.",
+                "details": error_message
+            }
+        )
+    elif "face is too small" in error_message.lower():
+        return error_response(
+            status_code=400,
+            content={
+                "success": False,
+                "error": "Face too small",
+                "message": "The face is too small in the image. Please move closer to the camera.",
+                "details": error_message
+            }
+        )
+    
+    # Handle exceptions related to processing in the uploaded image (likely spoofing)
+    elif "exception while processing img1_path" in error_message.lower():
+        logger.warning(f"Potential spoofing detected in uploaded image: {error_message}")
+        return error_response(
+            status_code=400,
+            content={
+                "success": False,
+                "error": "Potential spoofing detected",
+                "message": "The system detected potential spoofing in the uploaded image.",
+                "details": error_message
+            }
+        )
+    
+    # Handle exceptions related to processing in the reference image
+    elif "exception while processing img2_path" in error_message.lower():
+        logger.warning(f"Issue with reference image: {error_message}")
+        return error_response(
+            status_code=400,
+            content={
+                "success": False,
+                "error": "Reference image issue",
+                "message": "There is an issue with the stored reference image.",
+                "details": error_message
+            }
+        )
+    
+    # Common face detection errors
+    elif "face could not be detected" in error_message.lower():
+        return error_response(
+            status_code=400,
+            content={
+                "success": False,
+                "error": "No face detected",
+                "message": "No face detected in one or both images. Please provide a clear image with a visible face.",
+                "details": error_message
+            }
+        )
+    elif "more than one face" in error_message.lower():
+        return error_response(
+            status_code=400,
+            content={
+                "success": False,
+                "error": "Multiple faces detected",
+                "message": "Multiple faces detected in the image. Please provide an image with only one face.",
+                "details": error_message
+            }
+        )
+    else:
+        return error_response(
+            status_code=400,
+            content={
+                "success": False,
+                "error": "Verification failed",
+                "message": "Face verification process failed.",
+                "details": error_message
+            }
+        )
+
+def overloaded_response(error):
+    """Tell the client the server is busy and when to retry"""
+    logger.warning(f"Rejected request: {error.reason} (retry after {error.retry_after}s)")
+    return error_response(
+        status_code=503,
+        headers={"Retry-After": str(error.retry_after)},
+        content={
+            "success": False,
+            "error": "Server busy",
+            "message": f"Too many verifications in progress. Please retry in {error.retry_after} seconds.",
+            "details": error.reason,
+            "retry_after": error.retry_after
+        }
+    )
+
+def request_deadline(request):
+    """Deadline of a request, optionally shortened by the client's X-Request-Timeout header (seconds)"""
     try:
-        # Fetch voter data from the API
-        voter_api_url = f"http://localhost:9001/api/voters/id/{voter_id}"
-        logger.info(f"Fetching voter data from: {voter_api_url}")
+        timeout = float(request.headers["X-Request-Timeout"])
+    except (KeyError, ValueError):
+        timeout = None
+    if timeout is not None and not (math.isfinite(timeout) and timeout > 0):
+        # nan, inf and non-positive values would disable or break the deadline check
+        timeout = None
+    return admission.deadline_from(timeout)
+
+class ReferenceUnavailable(Exception):
+    """Raised when the reference embedding of a voter cannot be prepared"""
+    
+    def __init__(self, error, details):
+        super().__init__(details)
+        self.error = error
+        self.details = details
+
+async def prepare_reference(voter_id):
+    """
+    Look up a voter's photo and return the embeddings of their reference face
+    
+    Concurrent calls for the same voter share one lookup, download and embedding.
+    
+    Returns:
+        Dict of {model name: reference embedding}, one per model of the cascade
+    
+    Raises:
+        ReferenceUnavailable: If the voter or their reference image could not be fetched
+    """
+    return await reference_flights.do(voter_id, lambda: _prepare_reference(voter_id))
+
+async def _prepare_reference(voter_id):
+    # Fetch reference image URL from voter database API
+    with metrics.time_stage("voter_api_lookup"):
+        voter_image_url = await voter_api.get_voter_image_url(voter_id)
+    if not voter_image_url:
+        raise ReferenceUnavailable("Voter not found", f"Could not retrieve image for voter ID: {voter_id}")
+    
+    # Reference embeddings are only computed on a cache miss
+    version = photo_version(voter_image_url)
+    references = {model_name: store.get(voter_id, version) for model_name, store in reference_stores.items()}
+    missing = [model_name for model_name, embedding in references.items() if embedding is None]
+    if not missing:
+        logger.info(f"Using cached reference embedding for voter ID: {voter_id}")
+        return references
+    
+    logger.info(f"Fetching reference image from: {voter_image_url}")
+    
+    with metrics.time_stage("reference_download"):
+        reference_bytes = await voter_api.download_image(voter_image_url)
+    if not reference_bytes:
+        raise ReferenceUnavailable(
+            "Reference image unavailable",
+            f"Could not download reference image for voter ID: {voter_id}"
+        )
+    
+    logger.info(f"Reference image downloaded ({len(reference_bytes)} bytes)")
+    
+    # The reference photo comes from the voter database and is trusted, so it is not checked for spoofing
+    reference_face, timings = await inference_pool.run(face_pipeline.detect_face_timed, reference_bytes, False, "img2_path")
+    metrics.observe_stages(timings, prefix="reference_")
+    for model_name in missing:
+        stage = "reference_embedding" if model_name == face_pipeline.MODEL_NAME else "reference_cascade_embedding"
+        with metrics.time_stage(stage):
+            references[model_name] = await embedding_batchers[model_name].embed(reference_face)
+        reference_stores[model_name].put(voter_id, version, references[model_name])
+    if face_pipeline.MODEL_NAME in missing:
+        identify_index.add(voter_id, references[face_pipeline.MODEL_NAME])
+        schedule_identify_index_training()
+    return references
+
+async def verify_with_reference(voter_id, image_bytes, deadline=None, reference_tasks=None):
+    """
+    Verify an uploaded image against the reference photo of a voter
+    
+    Args:
+        voter_id: The voter ID to fetch the reference image from the voter database
+        image_bytes: Encoded bytes of the uploaded image
+        deadline: time.monotonic() by which the verification has to finish
+        reference_tasks: Dict of {voter ID: reference preparation task} shared by the items
+            of a batch, so each voter is looked up once per batch
         
-        async with aiohttp.ClientSession() as session:
-            try:
-                async with session.get(voter_api_url, timeout=5) as response:
-                    if response.status != 200:
-                        logger.error(f"Error fetching voter data. Status: {response.status}, URL: {voter_api_url}")
-                        return None
-                    
-                    voter_data = await response.json()
-                    
-                    # Extract the photo URL from the response
-                    if "photoUrl" not in voter_data:
-                        logger.error(f"No photoUrl found in voter data: {voter_data}")
-                        return None
-                    
-                    photo_url = voter_data["photoUrl"]
-                    
-                    # Construct the full URL for the image
-                    if photo_url.startswith("http"):
-                        # If it's already a full URL, use it as is
-                        return photo_url
-                    else:
-                        # Otherwise, construct the full URL
-                        return f"http://localhost:9001{photo_url}"
-            except aiohttp.ClientConnectorError:
-                logger.error(f"Failed to connect to voter API at {voter_api_url}. The service may be down.")
-                return None
-            except aiohttp.ClientError as e:
-                logger.error(f"HTTP client error when accessing voter API: {str(e)}")
-                return None
-            except asyncio.TimeoutError:
-                logger.error(f"Timeout when connecting to voter API at {voter_api_url}")
-                return None
+    Returns:
+        Response data or a JSONResponse describing the error
+    """
+    dedup_key = (voter_id, hashlib.sha256(image_bytes).hexdigest())
+    cached_result = result_cache.get(dedup_key)
+    if cached_result is not None:
+        logger.info(f"Returning earlier result for identical request for voter ID: {voter_id}")
+        return cached_result
     
+    try:
+        async with admission.admit(deadline):
+            return await _verify_with_reference(voter_id, image_bytes, dedup_key, reference_tasks)
+    except Overloaded as e:
+        return overloaded_response(e)
+
+async def _verify_with_reference(voter_id, image_bytes, dedup_key, reference_tasks=None):
+    try:
+        logger.info("Starting face verification")
+        # An unusable upload (undecodable, blurry, badly lit, no face or a too small one) is
+        # rejected before the voter lookup, reference download and reference embedding
+        probe = await detect_probe_face(image_bytes)
+        
+        try:
+            if reference_tasks is None:
+                references = await prepare_reference(voter_id)
+            else:
+                if voter_id not in reference_tasks:
+                    reference_tasks[voter_id] = asyncio.ensure_future(prepare_reference(voter_id))
+                references = await asyncio.shield(reference_tasks[voter_id])
+        except ReferenceUnavailable as e:
+            return error_response(
+                status_code=404,
+                content={
+                    "success": False,
+                    "error": e.error,
+                    "details": e.details
+                }
+            )
+        
+        response_data = await verify_probe(voter_id, image_bytes, references, probe)
+        result_cache.put(dedup_key, response_data)
+        return response_data
+        
     except Exception as e:
-        logger.error(f"Error getting voter image URL: {str(e)}")
-        return None
+        error_message = str(e)
+        logger.error(f"Face verification error: {error_message}")
+        return verification_error_response(error_message)
+
+async def gather_or_cancel(*coros):
+    """
+    Run coroutines concurrently and return their results in order
+    
+    The first one to fail cancels the others, and its exception is raised.
+    """
+    tasks = [asyncio.ensure_future(coro) for coro in coros]
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+        for task in done:
+            if task.exception() is not None:
+                raise task.exception()
+        return [task.result() for task in tasks]
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+async def check_probe_spoofing(img, facial_areas):
+    """Run anti-spoofing on the faces of an uploaded image, raising ValueError on a spoof"""
+    with metrics.time_stage("anti_spoofing"):
+        await inference_pool.run(face_pipeline.check_spoofing, img, facial_areas)
+
+async def embed_probe_face(probe_face):
+    """Embed an uploaded face crop with the main model"""
+    with metrics.time_stage("embedding"):
+        return await embedding_batcher.embed(probe_face)
+
+async def compare_probe(probe_face, references):
+    """
+    Embed an uploaded face crop and compare it with the voter's reference embeddings
+    
+    With a model cascade, the fast model decides pairs that are clearly above or below
+    its threshold; only pairs within CASCADE_MARGIN of it are embedded with the main model.
+    
+    Returns:
+        Comparison from face_pipeline.compare_embeddings
+    """
+    if CASCADE_MODEL:
+        with metrics.time_stage("cascade_embedding"):
+            cascade_embedding = await embedding_batchers[CASCADE_MODEL].embed(probe_face)
+        result = face_pipeline.compare_embeddings(cascade_embedding, references[CASCADE_MODEL], CASCADE_MODEL)
+        if face_pipeline.is_clear_decision(result, CASCADE_MARGIN):
+            metrics.count_cascade("decided")
+            return result
+        metrics.count_cascade("escalated")
+    
+    probe_embedding = await embed_probe_face(probe_face)
+    with metrics.time_stage("comparison"):
+        return face_pipeline.compare_embeddings(probe_embedding, references[face_pipeline.MODEL_NAME])
+
+async def detect_probe_face(image_bytes):
+    """
+    Decode and quality-check an uploaded image and detect its faces
+    
+    Returns:
+        Tuple of (face crop, decoded image, facial areas, timings) from face_pipeline.detect_probe
+    """
+    probe = await inference_pool.run(face_pipeline.detect_probe, image_bytes)
+    metrics.observe_stages(probe[3])
+    return probe
+
+async def verify_probe(voter_id, image_bytes, references, probe=None):
+    """
+    Detect and embed the face in an uploaded image and compare it with the reference
+    
+    The face is detected once. Anti-spoofing then runs on the probe concurrently with
+    its embedding and comparison, and a spoof verdict cancels whatever is still running.
+    
+    Args:
+        voter_id: The voter ID the reference embeddings belong to
+        image_bytes: Encoded bytes of the uploaded image
+        references: The voter's prepared reference embeddings, from prepare_reference
+        probe: Result of detect_probe_face, if the upload was already detected
+        
+    Returns:
+        Response data of the verification
+    """
+    if probe is None:
+        probe = await detect_probe_face(image_bytes)
+    probe_face, probe_img, facial_areas, _ = probe
+    
+    _, result = await gather_or_cancel(
+        check_probe_spoofing(probe_img, facial_areas),
+        compare_probe(probe_face, references)
+    )
+    metrics.count_verification(result["verified"])
+    
+    # Calculate similarity score
+    similarity_score = (1 - result["distance"]) * 100
+    
+    # Return the verification result with appropriate message
+    response_data = {
+        "success": True,
+        "verified": result["verified"],
+        "distance": result["distance"],
+        "threshold": result["threshold"],
+        "model": result["model"],
+        "detector_backend": result.get("detector_backend", "opencv"),
+        "similarity_score": similarity_score,
+        "voter_id": voter_id
+    }
+    
+    # Add appropriate message based on verification result
+    if result["verified"]:
+        response_data["message"] = "Face verification successful. Identity confirmed."
+    else:
+        response_data["message"] = "Face verification failed. This does not match the registered voter."
+    
+    return response_data
 
 @app.post("/api/verify")
 async def verify_face_with_voter_id(
+    request: Request,
     uploaded_image: UploadFile = File(...),
     voter_id: str = Form(...)
 ):
@@ -176,22 +867,15 @@ async def verify_face_with_voter_id(
     """
     logger.info(f"Face verification request received for voter ID: {voter_id}")
     
-    # Create temporary files for the images
-    upload_path = TEMP_DIR / f"uploaded_{uploaded_image.filename}"
-    ref_path = TEMP_DIR / f"reference_{voter_id}.jpg"
-    
     try:
-        # Save uploaded file
+        # Read uploaded file into memory
         try:
-            async with aiofiles.open(upload_path, "wb") as buffer:
-                # Read in chunks to handle large files
+            with metrics.time_stage("upload_read"):
                 content = await uploaded_image.read()
-                await buffer.write(content)
-                
-            logger.info(f"Saved uploaded image: {upload_path}")
+            logger.info(f"Read uploaded image: {uploaded_image.filename} ({len(content)} bytes)")
         except Exception as e:
-            logger.error(f"Error saving uploaded file: {str(e)}")
-            return JSONResponse(
+            logger.error(f"Error reading uploaded file: {str(e)}")
+            return error_response(
                 status_code=500,
                 content={
                     "success": False,
@@ -200,152 +884,14 @@ async def verify_face_with_voter_id(
                 }
             )
         
-        # Fetch reference image from voter database API
-        voter_image_url = await get_voter_image_url(voter_id)
-        if not voter_image_url:
-            return JSONResponse(
-                status_code=404,
-                content={
-                    "success": False,
-                    "error": f"Voter not found",
-                    "details": f"Could not retrieve image for voter ID: {voter_id}"
-                }
-            )
-        
-        logger.info(f"Fetching reference image from: {voter_image_url}")
-        
-        download_success = await download_image(voter_image_url, ref_path)
-        if not download_success:
-            return JSONResponse(
-                status_code=404,
-                content={
-                    "success": False,
-                    "error": "Reference image unavailable",
-                    "details": f"Could not download reference image for voter ID: {voter_id}"
-                }
-            )
-        
-        logger.info(f"Reference image downloaded and saved to: {ref_path}")
-        
-        # Verify faces using DeepFace
-        try:
-            logger.info("Starting face verification with DeepFace")
-            result = DeepFace.verify(
-                img1_path=str(upload_path),
-                img2_path=str(ref_path),
-                model_name="VGG-Face",
-                distance_metric="cosine",
-                detector_backend="opencv",
-                anti_spoofing=True
-            )
-            
-            logger.info(f"Verification result: {result}")
-            
-            # Calculate similarity score
-            similarity_score = (1 - result["distance"]) * 100
-            
-            # Return the verification result with appropriate message
-            response_data = {
-                "success": True,
-                "verified": result["verified"],
-                "distance": result["distance"],
-                "threshold": result["threshold"],
-                "model": result["model"],
-                "detector_backend": result.get("detector_backend", "opencv"),
-                "similarity_score": similarity_score,
-                "voter_id": voter_id
-            }
-            
-            # Add appropriate message based on verification result
-            if result["verified"]:
-                response_data["message"] = "Face verification successful. Identity confirmed."
-            else:
-                response_data["message"] = "Face verification failed. This does not match the registered voter."
-            
-            return response_data
-            
-        except Exception as e:
-            error_message = str(e)
-            logger.error(f"DeepFace verification error: {error_message}")
-            
-            # Check for spoofing detection
-            if ("spoofed image" in error_message.lower() or 
-                "fake face" in error_message.lower()):
-                logger.warning(f"Explicit spoofing detected: {error_message}")
-                return JSONResponse(
-                    status_code=400,
-                    content={
-                        "success": False,
-                        "error": "Spoofing detected",
-                        "message": "Please use a real face image, not a photo of a display or printed image.",
-                        "details": error_message
-                    }
-                )
-            
-            # Handle exceptions related to processing in the uploaded image (likely spoofing)
-            elif "exception while processing img1_path" in error_message.lower():
-                logger.warning(f"Potential spoofing detected in uploaded image: {error_message}")
-                return JSONResponse(
-                    status_code=400,
-                    content={
-                        "success": False,
-                        "error": "Potential spoofing detected",
-                        "message": "The system detected potential spoofing in the uploaded image.",
-                        "details": error_message
-                    }
-                )
-            
-            # Handle exceptions related to processing in the reference image
-            elif "exception while processing img2_path" in error_message.lower():
-                logger.warning(f"Issue with reference image: {error_message}")
-                return JSONResponse(
-                    status_code=400,
-                    content={
-                        "success": False,
-                        "error": "Reference image issue",
-                        "message": "There is an issue with the stored reference image.",
-                        "details": error_message
-                    }
-                )
-            
-            # Common face detection errors
-            elif "face could not be detected" in error_message.lower():
-                return JSONResponse(
-                    status_code=400,
-                    content={
-                        "success": False,
-                        "error": "No face detected",
-                        "message": "No face detected in one or both images. Please provide a clear image with a visible face.",
-                        "details": error_message
-                    }
-                )
-            elif "more than one face" in error_message.lower():
-                return JSONResponse(
-                    status_code=400,
-                    content={
-                        "success": False,
-                        "error": "Multiple faces detected",
-                        "message": "Multiple faces detected in the image. Please provide an image with only one face.",
-                        "details": error_message
-                    }
-                )
-            else:
-                return JSONResponse(
-                    status_code=400,
-                    content={
-                        "success": False,
-                        "error": "Verification failed",
-                        "message": "Face verification process failed.",
-                        "details": error_message
-                    }
-                )
+        return await verify_with_reference(voter_id, content, request_deadline(request))
         
     except Exception as e:
         if isinstance(e, HTTPException):
             # Re-raise HTTP exceptions with their status codes
             raise
         logger.error(f"Error processing images: {str(e)}")
-        return JSONResponse(
+        return error_response(
             status_code=500,
             content={
                 "success": False,
@@ -354,19 +900,10 @@ async def verify_face_with_voter_id(
                 "details": str(e)
             }
         )
-    
-    finally:
-        # Clean up temporary files
-        try:
-            if os.path.exists(upload_path):
-                os.remove(upload_path)
-            if os.path.exists(ref_path):
-                os.remove(ref_path)
-        except Exception as e:
-            logger.error(f"Error cleaning up temp files: {str(e)}")
 
 @app.post("/api/verify-base64")
 async def verify_face_base64_with_voter_id(
+    request: Request,
     uploaded_image: str = Form(...),
     voter_id: str = Form(...)
 ):
@@ -382,10 +919,6 @@ async def verify_face_base64_with_voter_id(
     """
     logger.info(f"Base64 face verification request received for voter ID: {voter_id}")
     
-    # Create temporary files for the images
-    upload_path = TEMP_DIR / f"uploaded_base64_{voter_id}.jpg"
-    ref_path = TEMP_DIR / f"reference_{voter_id}.jpg"
-    
     try:
         # Decode base64 image
         try:
@@ -393,16 +926,14 @@ async def verify_face_base64_with_voter_id(
             if uploaded_image.startswith('data:'):
                 uploaded_image = uploaded_image.split(',')[1]
                 
-            upload_bytes = base64.b64decode(uploaded_image)
+            with metrics.time_stage("base64_decode"):
+                upload_bytes = base64.b64decode(uploaded_image)
             
-            async with aiofiles.open(upload_path, "wb") as f:
-                await f.write(upload_bytes)
-                
-            logger.info(f"Decoded base64 image saved to: {upload_path}")
+            logger.info(f"Decoded base64 image ({len(upload_bytes)} bytes)")
             
         except Exception as e:
             logger.error(f"Error decoding base64 image: {str(e)}")
-            return JSONResponse(
+            return error_response(
                 status_code=400,
                 content={
                     "success": False,
@@ -412,170 +943,819 @@ async def verify_face_base64_with_voter_id(
                 }
             )
         
-        # Fetch reference image from voter database API
-        voter_image_url = await get_voter_image_url(voter_id)
-        if not voter_image_url:
-            return JSONResponse(
-                status_code=404,
+        return await verify_with_reference(voter_id, upload_bytes, request_deadline(request))
+        
+    except Exception as e:
+        if isinstance(e, HTTPException):
+            # Re-raise HTTP exceptions with their status codes
+            raise
+        logger.error(f"Error processing images: {str(e)}")
+        return error_response(
+            status_code=500,
+            content={
+                "success": False,
+                "error": "Server error",
+                "message": "An unexpected error occurred during verification.",
+                "details": str(e)
+            }
+        )
+
+# Content types accepted as a raw image body
+RAW_IMAGE_TYPES = {"image/jpeg", "image/png", "application/octet-stream"}
+
+async def read_body_limited(request, limit):
+    """
+    Read a request body into a single buffer, giving up as soon as it exceeds the limit
+    
+    Returns:
+        The body as a bytearray, or None if it is larger than the limit
+    """
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > limit:
+        return None
+    
+    buffer = bytearray()
+    async for chunk in request.stream():
+        buffer += chunk
+        if len(buffer) > limit:
+            return None
+    return buffer
+
+@app.post("/api/verify-raw")
+@app.post("/api/verify-raw/{voter_id}")
+async def verify_face_raw(
+    request: Request,
+    voter_id: str = None,
+    x_voter_id: str = Header(None)
+):
+    """
+    Verify a face sent as the raw request body (image/jpeg or application/octet-stream)
+    
+    Avoids the size and decoding overhead of multipart and base64 uploads: the body is
+    read into one buffer and decoded from it directly.
+    
+    Args:
+        voter_id: The voter ID, in the path
+        x_voter_id: The voter ID, in the X-Voter-Id header if not in the path
+        
+    Returns:
+        JSON with verification result
+    """
+    voter_id = voter_id or x_voter_id
+    if not voter_id:
+        return error_response(
+            status_code=400,
+            content={
+                "success": False,
+                "error": "Missing voter ID",
+                "message": "Pass the voter ID in the URL path or the X-Voter-Id header."
+            }
+        )
+    
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if content_type not in RAW_IMAGE_TYPES:
+        return error_response(
+            status_code=415,
+            content={
+                "success": False,
+                "error": "Unsupported media type",
+                "message": "Send the image as image/jpeg, image/png or application/octet-stream.",
+                "details": content_type or None
+            }
+        )
+    
+    logger.info(f"Raw face verification request received for voter ID: {voter_id}")
+    
+    try:
+        with metrics.time_stage("upload_read"):
+            image_bytes = await read_body_limited(request, MAX_UPLOAD_BYTES)
+        if image_bytes is None:
+            return error_response(
+                status_code=413,
                 content={
                     "success": False,
-                    "error": "Voter not found",
-                    "details": f"Could not retrieve image for voter ID: {voter_id}"
+                    "error": "Image too large",
+                    "message": f"The image must not be larger than {MAX_UPLOAD_BYTES} bytes."
                 }
             )
-        
-        logger.info(f"Fetching reference image from: {voter_image_url}")
-        
-        download_success = await download_image(voter_image_url, ref_path)
-        if not download_success:
-            return JSONResponse(
-                status_code=404,
+        if not image_bytes:
+            return error_response(
+                status_code=400,
                 content={
                     "success": False,
-                    "error": "Reference image unavailable",
-                    "details": f"Could not download reference image for voter ID: {voter_id}"
+                    "error": "Invalid image data",
+                    "message": "The request body is empty."
                 }
             )
         
-        logger.info(f"Reference image downloaded and saved to: {ref_path}")
+        return await verify_with_reference(voter_id, image_bytes, request_deadline(request))
         
-        # Verify faces using DeepFace
-        try:
-            logger.info("Starting face verification with DeepFace")
-            result = DeepFace.verify(
-                img1_path=str(upload_path),
-                img2_path=str(ref_path),
-                model_name="VGG-Face",
-                distance_metric="cosine",
-                detector_backend="opencv",
-                anti_spoofing=True
+    except Exception as e:
+        logger.error(f"Error processing images: {str(e)}")
+        return error_response(
+            status_code=500,
+            content={
+                "success": False,
+                "error": "Server error",
+                "message": "An unexpected error occurred during verification.",
+                "details": str(e)
+            }
+        )
+
+# Content types accepted as a newline-delimited JSON batch
+NDJSON_TYPES = {"application/x-ndjson", "application/jsonl"}
+
+def batch_item_error(status_code, error, message, details=None):
+    """Error response of a single batch item"""
+    return error_response(
+        status_code=status_code,
+        content={
+            "success": False,
+            "error": error,
+            "message": message,
+            "details": details
+        }
+    )
+
+def parse_batch_line(line):
+    """
+    Parse one NDJSON batch item: {"id": ..., "voter_id": ..., "image": "<base64>"}
+    
+    Returns:
+        Tuple of (item ID, voter ID, image bytes or an error JSONResponse)
+    """
+    try:
+        item = json.loads(line)
+        item_id = item.get("id")
+        voter_id = item.get("voter_id")
+        image = item.get("image")
+    except (ValueError, AttributeError) as e:
+        return None, None, batch_item_error(400, "Invalid batch item", "Each line must be a JSON object.", str(e))
+    
+    if not voter_id or not image:
+        return item_id, voter_id, batch_item_error(
+            400, "Invalid batch item", "Each line needs a voter_id and a base64 encoded image."
+        )
+    try:
+        if image.startswith('data:'):
+            image = image.split(',')[1]
+        with metrics.time_stage("base64_decode"):
+            image_bytes = base64.b64decode(image)
+    except Exception as e:
+        return item_id, voter_id, batch_item_error(
+            400, "Invalid image data", "The provided base64 image data is invalid or corrupted.", str(e)
+        )
+    if not image_bytes:
+        return item_id, voter_id, batch_item_error(400, "Invalid image data", "The image is empty.")
+    return item_id, str(voter_id), image_bytes
+
+async def read_ndjson_items(request):
+    """
+    Yield batch items from an NDJSON body line by line, as the body arrives
+    
+    A line longer than a base64 encoded MAX_UPLOAD_BYTES image is skipped and
+    reported as too large without being buffered.
+    """
+    limit = MAX_UPLOAD_BYTES * 4 // 3 + 4096
+    buffer = bytearray()
+    skipping = False
+    async for chunk in request.stream():
+        buffer += chunk
+        while True:
+            newline = buffer.find(b"\n")
+            if newline < 0:
+                break
+            line = bytes(buffer[:newline])
+            del buffer[:newline + 1]
+            if skipping:
+                # Tail of an oversized line
+                skipping = False
+            elif line.strip():
+                yield parse_batch_line(line)
+        if skipping:
+            buffer.clear()
+        elif len(buffer) > limit:
+            skipping = True
+            buffer.clear()
+            yield None, None, batch_item_error(
+                413, "Image too large", f"The image must not be larger than {MAX_UPLOAD_BYTES} bytes."
             )
+    if buffer.strip() and not skipping:
+        yield parse_batch_line(bytes(buffer))
+
+async def read_multipart_items(request):
+    """
+    Yield batch items from a multipart body of repeated voter_id and uploaded_image fields
+    
+    Each uploaded_image is paired with the voter_id (and optional id) fields sent before it.
+    Unlike NDJSON, the form is parsed as a whole: the upload is buffered (files larger
+    than 1 MB are spooled to disk) before the first item is yielded.
+    """
+    form = await request.form()
+    try:
+        async for item in _multipart_items(form):
+            yield item
+    finally:
+        await form.close()
+
+async def _multipart_items(form):
+    item_id, voter_id = None, None
+    for key, value in form.multi_items():
+        if key == "id":
+            item_id = value
+        elif key == "voter_id":
+            voter_id = value
+        elif key == "uploaded_image":
+            if not voter_id:
+                yield item_id, None, batch_item_error(
+                    400, "Invalid batch item", "Send a voter_id field before each uploaded_image."
+                )
+            elif isinstance(value, str):
+                yield item_id, voter_id, batch_item_error(400, "Invalid image data", "uploaded_image must be a file.")
+            else:
+                image_bytes = await value.read()
+                if len(image_bytes) > MAX_UPLOAD_BYTES:
+                    yield item_id, voter_id, batch_item_error(
+                        413, "Image too large", f"The image must not be larger than {MAX_UPLOAD_BYTES} bytes."
+                    )
+                else:
+                    yield item_id, voter_id, image_bytes
+            item_id, voter_id = None, None
+
+def batch_result_line(index, item_id, voter_id, result):
+    """Serialize the result of a batch item (response data or a JSONResponse) as one NDJSON line"""
+    if isinstance(result, JSONResponse):
+        status_code, content = result.status_code, json.loads(result.body)
+    else:
+        status_code, content = 200, result
+    line = {"index": index, "id": item_id, "voter_id": voter_id, "status": status_code, **content}
+    return (json.dumps(line) + "\n").encode()
+
+class BatchVerificationResponse(Response):
+    """
+    Verify batch items while the request body is read and stream their NDJSON result lines
+    
+    Starlette's StreamingResponse listens for http.disconnect on receive while it
+    streams, which would swallow the http.request messages of a body still being read.
+    This raw ASGI response owns receive instead: one task reads the body and then waits
+    for the client to go away, feeding parsed items through a bounded queue to
+    BATCH_VERIFY_CONCURRENCY workers. Reading pauses while the queue is full, and the
+    workers pause while the client does not read its results, so a large batch is never
+    held in memory. Items of the same voter share one reference preparation while any of
+    them is waiting or being verified, and concurrent items share embedding batches.
+    """
+    
+    media_type = "application/x-ndjson"
+    
+    def __init__(self, items, concurrency=BATCH_VERIFY_CONCURRENCY, lookahead=INFERENCE_WORKERS):
+        """
+        Args:
+            items: Async iterator of (item ID, voter ID, image bytes or error JSONResponse),
+                reading the request body
+            concurrency: Items verified at once
+            lookahead: Items read ahead of the workers
+        """
+        self.items = items
+        self.concurrency = max(1, concurrency)
+        self.lookahead = max(1, min(lookahead, self.concurrency))
+        self.status_code = 200
+        self.background = None
+        self.init_headers()
+    
+    async def __call__(self, scope, receive, send):
+        pending = asyncio.Queue(maxsize=self.lookahead)
+        results = asyncio.Queue(maxsize=self.concurrency)
+        disconnected = asyncio.Event()
+        reference_tasks = {}
+        # Items read but not yet verified, per voter
+        voter_items = {}
+        count = 0
+        
+        def release(voter_id):
+            # The reference task of a voter is dropped with the last item that needs it
+            voter_items[voter_id] -= 1
+            if voter_items[voter_id] == 0:
+                del voter_items[voter_id]
+                task = reference_tasks.pop(voter_id, None)
+                if task is not None:
+                    task.cancel()
+        
+        async def read_items():
+            nonlocal count
+            try:
+                async for item_id, voter_id, image in self.items:
+                    voter_items[voter_id] = voter_items.get(voter_id, 0) + 1
+                    await pending.put((count, item_id, voter_id, image))
+                    count += 1
+            except ClientDisconnect:
+                disconnected.set()
+                return
+            except Exception as e:
+                logger.error(f"Error reading verification batch: {str(e)}")
+                error = batch_item_error(400, "Invalid batch", "The batch could not be read completely.", str(e))
+                await results.put(batch_result_line(None, None, None, error))
+            for _ in range(self.concurrency):
+                await pending.put(None)
+            # The body is complete, so the next message means the client went away
+            while (await receive())["type"] != "http.disconnect":
+                pass
+            disconnected.set()
+        
+        async def verify_items():
+            while True:
+                item = await pending.get()
+                if item is None:
+                    return
+                index, item_id, voter_id, image = item
+                try:
+                    if isinstance(image, JSONResponse):
+                        result = image
+                    else:
+                        result = await verify_with_reference(voter_id, image, admission.deadline_from(), reference_tasks)
+                except Exception as e:
+                    logger.error(f"Error verifying batch item {index}: {str(e)}")
+                    result = batch_item_error(500, "Server error", "An unexpected error occurred during verification.", str(e))
+                release(voter_id)
+                await results.put(batch_result_line(index, item_id, voter_id, result))
+        
+        async def finish():
+            await asyncio.gather(*workers)
+            logger.info(f"Verification batch of {count} items finished")
+            await results.put(None)
+        
+        reader = asyncio.create_task(read_items())
+        workers = [asyncio.create_task(verify_items()) for _ in range(self.concurrency)]
+        finisher = asyncio.create_task(finish())
+        client_gone = asyncio.create_task(disconnected.wait())
+        try:
+            await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+            while True:
+                next_line = asyncio.create_task(results.get())
+                await asyncio.wait({next_line, client_gone}, return_when=asyncio.FIRST_COMPLETED)
+                if not next_line.done():
+                    next_line.cancel()
+                    logger.info(f"Verification batch client went away after {count} items")
+                    return
+                line = next_line.result()
+                if line is None:
+                    await send({"type": "http.response.body", "body": b"", "more_body": False})
+                    return
+                await send({"type": "http.response.body", "body": line, "more_body": True})
+        finally:
+            # Stop reading and drop the items and reference preparations still in flight
+            for task in (reader, finisher, client_gone, *workers, *reference_tasks.values()):
+                task.cancel()
+
+@app.post("/api/verify-batch")
+async def verify_face_batch(request: Request):
+    """
+    Verify many (voter ID, image) pairs in one streamed request
+    
+    Meant for booths replaying checks they queued while offline. The body is either
+    NDJSON, one {"id", "voter_id", "image" (base64)} object per line, or multipart
+    form data with repeated voter_id and uploaded_image fields (buffered before the
+    first item is verified). Items are verified concurrently, and one NDJSON result
+    line is streamed back per item as soon as it is ready, in completion order;
+    "index" and "id" tie a result to its item.
+    
+    Returns:
+        Streamed NDJSON results, or a JSON error if the body type is not supported
+    """
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if content_type in NDJSON_TYPES:
+        items = read_ndjson_items(request)
+    elif content_type == "multipart/form-data":
+        items = read_multipart_items(request)
+    else:
+        return error_response(
+            status_code=415,
+            content={
+                "success": False,
+                "error": "Unsupported media type",
+                "message": "Send the batch as application/x-ndjson or multipart/form-data.",
+                "details": content_type or None
+            }
+        )
+    
+    logger.info("Batch face verification request received")
+    return BatchVerificationResponse(items)
+
+@app.websocket("/ws/verify/{voter_id}")
+async def verify_session(websocket: WebSocket, voter_id: str):
+    """
+    Verify a voter from a stream of camera frames over one WebSocket session
+    
+    The reference is prepared once when the session opens, under admission control.
+    The client then sends encoded frames as binary messages; only the newest waiting
+    frame is processed, older ones are dropped. Each processed frame is answered with a "frame" message, and a
+    rejected one (too large, or not binary) with a "frame" error message. The session
+    ends with a "result" message at the first match or spoof verdict, or when
+    SESSION_TIMEOUT or SESSION_MAX_FRAMES is reached.
+    
+    Args:
+        voter_id: The voter ID to fetch the reference image from the voter database
+    """
+    await websocket.accept()
+    logger.info(f"Verification session opened for voter ID: {voter_id}")
+    
+    try:
+        async with admission.admit():
+            references = await prepare_reference(voter_id)
+    except Overloaded as e:
+        content = json.loads(overloaded_response(e).body)
+        await websocket.send_json({"type": "result", **content})
+        await websocket.close()
+        return
+    except ReferenceUnavailable as e:
+        metrics.count_error(e.error)
+        await websocket.send_json({"type": "result", "success": False, "error": e.error, "details": e.details})
+        await websocket.close()
+        return
+    except Exception as e:
+        content = json.loads(verification_error_response(str(e)).body)
+        await websocket.send_json({"type": "result", **content})
+        await websocket.close()
+        return
+    
+    await websocket.send_json({"type": "ready", "voter_id": voter_id})
+    
+    # Holds at most the newest unprocessed frame; None marks a disconnect
+    frames = asyncio.Queue(maxsize=1)
+    dropped = 0
+    rejected = 0
+    # The receiver answers rejected frames while the main loop answers processed ones
+    send_lock = asyncio.Lock()
+    
+    async def send(message):
+        async with send_lock:
+            await websocket.send_json(message)
+    
+    async def receive_frames():
+        nonlocal dropped, rejected
+        try:
+            while True:
+                message = await websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    break
+                frame = message.get("bytes")
+                if not frame or len(frame) > MAX_UPLOAD_BYTES:
+                    rejected += 1
+                    if frame:
+                        error = "Image too large"
+                        details = f"Frames must not be larger than {MAX_UPLOAD_BYTES} bytes; this one has {len(frame)}."
+                    else:
+                        error = "Invalid frame"
+                        details = "Frames must be sent as non-empty binary messages."
+                    metrics.count_error(error)
+                    await send({"type": "frame", "frame": None, "success": False, "error": error, "details": details})
+                    continue
+                if frames.full():
+                    # A newer frame arrived before the last one was processed
+                    frames.get_nowait()
+                    dropped += 1
+                frames.put_nowait(frame)
+        finally:
+            if frames.full():
+                frames.get_nowait()
+            frames.put_nowait(None)
+    
+    receiver = asyncio.create_task(receive_frames())
+    loop = asyncio.get_running_loop()
+    session_deadline = loop.time() + SESSION_TIMEOUT
+    processed = 0
+    outcome = None
+    last_response = None
+    
+    try:
+        while processed < SESSION_MAX_FRAMES:
+            try:
+                frame = await asyncio.wait_for(frames.get(), session_deadline - loop.time())
+            except asyncio.TimeoutError:
+                break
+            if frame is None:
+                # Client went away, nobody to answer
+                return
+            processed += 1
             
-            logger.info(f"Verification result: {result}")
-            
-            # Calculate similarity score
-            similarity_score = (1 - result["distance"]) * 100
+            try:
+                async with admission.admit():
+                    response_data = await verify_probe(voter_id, frame, references)
+            except Overloaded as e:
+                await send({
+                    "type": "frame",
+                    "frame": processed,
+                    "success": False,
+                    "error": "Server busy",
+                    "details": e.reason,
+                    "retry_after": e.retry_after
+                })
+                continue
+            except face_pipeline.NoFaceDetected as e:
+                # On /api/verify this is reported as potential spoofing; a camera stream
+                # routinely has frames without a face, so the client is told what happened
+                metrics.count_error("No face detected")
+                await send({
+                    "type": "frame",
+                    "frame": processed,
+                    "success": False,
+                    "error": "No face detected",
+                    "message": "No face was found in the frame. Please look at the camera.",
+                    "details": str(e)
+                })
+                continue
+            except Exception as e:
+                content = json.loads(verification_error_response(str(e)).body)
+                if content["error"] == "Spoofing detected":
+                    outcome = content
+                    break
+                await send({"type": "frame", "frame": processed, **content})
+                continue
             
-            # Return the verification result with appropriate message
-            response_data = {
-                "success": True,
-                "verified": result["verified"],
-                "distance": result["distance"],
-                "threshold": result["threshold"],
-                "model": result["model"],
-                "detector_backend": result.get("detector_backend", "opencv"),
-                "similarity_score": similarity_score,
+            if response_data["verified"]:
+                outcome = response_data
+                break
+            last_response = response_data
+            await send({"type": "frame", "frame": processed, **response_data})
+        
+        if outcome is None:
+            outcome = last_response or {
+                "success": False,
+                "error": "No face verified",
+                "message": "No usable frame was received before the session ended.",
                 "voter_id": voter_id
             }
-            
-            # Add appropriate message based on verification result
-            if result["verified"]:
-                response_data["message"] = "Face verification successful. Identity confirmed."
-            else:
-                response_data["message"] = "Face verification failed. This does not match the registered voter."
-            
-            return response_data
-            
+        logger.info(
+            f"Verification session for voter ID {voter_id} finished after {processed} frames "
+            f"({dropped} dropped, {rejected} rejected)"
+        )
+        await send({"type": "result", "frames": processed, "dropped_frames": dropped, "rejected_frames": rejected, **outcome})
+        await websocket.close()
+    except WebSocketDisconnect:
+        logger.info(f"Verification session for voter ID {voter_id} disconnected")
+    except Exception as e:
+        # Typically the client closing the connection while a frame was being answered
+        logger.warning(f"Verification session for voter ID {voter_id} ended: {str(e)}")
+    finally:
+        receiver.cancel()
+
+@app.post("/api/identify")
+async def identify_face(
+    request: Request,
+    uploaded_image: UploadFile = File(...),
+    top_k: int = Form(5),
+    exclude_voter_id: str = Form(None)
+):
+    """
+    Search every enrolled voter for faces matching the uploaded image (1:N)
+    
+    Used to catch people registered more than once under different voter IDs.
+    
+    Args:
+        uploaded_image: The face image to search for
+        top_k: Number of closest voters to return
+        exclude_voter_id: Optional voter ID to leave out, e.g. the voter being registered
+        
+    Returns:
+        JSON with the closest enrolled voters and their distances
+    """
+    logger.info(f"Identification request received (top_k={top_k})")
+    
+    if top_k < 1 or top_k > 100:
+        return error_response(
+            status_code=400,
+            content={
+                "success": False,
+                "error": "Invalid parameter",
+                "message": "top_k must be between 1 and 100."
+            }
+        )
+    
+    try:
+        with metrics.time_stage("upload_read"):
+            content = await uploaded_image.read()
+        
+        try:
+            async with admission.admit(request_deadline(request)):
+                probe_face, probe_img, facial_areas, _ = await detect_probe_face(content)
+                _, probe_embedding = await gather_or_cancel(
+                    check_probe_spoofing(probe_img, facial_areas),
+                    embed_probe_face(probe_face)
+                )
+        except Overloaded as e:
+            return overloaded_response(e)
         except Exception as e:
             error_message = str(e)
-            logger.error(f"DeepFace verification error: {error_message}")
-            
-            # Check for spoofing detection
-            if ("spoofed image" in error_message.lower() or 
-                "fake face" in error_message.lower()):
-                logger.warning(f"Explicit spoofing detected: {error_message}")
-                return JSONResponse(
-                    status_code=400,
-                    content={
-                        "success": False,
-                        "error": "Spoofing detected",
-                        "message": "Please use a real face image, not a photo of a display or printed image.",
-                        "details": error_message
-                    }
-                )
-            
-            # Handle exceptions related to processing in the uploaded image (likely spoofing)
-            elif "exception while processing img1_path" in error_message.lower():
-                logger.warning(f"Potential spoofing detected in uploaded image: {error_message}")
-                return JSONResponse(
-                    status_code=400,
-                    content={
-                        "success": False,
-                        "error": "Potential spoofing detected",
-                        "message": "The system detected potential spoofing in the uploaded image.",
-                        "details": error_message
-                    }
-                )
-            
-            # Handle exceptions related to processing in the reference image
-            elif "exception while processing img2_path" in error_message.lower():
-                logger.warning(f"Issue with reference image: {error_message}")
-                return JSONResponse(
-                    status_code=400,
-                    content={
-                        "success": False,
-                        "error": "Reference image issue",
-                        "message": "There is an issue with the stored reference image.",
-                        "details": error_message
-                    }
-                )
-            
-            # Common face detection errors
-            elif "face could not be detected" in error_message.lower():
-                return JSONResponse(
-                    status_code=400,
-                    content={
-                        "success": False,
-                        "error": "No face detected",
-                        "message": "No face detected in one or both images. Please provide a clear image with a visible face.",
-                        "details": error_message
-                    }
-                )
-            elif "more than one face" in error_message.lower():
-                return JSONResponse(
-                    status_code=400,
-                    content={
-                        "success": False,
-                        "error": "Multiple faces detected",
-                        "message": "Multiple faces detected in the image. Please provide an image with only one face.",
-                        "details": error_message
-                    }
-                )
-            else:
-                return JSONResponse(
-                    status_code=400,
-                    content={
-                        "success": False,
-                        "error": "Verification failed",
-                        "message": "Face verification process failed.",
-                        "details": error_message
-                    }
-                )
+            logger.error(f"Face identification error: {error_message}")
+            return verification_error_response(error_message)
+        
+        matches = await asyncio.to_thread(identify_index.search, probe_embedding, top_k, exclude_voter_id)
+        threshold = face_pipeline.find_threshold()
+        
+        return {
+            "success": True,
+            "matches": [
+                {
+                    "voter_id": voter_id,
+                    "distance": distance,
+                    "similarity_score": (1 - distance) * 100,
+                    "is_match": distance <= threshold
+                }
+                for voter_id, distance in matches
+            ],
+            "threshold": threshold,
+            "model": face_pipeline.MODEL_NAME,
+            "enrolled_voters": len(identify_index),
+            "index": identify_index.mode
+        }
         
     except Exception as e:
-        if isinstance(e, HTTPException):
-            # Re-raise HTTP exceptions with their status codes
-            raise
-        logger.error(f"Error processing images: {str(e)}")
-        return JSONResponse(
+        logger.error(f"Error identifying face: {str(e)}")
+        return error_response(
             status_code=500,
             content={
                 "success": False,
                 "error": "Server error",
-                "message": "An unexpected error occurred during verification.",
+                "message": "An unexpected error occurred during identification.",
                 "details": str(e)
             }
         )
-    
-    finally:
-        # Clean up temporary files
+
+def enrollment_job_status(job_id):
+    """Status of an enrollment job run by this worker, as reported by /api/enroll/{job_id}"""
+    job = enrollment_jobs[job_id]
+    status = {
+        "success": True,
+        "job_id": job_id,
+        "status": job["status"],
+        "progress": job["progress"].to_dict()
+    }
+    if job["details"]:
+        status["details"] = job["details"]
+    return status
+
+async def publish_enrollment_status(job_id):
+    """Keep the shared status file of an enrollment job up to date until the job has ended"""
+    finished = enrollment_jobs[job_id]["finished"]
+    while True:
+        status = enrollment_job_status(job_id)
+        await asyncio.to_thread(write_job_status, ENROLLMENT_JOBS_DIR, job_id, status)
+        if status["status"] != "running":
+            return
         try:
-            if os.path.exists(upload_path):
-                os.remove(upload_path)
-            if os.path.exists(ref_path):
-                os.remove(ref_path)
-        except Exception as e:
-            logger.error(f"Error cleaning up temp files: {str(e)}")
+            await asyncio.wait_for(finished.wait(), WORKER_SYNC_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+
+async def run_enrollment_job(job_id, voter_ids):
+    """Enroll voters in the background and add their embeddings to the identification index"""
+    job = enrollment_jobs[job_id]
+    publisher = asyncio.create_task(publish_enrollment_status(job_id))
+    try:
+        await enroll_voters(
+            voter_ids,
+            voter_api,
+            enrollment_pool,
+            reference_store,
+            cascade_store=reference_stores.get(CASCADE_MODEL),
+            concurrency=ENROLL_CONCURRENCY,
+            progress=job["progress"],
+            on_enrolled=identify_index.add
+        )
+        if job["progress"].enrolled:
+            # Publish the new embeddings so every worker maps them
+            await asyncio.to_thread(publish_embedding_roll, reference_store, EMBEDDING_ROLL_DIR, EMBEDDING_ROLL_DTYPE)
+        job["status"] = "completed"
+    except Exception as e:
+        logger.error(f"Enrollment job {job_id} failed: {str(e)}")
+        job["status"] = "failed"
+        job["details"] = str(e)
+    job["finished"].set()
+    await publisher
+    schedule_identify_index_training()
+
+@app.post("/api/enroll")
+async def enroll_batch(request: Request):
+    """
+    Start precomputing reference embeddings for many voters
+    
+    The request body is either JSON ({"voter_ids": [...]}) or plain text with one
+    voter ID per line. Voters whose current photo is already embedded are skipped,
+    so resubmitting an interrupted job resumes it.
+    
+    Returns:
+        JSON with the ID of the background enrollment job
+    """
+    try:
+        if request.headers.get("content-type", "").startswith("application/json"):
+            voter_ids = (await request.json())["voter_ids"]
+        else:
+            voter_ids = (await request.body()).decode("utf-8").splitlines()
+        voter_ids = [str(voter_id).strip() for voter_id in voter_ids if str(voter_id).strip()]
+    except Exception as e:
+        return error_response(
+            status_code=400,
+            content={
+                "success": False,
+                "error": "Invalid request",
+                "message": "Provide a JSON body with a voter_ids list or one voter ID per line.",
+                "details": str(e)
+            }
+        )
+    
+    job_id = uuid.uuid4().hex
+    enrollment_jobs[job_id] = {
+        "status": "running",
+        "progress": EnrollmentProgress(),
+        "details": None,
+        "finished": asyncio.Event()
+    }
+    enrollment_jobs[job_id]["task"] = asyncio.create_task(run_enrollment_job(job_id, voter_ids))
+    logger.info(f"Started enrollment job {job_id} for {len(voter_ids)} voters")
+    
+    return JSONResponse(
+        status_code=202,
+        content={
+            "success": True,
+            "job_id": job_id,
+            "voters": len(voter_ids),
+            "message": "Enrollment started."
+        }
+    )
+
+@app.get("/api/enroll/{job_id}")
+async def enrollment_status(job_id: str):
+    """Report the progress and throughput of an enrollment job, whichever worker runs it"""
+    if job_id in enrollment_jobs:
+        return enrollment_job_status(job_id)
+    
+    status = await asyncio.to_thread(read_job_status, ENROLLMENT_JOBS_DIR, job_id)
+    if status is None:
+        return error_response(
+            status_code=404,
+            content={
+                "success": False,
+                "error": "Job not found",
+                "details": f"No enrollment job with ID: {job_id}"
+            }
+        )
+    return status
+
+# Uvicorn options shared by the single-process and multi-worker modes
+SERVER_OPTIONS = {
+    "log_level": "info",
+    "timeout_keep_alive": 120,
+    "http": "h11",
+    "ws": "auto"
+}
+
+def serve_workers(port, workers):
+    """
+    Serve the app from pre-forked worker processes sharing one listening socket
+    
+    DeepFace and TensorFlow are imported and the voter roll is mapped before forking, so
+    the workers share those pages copy-on-write. The models are built in each worker
+    after the fork because TensorFlow is not fork-safe once it has run operations.
+    
+    State a request can observe on any worker is shared through files: cache
+    invalidations and enrollment job status (worker_state) and the Prometheus samples
+    (metrics multiprocess mode). Only the first worker prepares prefetched voting slots.
+    """
+    global worker_index
+    started = time.perf_counter()
+    face_pipeline.preload_libraries()
+    embedding_roll.refresh()
+    logger.info(f"Preloaded libraries and voter roll in {time.perf_counter() - started:.2f}s")
+    invalidation_log.reset()
+    metrics.clear_multiprocess_files()
+    
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(("0.0.0.0", port))
+    sock.listen(2048)
+    
+    children = []
+    for index in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            worker_index = index
+            server = uvicorn.Server(uvicorn.Config(app, **SERVER_OPTIONS))
+            server.run(sockets=[sock])
+            os._exit(0)
+        children.append(pid)
+    print(f"Started {workers} workers on port {port}")
+    
+    def stop_workers(signum, frame):
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+    
+    signal.signal(signal.SIGTERM, stop_workers)
+    signal.signal(signal.SIGINT, stop_workers)
+    for pid in children:
+        os.waitpid(pid, 0)
+        metrics.mark_worker_dead(pid)
 
 if __name__ == "__main__":
     # Run the FastAPI app using Uvicorn
@@ -584,17 +1764,16 @@ if __name__ == "__main__":
     for port in ports_to_try:
         try:
             print(f"Attempting to start server on port {port}")
-            uvicorn.run(
-                "main:app", 
-                host="0.0.0.0", 
-                port=port, 
-                reload=False,
-                log_level="info",
-                limit_concurrency=10,
-                timeout_keep_alive=120,
-                http="h11",
-                ws="none"
-            )
+            if API_WORKERS > 1:
+                serve_workers(port, API_WORKERS)
+            else:
+                uvicorn.run(
+                    "main:app", 
+                    host="0.0.0.0", 
+                    port=port, 
+                    reload=False,
+                    **SERVER_OPTIONS
+                )
             break
         except OSError as e:
             if "address already in use" in str(e).lower() or "winerror 10048" in str(e).lower():
@@ -0,0 +1,200 @@
+"""
+Prometheus metrics for the face verification API.
+
+Every verification is broken down into stages (upload read, voter API lookup,
+reference download, face detection, anti-spoofing, embedding, comparison), each with
+its own latency histogram, so it is visible whether time goes to I/O or to the
+models. Error responses are counted by the error class the handlers return, and the
+load of the admission queue, inference pool and embedding batcher is exported as
+gauges.
+
+With pre-forked workers (API_WORKERS > 1) prometheus_client runs in multiprocess
+mode: every worker writes its samples to files in PROMETHEUS_MULTIPROC_DIR, and
+whichever worker answers a scrape aggregates all of them. Counters and histograms are
+summed over the workers; the load gauges are refreshed by each worker every
+WORKER_SYNC_INTERVAL seconds and summed over the live workers.
+
+The stages of each request are also collected per request and returned to the
+client in a Server-Timing header, so a single slow verification can be broken down.
+"""
+import contextlib
+import contextvars
+import os
+import time
+
+from settings import API_WORKERS, PROMETHEUS_MULTIPROC_DIR
+
+if API_WORKERS > 1:
+    # prometheus_client picks its storage when it is imported, so this has to come first
+    os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", str(PROMETHEUS_MULTIPROC_DIR))
+MULTIPROCESS_DIR = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+if MULTIPROCESS_DIR:
+    os.makedirs(MULTIPROCESS_DIR, exist_ok=True)
+
+from prometheus_client import (  # noqa: E402
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+)
+
+# From a cache hit (a few ms) up to a slow voter API or a cold model (tens of seconds)
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+STAGE_SECONDS = Histogram(
+    "face_api_stage_seconds",
+    "Time spent in each stage of a request",
+    ["stage"],
+    buckets=STAGE_BUCKETS
+)
+
+ERRORS = Counter(
+    "face_api_errors_total",
+    "Error responses by error class",
+    ["error"]
+)
+
+VERIFICATIONS = Counter(
+    "face_api_verifications_total",
+    "Completed verifications by outcome",
+    ["result"]
+)
+
+
+CASCADE = Counter(
+    "face_api_cascade_total",
+    "Verifications decided by the fast cascade model, or escalated to the main model",
+    ["outcome"]
+)
+
+
+# Stage timings of the current request, set by ServerTimingMiddleware; tasks started by
+# the request copy the context and so add to the same dict
+_request_timings = contextvars.ContextVar("request_timings", default=None)
+
+
+@contextlib.contextmanager
+def time_stage(stage):
+    """Context manager observing the duration of a block under the given stage"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - started)
+
+
+def observe_stage(stage, seconds):
+    STAGE_SECONDS.labels(stage=stage).observe(seconds)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+
+def observe_stages(timings, prefix=""):
+    """Record a dict of {stage: seconds}, e.g. the timings returned by face_pipeline.detect_face_timed"""
+    for stage, seconds in timings.items():
+        observe_stage(f"{prefix}{stage}", seconds)
+
+
+def count_error(error):
+    ERRORS.labels(error=error).inc()
+
+
+def count_verification(verified):
+    VERIFICATIONS.labels(result="verified" if verified else "not_verified").inc()
+
+
+def count_cascade(outcome):
+    CASCADE.labels(outcome=outcome).inc()
+
+
+# Gauges read from a function, refreshed by refresh_gauges in multiprocess mode
+_tracked_gauges = []
+
+
+def track_gauge(name, documentation, fn):
+    """Export a gauge whose value is read from fn() at scrape time (see refresh_gauges)"""
+    gauge = Gauge(name, documentation, multiprocess_mode="livesum")
+    if MULTIPROCESS_DIR:
+        _tracked_gauges.append((gauge, fn))
+    else:
+        gauge.set_function(fn)
+    return gauge
+
+
+def refresh_gauges():
+    """Write the current value of every tracked gauge (multiprocess mode reads them from files)"""
+    for gauge, fn in _tracked_gauges:
+        gauge.set(fn())
+
+
+def clear_multiprocess_files():
+    """Remove the sample files of earlier runs; called by the parent before forking workers"""
+    if not MULTIPROCESS_DIR:
+        return
+    own_suffix = f"_{os.getpid()}.db"
+    for name in os.listdir(MULTIPROCESS_DIR):
+        if name.endswith(".db") and not name.endswith(own_suffix):
+            os.remove(os.path.join(MULTIPROCESS_DIR, name))
+
+
+def mark_worker_dead(pid):
+    """Drop the live gauges of a worker that exited"""
+    if MULTIPROCESS_DIR:
+        multiprocess.mark_process_dead(pid)
+
+
+def server_timing_header(timings, total):
+    """Format stage timings (seconds) as a Server-Timing header value in milliseconds"""
+    entries = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings.items()]
+    entries.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(entries)
+
+
+class ServerTimingMiddleware:
+    """
+    ASGI middleware adding a Server-Timing header with the stage breakdown of each request
+
+    Only responses of requests that went through at least one timed stage get the
+    header. A streamed response gets the stages finished before its first byte.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        timings = {}
+        token = _request_timings.set(timings)
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start" and timings:
+                header = server_timing_header(timings, time.perf_counter() - started)
+                headers = list(message.get("headers", [])) + [
+                    (b"server-timing", header.encode("latin-1")),
+                    (b"timing-allow-origin", b"*")
+                ]
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _request_timings.reset(token)
+
+
+def render():
+    """
+    Render every metric in the Prometheus text format
+
+    Returns:
+        Tuple of (body, content type)
+    """
+    if MULTIPROCESS_DIR:
+        refresh_gauges()
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
+
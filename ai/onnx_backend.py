@@ -0,0 +1,242 @@
+"""
+ONNX Runtime inference backend for the face models.
+
+The recognition model (a Keras model) and the two MiniFASNet anti-spoofing models
+(PyTorch) can be exported to ONNX once and then run with ONNX Runtime, optionally
+with dynamic int8 quantization of the weights. On CPU-only hosts this lowers the
+latency per face and avoids keeping TensorFlow and PyTorch graphs resident for
+those models. The OpenCV face detector is native code already; it is only given the
+same thread budget.
+
+ONNX Runtime, tf2onnx and onnx are optional dependencies (requirements-onnx.txt)
+and are only imported when this backend is used.
+
+Usage:
+    python onnx_backend.py export [--int8]
+    python onnx_backend.py parity photos/ [--int8]
+"""
+import argparse
+import itertools
+import logging
+import sys
+from pathlib import Path
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Crop scales of the two MiniFASNet models, as used by DeepFace's Fasnet
+SPOOFING_MODELS = (("fasnet_v2", 2.7), ("fasnet_v1se", 4.0))
+SPOOFING_INPUT_SIZE = 80
+
+_sessions = {}
+
+
+def model_path(directory, name, int8=False):
+    return Path(directory) / f"{name}{'.int8' if int8 else ''}.onnx"
+
+
+def create_session(path, threads):
+    """Open an ONNX Runtime session limited to the given number of intra-op threads"""
+    import onnxruntime
+
+    options = onnxruntime.SessionOptions()
+    options.intra_op_num_threads = threads
+    options.inter_op_num_threads = 1
+    options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+    return onnxruntime.InferenceSession(str(path), sess_options=options, providers=["CPUExecutionProvider"])
+
+
+def _session(path, threads):
+    session = _sessions.get(path)
+    if session is None:
+        if not path.exists():
+            raise FileNotFoundError(f"ONNX model {path} not found, run 'python onnx_backend.py export' first")
+        session = _sessions[path] = create_session(path, threads)
+        logger.info(f"Loaded ONNX model {path}")
+    return session
+
+
+class OnnxEmbeddingModel:
+    """Recognition model run by ONNX Runtime, with DeepFace's input_shape convention (width, height)"""
+
+    def __init__(self, session):
+        self.session = session
+        self.input_name = session.get_inputs()[0].name
+        _, height, width, _ = session.get_inputs()[0].shape
+        self.input_shape = (width, height)
+
+    def forward_batch(self, batch):
+        return self.session.run(None, {self.input_name: np.asarray(batch, dtype=np.float32)})[0]
+
+
+class OnnxFasnet:
+    """Drop-in replacement for DeepFace's Fasnet spoofing model, run by ONNX Runtime"""
+
+    def __init__(self, sessions):
+        self.sessions = sessions
+
+    def analyze(self, img, facial_area):
+        """
+        Same contract as Fasnet.analyze
+
+        Returns:
+            Tuple of (is_real, score)
+        """
+        from deepface.models.spoofing.FasNet import crop
+
+        prediction = np.zeros(3, dtype=np.float32)
+        for session, (_, scale) in zip(self.sessions, SPOOFING_MODELS):
+            face = crop(img, facial_area, scale, SPOOFING_INPUT_SIZE, SPOOFING_INPUT_SIZE)
+            # Fasnet feeds raw 0-255 BGR pixels, channels first
+            tensor = face.transpose(2, 0, 1)[np.newaxis].astype(np.float32)
+            logits = session.run(None, {session.get_inputs()[0].name: tensor})[0][0]
+            exp = np.exp(logits - logits.max())
+            prediction += exp / exp.sum()
+
+        label = int(np.argmax(prediction))
+        return label == 1, float(prediction[label] / 2)
+
+
+def load_embedding_model(directory, model_name, int8=False, threads=1):
+    return OnnxEmbeddingModel(_session(model_path(directory, model_name, int8), threads))
+
+
+def load_spoofing_model(directory, int8=False, threads=1):
+    return OnnxFasnet([_session(model_path(directory, name, int8), threads) for name, _ in SPOOFING_MODELS])
+
+
+def export_embedding_model(model_name, path):
+    """Export a DeepFace Keras recognition model to ONNX"""
+    import tensorflow as tf
+    import tf2onnx
+    from deepface import DeepFace
+
+    keras_model = DeepFace.build_model(model_name).model
+    spec = (tf.TensorSpec((None,) + tuple(keras_model.input_shape[1:]), tf.float32, name="input"),)
+    tf2onnx.convert.from_keras(keras_model, input_signature=spec, opset=13, output_path=str(path))
+    logger.info(f"Exported {model_name} to {path}")
+
+
+def export_spoofing_models(directory):
+    """Export DeepFace's two MiniFASNet anti-spoofing models to ONNX"""
+    import torch
+    from deepface import DeepFace
+
+    fasnet = DeepFace.build_model("Fasnet", task="spoofing")
+    dummy = torch.zeros((1, 3, SPOOFING_INPUT_SIZE, SPOOFING_INPUT_SIZE), device=fasnet.device)
+    for model, (name, _) in zip((fasnet.first_model, fasnet.second_model), SPOOFING_MODELS):
+        path = model_path(directory, name)
+        torch.onnx.export(
+            model, dummy, str(path),
+            input_names=["input"], output_names=["output"],
+            dynamic_axes={"input": {0: "batch"}, "output": {0: "batch"}},
+            opset_version=13
+        )
+        logger.info(f"Exported Fasnet {name} to {path}")
+
+
+def quantize(path, quantized_path):
+    """Quantize the weights of an ONNX model to int8 (dynamic quantization)"""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    quantize_dynamic(str(path), str(quantized_path), weight_type=QuantType.QInt8)
+    logger.info(f"Quantized {path} to {quantized_path}")
+
+
+def export_models(directory, model_names, int8=False):
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    names = list(model_names)
+    for model_name in model_names:
+        export_embedding_model(model_name, model_path(directory, model_name))
+    export_spoofing_models(directory)
+    names += [name for name, _ in SPOOFING_MODELS]
+    if int8:
+        for name in names:
+            quantize(model_path(directory, name), model_path(directory, name, int8=True))
+
+
+def parity_check(image_dir, directory, model_name, int8=False, threads=1, min_similarity=0.99):
+    """
+    Compare the ONNX backend with the TensorFlow/PyTorch path on a directory of face photos
+
+    Every face is detected once, then embedded and checked for spoofing by both paths.
+    Reports the cosine similarity between the two embeddings of each face, how many
+    verification decisions over all pairs of photos differ, and how many spoofing
+    verdicts differ.
+
+    Returns:
+        True if every face's similarity is at least min_similarity and no decision differs
+    """
+    import face_pipeline
+    from deepface import DeepFace
+
+    onnx_model = load_embedding_model(directory, model_name, int8, threads)
+    onnx_fasnet = load_spoofing_model(directory, int8, threads)
+    tf_model = DeepFace.build_model(model_name)
+    fasnet = DeepFace.build_model("Fasnet", task="spoofing")
+
+    paths = sorted(path for path in Path(image_dir).rglob("*") if path.suffix.lower() in {".jpg", ".jpeg", ".png"})
+    reference, candidate = [], []
+    spoof_mismatches = 0
+    for path in paths:
+        img = face_pipeline.decode_image(path.read_bytes())
+        try:
+            face_objs = DeepFace.extract_faces(img_path=img, detector_backend=face_pipeline.DETECTOR_BACKEND, align=True)
+        except ValueError:
+            logger.warning(f"No face in {path}, skipped")
+            continue
+        face_obj = max(face_objs, key=lambda obj: obj["facial_area"]["w"] * obj["facial_area"]["h"])
+        reference.append(face_pipeline.embed_faces([face_obj["face"]], model_name, model=tf_model)[0])
+        candidate.append(face_pipeline.embed_faces([face_obj["face"]], model_name, model=onnx_model)[0])
+
+        area = face_obj["facial_area"]
+        box = (area["x"], area["y"], area["w"], area["h"])
+        if fasnet.analyze(img=img, facial_area=box)[0] != onnx_fasnet.analyze(img, box)[0]:
+            spoof_mismatches += 1
+
+    if len(reference) < 2:
+        print("Need at least two photos with a detectable face")
+        return False
+
+    reference, candidate = np.stack(reference), np.stack(candidate)
+    similarity = np.sum(reference * candidate, axis=1)
+    threshold = face_pipeline.find_threshold(model_name)
+    decision_mismatches = 0
+    pairs = list(itertools.combinations(range(len(reference)), 2))
+    for i, j in pairs:
+        if (1 - reference[i] @ reference[j] <= threshold) != (1 - candidate[i] @ candidate[j] <= threshold):
+            decision_mismatches += 1
+
+    print(f"Faces compared: {len(reference)} ({'int8' if int8 else 'float32'} ONNX vs TensorFlow {model_name})")
+    print(f"Embedding cosine similarity: min {similarity.min():.5f}, mean {similarity.mean():.5f}")
+    print(f"Verification decisions differing: {decision_mismatches} of {len(pairs)} pairs")
+    print(f"Spoofing verdicts differing: {spoof_mismatches} of {len(reference)} faces")
+    return similarity.min() >= min_similarity and decision_mismatches == 0 and spoof_mismatches == 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    from settings import ONNX_MODEL_DIR, INFERENCE_THREADS
+
+    parser = argparse.ArgumentParser(description="Export the face models to ONNX and check them against the original path")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    export_parser = subparsers.add_parser("export", help="Export the recognition and anti-spoofing models")
+    export_parser.add_argument("--models", nargs="+", default=["VGG-Face"], help="Recognition models to export")
+    export_parser.add_argument("--int8", action="store_true", help="Also write int8-quantized models")
+    parity_parser = subparsers.add_parser("parity", help="Compare ONNX and TensorFlow results on a photo directory")
+    parity_parser.add_argument("images", help="Directory of face photos (searched recursively)")
+    parity_parser.add_argument("--model", default="VGG-Face", help="Recognition model to compare")
+    parity_parser.add_argument("--int8", action="store_true", help="Check the int8-quantized models")
+    parity_parser.add_argument("--min-similarity", type=float, default=0.99, help="Smallest accepted embedding similarity")
+    for subparser in (export_parser, parity_parser):
+        subparser.add_argument("--model-dir", default=str(ONNX_MODEL_DIR), help="Directory of the ONNX models")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        export_models(args.model_dir, args.models, args.int8)
+        sys.exit(0)
+    passed = parity_check(args.images, args.model_dir, args.model, args.int8, INFERENCE_THREADS, args.min_similarity)
+    print("PASS" if passed else "FAIL")
+    sys.exit(0 if passed else 1)
@@ -0,0 +1,81 @@
+"""
+On-demand sampling profiler for the running API.
+
+While a profile runs, a background thread snapshots the Python stack of every other
+thread at a fixed interval (sys._current_frames) and counts identical stacks. Nothing
+is instrumented, so requests run at full speed between samples and there is no cost
+at all when no profile is running. Time spent inside TensorFlow or OpenCV native code
+is attributed to the Python frame that called into it.
+
+The result is returned as collapsed stacks, one "thread;outer;...;inner count" line
+per distinct stack, which flamegraph.pl, speedscope and similar tools read directly.
+"""
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+
+
+class ProfilerBusy(Exception):
+    """Raised when a profile is requested while another one is running"""
+
+
+class SamplingProfiler:
+    """Samples the stacks of every thread of this process for a fixed duration"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.profiles = 0
+
+    @property
+    def running(self):
+        return self._lock.locked()
+
+    def profile(self, seconds, interval=0.005):
+        """
+        Sample every thread except the calling one (blocking)
+
+        Args:
+            seconds: How long to sample
+            interval: Seconds between samples
+
+        Returns:
+            Tuple of (number of samples, Counter of {collapsed stack: count})
+
+        Raises:
+            ProfilerBusy: If another profile is running
+        """
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusy("A profile is already running")
+        try:
+            own_ident = threading.get_ident()
+            stacks = Counter()
+            samples = 0
+            deadline = time.monotonic() + seconds
+            while time.monotonic() < deadline:
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+                for ident, frame in sys._current_frames().items():
+                    if ident != own_ident:
+                        stacks[self._collapse(names.get(ident, f"thread-{ident}"), frame)] += 1
+                samples += 1
+                time.sleep(interval)
+            self.profiles += 1
+            return samples, stacks
+        finally:
+            self._lock.release()
+
+    @staticmethod
+    def _collapse(thread_name, frame):
+        frames = []
+        while frame is not None:
+            code = frame.f_code
+            frames.append(f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})")
+            frame = frame.f_back
+        frames.append(thread_name)
+        return ";".join(reversed(frames))
+
+
+def format_collapsed(stacks):
+    """Render collapsed stacks as text, most frequent first"""
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
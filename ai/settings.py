@@ -0,0 +1,129 @@
+import os
+from pathlib import Path
+
+# Define application root directory for consistent path resolution
+ROOT_DIR = Path(os.path.dirname(os.path.abspath(__file__)))
+
+# Define temp directory
+TEMP_DIR = ROOT_DIR / "temp"
+
+# Directory holding the on-disk tier of the reference embedding store
+EMBEDDINGS_DIR = Path(os.getenv("EMBEDDINGS_DIR", str(ROOT_DIR / "embeddings")))
+
+# Number of reference embeddings kept in memory (LRU)
+REFERENCE_CACHE_SIZE = int(os.getenv("REFERENCE_CACHE_SIZE", "4096"))
+
+# Executor running the face models: "thread" or "process" (process workers preload the models)
+INFERENCE_EXECUTOR = os.getenv("INFERENCE_EXECUTOR", "thread")
+
+# Number of inference workers
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+
+# Micro-batching of face embeddings: largest batch and longest wait for a batch to fill
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "16"))
+EMBEDDING_BATCH_WAIT_MS = float(os.getenv("EMBEDDING_BATCH_WAIT_MS", "10"))
+
+# Voter database API and its HTTP connection pool
+VOTER_API_URL = os.getenv("VOTER_API_URL", "http://localhost:9001").rstrip("/")
+VOTER_API_POOL_SIZE = int(os.getenv("VOTER_API_POOL_SIZE", "100"))
+VOTER_API_POOL_PER_HOST = int(os.getenv("VOTER_API_POOL_PER_HOST", "32"))
+VOTER_API_DNS_CACHE_TTL = int(os.getenv("VOTER_API_DNS_CACHE_TTL", "300"))
+VOTER_API_KEEPALIVE = float(os.getenv("VOTER_API_KEEPALIVE", "30"))
+VOTER_API_CONNECT_TIMEOUT = float(os.getenv("VOTER_API_CONNECT_TIMEOUT", "2"))
+VOTER_API_TIMEOUT = float(os.getenv("VOTER_API_TIMEOUT", "5"))
+
+# Caching of voter photo URLs and reference image bytes (seconds / entries / bytes)
+VOTER_CACHE_TTL = float(os.getenv("VOTER_CACHE_TTL", "300"))
+VOTER_CACHE_SIZE = int(os.getenv("VOTER_CACHE_SIZE", "10000"))
+IMAGE_CACHE_TTL = float(os.getenv("IMAGE_CACHE_TTL", "600"))
+IMAGE_CACHE_MAX_BYTES = int(os.getenv("IMAGE_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+# Seconds an identical retry (same voter, same image bytes) reuses the earlier result, 0 disables
+RESULT_DEDUP_TTL = float(os.getenv("RESULT_DEDUP_TTL", "10"))
+
+# 1:N identification index: storage dtype, exact-search block size, IVF size threshold and lists probed
+IDENTIFY_INDEX_DTYPE = os.getenv("IDENTIFY_INDEX_DTYPE", "float16")
+IDENTIFY_BLOCK_SIZE = int(os.getenv("IDENTIFY_BLOCK_SIZE", "8192"))
+IDENTIFY_IVF_THRESHOLD = int(os.getenv("IDENTIFY_IVF_THRESHOLD", "100000"))
+IDENTIFY_NPROBE = int(os.getenv("IDENTIFY_NPROBE", "16"))
+
+# Voters processed at the same time by /api/enroll jobs
+ENROLL_CONCURRENCY = int(os.getenv("ENROLL_CONCURRENCY", "16"))
+
+# Memory-mapped voter roll shared by all workers: location, storage dtype and refresh interval (seconds)
+EMBEDDING_ROLL_DIR = Path(os.getenv("EMBEDDING_ROLL_DIR", str(EMBEDDINGS_DIR / "roll")))
+EMBEDDING_ROLL_DTYPE = os.getenv("EMBEDDING_ROLL_DTYPE", "float16")
+EMBEDDING_ROLL_REFRESH = float(os.getenv("EMBEDDING_ROLL_REFRESH", "30"))
+
+# Number of pre-forked API worker processes
+API_WORKERS = int(os.getenv("API_WORKERS", "1"))
+
+# Multi-worker state: shared directory of the cache invalidation log and enrollment job status,
+# and how often each worker polls it (seconds)
+WORKER_STATE_DIR = Path(os.getenv("WORKER_STATE_DIR", str(EMBEDDINGS_DIR / "workers")))
+WORKER_SYNC_INTERVAL = float(os.getenv("WORKER_SYNC_INTERVAL", "1"))
+
+# Directory where pre-forked workers write their Prometheus samples, aggregated by /metrics
+PROMETHEUS_MULTIPROC_DIR = Path(os.getenv("PROMETHEUS_MULTIPROC_DIR", str(TEMP_DIR / "prometheus")))
+
+# Admission control of model-bound requests: concurrent slots, queue length and deadline (seconds)
+ADMISSION_MAX_CONCURRENCY = int(os.getenv("ADMISSION_MAX_CONCURRENCY", str(INFERENCE_WORKERS * 4)))
+ADMISSION_QUEUE_SIZE = int(os.getenv("ADMISSION_QUEUE_SIZE", "64"))
+ADMISSION_DEADLINE = float(os.getenv("ADMISSION_DEADLINE", "10"))
+
+# Admission slots that /api/enroll jobs may hold at once, so bulk enrollment cannot crowd out verifications
+ENROLL_ADMISSION_SHARE = int(os.getenv("ENROLL_ADMISSION_SHARE", str(max(1, ADMISSION_MAX_CONCURRENCY // 4))))
+
+# Largest image accepted by the raw binary upload endpoint (bytes)
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(10 * 1024 * 1024)))
+
+# Pre-processing before inference: longest image side kept (pixels, 0 disables) and reduced-size JPEG decoding
+IMAGE_MAX_SIDE = int(os.getenv("IMAGE_MAX_SIDE", "1280"))
+IMAGE_REDUCED_DECODE = os.getenv("IMAGE_REDUCED_DECODE", "true").lower() in ("1", "true", "yes")
+
+# Early quality rejection of uploaded images (0 disables a check): Laplacian variance,
+# mean gray level range and smallest face side in pixels, measured after downscaling
+MIN_SHARPNESS = float(os.getenv("MIN_SHARPNESS", "25"))
+MIN_BRIGHTNESS = float(os.getenv("MIN_BRIGHTNESS", "40"))
+MAX_BRIGHTNESS = float(os.getenv("MAX_BRIGHTNESS", "225"))
+MIN_FACE_SIZE = int(os.getenv("MIN_FACE_SIZE", "64"))
+
+# WebSocket verification sessions: longest session (seconds) and most frames processed
+SESSION_TIMEOUT = float(os.getenv("SESSION_TIMEOUT", "30"))
+SESSION_MAX_FRAMES = int(os.getenv("SESSION_MAX_FRAMES", "60"))
+
+# Model cascade: fast model scoring every pair first ("" disables, e.g. "SFace" or "Facenet"),
+# and the margin around its threshold (fraction of the threshold) that escalates a pair to the main model
+CASCADE_MODEL = os.getenv("CASCADE_MODEL", "")
+CASCADE_MARGIN = float(os.getenv("CASCADE_MARGIN", "0.15"))
+
+# Backend running the recognition and anti-spoofing models: "tensorflow" (DeepFace's own models) or
+# "onnx" (exported with `python onnx_backend.py export`, optionally int8-quantized, run by ONNX Runtime)
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "tensorflow")
+ONNX_MODEL_DIR = Path(os.getenv("ONNX_MODEL_DIR", str(ROOT_DIR / "onnx_models")))
+ONNX_INT8 = os.getenv("ONNX_INT8", "false").lower() in ("1", "true", "yes")
+
+# CPU threads used by one model call (ONNX Runtime intra-op threads and OpenCV),
+# by default the host's cores split across the inference workers
+INFERENCE_THREADS = int(os.getenv("INFERENCE_THREADS", str(max(1, (os.cpu_count() or 2) // INFERENCE_WORKERS))))
+
+# Prefetching of reference embeddings ahead of voting time slots: schedule URL (absolute or relative
+# to the voter API) or JSON file ("" disables), bearer token for it, lead time and reload interval
+# (seconds), and voters prepared at once
+SLOT_SCHEDULE_SOURCE = os.getenv("SLOT_SCHEDULE_SOURCE", "")
+SLOT_SCHEDULE_TOKEN = os.getenv("SLOT_SCHEDULE_TOKEN", "")
+SLOT_PREFETCH_LEAD_TIME = float(os.getenv("SLOT_PREFETCH_LEAD_TIME", "900"))
+SLOT_SCHEDULE_REFRESH = float(os.getenv("SLOT_SCHEDULE_REFRESH", "60"))
+SLOT_PREFETCH_CONCURRENCY = int(os.getenv("SLOT_PREFETCH_CONCURRENCY", "2"))
+
+# Batch verification: items of one /api/verify-batch request verified at once, a small share of the
+# admission slots so a replayed batch cannot crowd out the booths
+BATCH_VERIFY_CONCURRENCY = int(os.getenv("BATCH_VERIFY_CONCURRENCY", str(max(1, ADMISSION_MAX_CONCURRENCY // 4))))
+
+# Server-Timing header with the stage breakdown of each request
+SERVER_TIMING = os.getenv("SERVER_TIMING", "true").lower() in ("1", "true", "yes")
+
+# Token required in the X-Admin-Token header of admin endpoints ("" disables them),
+# and the longest sampling profile they may run (seconds)
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "60"))
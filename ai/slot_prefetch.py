@@ -0,0 +1,210 @@
+"""
+Prefetching of voter reference embeddings ahead of their voting time slots.
+
+Voters are assigned to voting time slots, so the service knows roughly who will
+show up when. Shortly before a slot opens, the prefetcher looks up the voters of
+that slot, downloads their photos and embeds their reference faces, pinning the
+embeddings in memory so LRU eviction cannot push them out while the slot runs.
+When the slot ends the pins are released. Verifications during the slot then skip
+the reference download, detection and embedding at the moment the queues at the
+booths are longest.
+
+The schedule is a JSON list of slots (or an object with a "slots" list):
+
+    [{"id": "slot-1", "start": "2026-11-03T09:00:00+01:00", "end": "2026-11-03T10:00:00+01:00",
+      "voter_ids": ["V001", "V002"]}]
+
+Slots in the backend's format (date, startTime and endTime as "HH:MM" local time,
+_id, voters) are accepted as well.
+"""
+import asyncio
+import json
+import logging
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+
+class Slot:
+    """A voting time slot and the voters assigned to it"""
+
+    def __init__(self, slot_id, start, end, voter_ids):
+        self.slot_id = slot_id
+        self.start = start
+        self.end = end
+        self.voter_ids = voter_ids
+
+
+def _parse_time(value, date=None):
+    """Parse an ISO timestamp, or an "HH:MM" time on the given date; naive times are local"""
+    if date is not None and len(value) <= 5:
+        # The backend stores the slot's day as local midnight in UTC, so take the local date
+        day = datetime.fromisoformat(date.replace("Z", "+00:00")).astimezone().date()
+        parsed = datetime.combine(day, datetime.strptime(value, "%H:%M").time())
+    else:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    return parsed.astimezone().timestamp()
+
+
+def parse_schedule(data):
+    """
+    Turn a schedule document into Slot objects, skipping malformed and cancelled slots
+
+    Returns:
+        List of Slot
+    """
+    if isinstance(data, dict):
+        data = data.get("slots", [])
+
+    slots = []
+    for item in data:
+        try:
+            if item.get("status") in ("cancelled", "completed"):
+                continue
+            slot_id = str(item.get("id") or item["_id"])
+            start = _parse_time(item.get("start") or item["startTime"], item.get("date"))
+            end = _parse_time(item.get("end") or item["endTime"], item.get("date"))
+            if end <= start:
+                # A slot ending after midnight
+                end += timedelta(days=1).total_seconds()
+            voter_ids = [str(voter_id) for voter_id in item.get("voter_ids") or item.get("voters") or []]
+        except (KeyError, TypeError, ValueError) as e:
+            logger.warning(f"Skipping malformed slot {item!r}: {e}")
+            continue
+        slots.append(Slot(slot_id, start, end, voter_ids))
+    return slots
+
+
+def schedule_loader(source, voter_api, token=""):
+    """
+    Return a coroutine function loading the slot schedule
+
+    Args:
+        source: URL of the schedule (absolute, or relative to the voter API) or path of a JSON file
+        voter_api: VoterApiClient whose pooled session fetches the URL
+        token: Bearer token sent with the request, if the schedule endpoint needs one
+    """
+    async def load():
+        if source.startswith(("http://", "https://", "/api/")):
+            headers = {"Authorization": f"Bearer {token}"} if token else None
+            data = await voter_api.fetch_json(source, headers=headers)
+        else:
+            data = await asyncio.to_thread(lambda: json.loads(Path(source).read_text()))
+        return parse_schedule(data)
+
+    return load
+
+
+class SlotPrefetcher:
+    """Prepare and pin the reference embeddings of each time slot's voters while the slot is near or open"""
+
+    def __init__(self, load_schedule, prepare, stores, lead_time=900, refresh=60, concurrency=2):
+        """
+        Args:
+            load_schedule: Coroutine function returning the current list of Slot
+            prepare: Coroutine function preparing one voter's reference embeddings, or None to only
+                pin them while another process prepares them into the shared disk tier
+            stores: ReferenceEmbeddingStores whose entries are pinned for the slot
+            lead_time: Seconds before a slot opens that its prefetch starts
+            refresh: Seconds between schedule reloads
+            concurrency: Voters prepared at once, kept low so live verifications keep the workers
+        """
+        self.load_schedule = load_schedule
+        self.prepare = prepare
+        self.stores = list(stores)
+        self.lead_time = lead_time
+        self.refresh = refresh
+        self.concurrency = concurrency
+        self._active = {}
+        self.slots_prefetched = 0
+        self.voters_prepared = 0
+        self.voters_failed = 0
+        self.last_error = None
+
+    async def run(self):
+        """Reload the schedule and start or finish slots until cancelled"""
+        try:
+            while True:
+                try:
+                    self.sync(await self.load_schedule())
+                    self.last_error = None
+                except Exception as e:
+                    self.last_error = str(e)
+                    logger.error(f"Error loading the voting slot schedule: {str(e)}")
+                await asyncio.sleep(self.refresh)
+        finally:
+            for slot_id in list(self._active):
+                self._finish(slot_id)
+
+    def sync(self, slots, now=None):
+        """Start prefetching slots that open within the lead time, release slots that ended or disappeared"""
+        now = time.time() if now is None else now
+        due = {slot.slot_id: slot for slot in slots if slot.start - self.lead_time <= now < slot.end}
+
+        for slot_id in list(self._active):
+            if slot_id not in due:
+                self._finish(slot_id)
+
+        for slot_id, slot in due.items():
+            if slot_id not in self._active:
+                for voter_id in slot.voter_ids:
+                    for store in self.stores:
+                        store.pin(voter_id)
+                self._active[slot_id] = (slot, asyncio.create_task(self._prefetch(slot)))
+                logger.info(f"Prefetching references of {len(slot.voter_ids)} voters for slot {slot_id}")
+
+    def _finish(self, slot_id):
+        slot, task = self._active.pop(slot_id)
+        task.cancel()
+        for voter_id in slot.voter_ids:
+            for store in self.stores:
+                store.unpin(voter_id)
+        logger.info(f"Released prefetched references of slot {slot_id}")
+
+    async def _prefetch(self, slot):
+        if self.prepare is None:
+            return
+        started = time.perf_counter()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        failed = 0
+
+        async def prepare_one(voter_id):
+            nonlocal failed
+            async with semaphore:
+                try:
+                    await self.prepare(voter_id)
+                    self.voters_prepared += 1
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    failed += 1
+                    self.voters_failed += 1
+                    logger.warning(f"Could not prefetch reference of voter {voter_id} for slot {slot.slot_id}: {str(e)}")
+
+        await asyncio.gather(*(prepare_one(voter_id) for voter_id in slot.voter_ids))
+        self.slots_prefetched += 1
+        logger.info(
+            f"Prefetched slot {slot.slot_id}: {len(slot.voter_ids) - failed} of {len(slot.voter_ids)} voters "
+            f"in {time.perf_counter() - started:.1f}s"
+        )
+
+    def stats(self):
+        """Return the active slots and prefetch counters"""
+        return {
+            "active_slots": [
+                {
+                    "id": slot.slot_id,
+                    "voters": len(slot.voter_ids),
+                    "opens_at": datetime.fromtimestamp(slot.start).astimezone().isoformat(),
+                    "closes_at": datetime.fromtimestamp(slot.end).astimezone().isoformat(),
+                    "prefetch_done": task.done()
+                }
+                for slot, task in self._active.values()
+            ],
+            "slots_prefetched": self.slots_prefetched,
+            "voters_prepared": self.voters_prepared,
+            "voters_failed": self.voters_failed,
+            "last_error": self.last_error
+        }
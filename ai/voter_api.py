@@ -0,0 +1,323 @@
+"""
+Client for the voter database API.
+
+A single application-scoped aiohttp session is shared by every request, so
+lookups and reference downloads reuse keep-alive connections from a bounded pool
+instead of opening new TCP connections for each call.
+
+Voter photo URLs and reference image bytes are cached for a TTL. Once an entry
+expires it is revalidated with a conditional request (ETag / If-Modified-Since),
+so an unchanged photo costs a 304 instead of a full download.
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+
+class _CacheEntry:
+    __slots__ = ("value", "etag", "last_modified", "expires_at", "size")
+
+    def __init__(self, value, etag, last_modified, expires_at, size):
+        self.value = value
+        self.etag = etag
+        self.last_modified = last_modified
+        self.expires_at = expires_at
+        self.size = size
+
+    @property
+    def fresh(self):
+        return time.monotonic() < self.expires_at
+
+    def validators(self):
+        """Headers for a conditional request revalidating this entry"""
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+class _TTLCache:
+    """LRU cache with per-entry expiry, bounded by entry count and total size"""
+
+    def __init__(self, ttl, max_entries, max_bytes=None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key, value, etag=None, last_modified=None, size=0):
+        self.pop(key)
+        entry = _CacheEntry(value, etag, last_modified, time.monotonic() + self.ttl, size)
+        self._entries[key] = entry
+        self.total_bytes += size
+        while self._entries and (
+            len(self._entries) > self.max_entries
+            or (self.max_bytes is not None and self.total_bytes > self.max_bytes)
+        ):
+            _, evicted = self._entries.popitem(last=False)
+            self.total_bytes -= evicted.size
+        return entry
+
+    def refresh(self, entry):
+        entry.expires_at = time.monotonic() + self.ttl
+
+    def pop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.total_bytes -= entry.size
+        return entry
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "bytes": self.total_bytes,
+            "hits": self.hits,
+            "revalidated": self.revalidated,
+            "misses": self.misses
+        }
+
+
+class VoterApiClient:
+    """Pooled, keep-alive HTTP client for the voter database API"""
+
+    def __init__(
+        self,
+        base_url="http://localhost:9001",
+        pool_size=100,
+        pool_per_host=32,
+        dns_cache_ttl=300,
+        keepalive_timeout=30,
+        connect_timeout=2,
+        timeout=5,
+        voter_cache_ttl=300,
+        voter_cache_size=10000,
+        image_cache_ttl=600,
+        image_cache_max_bytes=256 * 1024 * 1024
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.pool_size = pool_size
+        self.pool_per_host = pool_per_host
+        self.dns_cache_ttl = dns_cache_ttl
+        self.keepalive_timeout = keepalive_timeout
+        self.connect_timeout = connect_timeout
+        self.timeout = timeout
+        self._session = None
+        self._voter_cache = _TTLCache(voter_cache_ttl, voter_cache_size)
+        self._image_cache = _TTLCache(image_cache_ttl, voter_cache_size, max_bytes=image_cache_max_bytes)
+        self.requests = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.connections_created = 0
+        self.connections_reused = 0
+
+    async def start(self):
+        """Create the shared session and connection pool"""
+        if self._session is not None and not self._session.closed:
+            return
+
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_connection_create_end.append(self._on_connection_created)
+        trace_config.on_connection_reuseconn.append(self._on_connection_reused)
+
+        connector = aiohttp.TCPConnector(
+            limit=self.pool_size,
+            limit_per_host=self.pool_per_host,
+            use_dns_cache=True,
+            ttl_dns_cache=self.dns_cache_ttl,
+            keepalive_timeout=self.keepalive_timeout
+        )
+        self._session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=self.timeout, connect=self.connect_timeout),
+            trace_configs=[trace_config]
+        )
+        logger.info(f"Voter API client started for {self.base_url} (pool size {self.pool_size}, per host {self.pool_per_host})")
+
+    async def close(self):
+        """Close the session and its pooled connections"""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def _on_connection_created(self, session, context, params):
+        self.connections_created += 1
+
+    async def _on_connection_reused(self, session, context, params):
+        self.connections_reused += 1
+
+    async def _get_session(self):
+        if self._session is None or self._session.closed:
+            await self.start()
+        return self._session
+
+    def resolve_url(self, path):
+        """Turn a path returned by the voter API into a full URL"""
+        if path.startswith("http"):
+            # If it's already a full URL, use it as is
+            return path
+        # Otherwise, construct the full URL
+        return f"{self.base_url}{path}"
+
+    async def get_voter_image_url(self, voter_id):
+        """Get the image URL for a voter from the voter database API"""
+        entry = self._voter_cache.get(voter_id)
+        if entry is not None and entry.fresh:
+            self._voter_cache.hits += 1
+            return entry.value
+
+        voter_api_url = f"{self.base_url}/api/voters/id/{voter_id}"
+        logger.info(f"Fetching voter data from: {voter_api_url}")
+
+        self.requests += 1
+        self.in_flight += 1
+        try:
+            session = await self._get_session()
+            headers = entry.validators() if entry is not None else {}
+            async with session.get(voter_api_url, headers=headers) as response:
+                if response.status == 304 and entry is not None:
+                    self._voter_cache.revalidated += 1
+                    self._voter_cache.refresh(entry)
+                    return entry.value
+
+                self._voter_cache.misses += 1
+                if response.status != 200:
+                    self._voter_cache.pop(voter_id)
+                    logger.error(f"Error fetching voter data. Status: {response.status}, URL: {voter_api_url}")
+                    self.errors += 1
+                    return None
+
+                voter_data = await response.json()
+
+                # Extract the photo URL from the response
+                if "photoUrl" not in voter_data:
+                    logger.error(f"No photoUrl found in voter data: {voter_data}")
+                    return None
+
+                photo_url = self.resolve_url(voter_data["photoUrl"])
+                if entry is not None and entry.value != photo_url:
+                    # The voter's photo was replaced, the old image is no longer needed
+                    self._image_cache.pop(entry.value)
+                self._voter_cache.put(
+                    voter_id,
+                    photo_url,
+                    etag=response.headers.get("ETag"),
+                    last_modified=response.headers.get("Last-Modified")
+                )
+                return photo_url
+        except aiohttp.ClientConnectorError:
+            logger.error(f"Failed to connect to voter API at {voter_api_url}. The service may be down.")
+        except aiohttp.ClientError as e:
+            logger.error(f"HTTP client error when accessing voter API: {str(e)}")
+        except asyncio.TimeoutError:
+            logger.error(f"Timeout when connecting to voter API at {voter_api_url}")
+        except Exception as e:
+            logger.error(f"Error getting voter image URL: {str(e)}")
+        finally:
+            self.in_flight -= 1
+
+        self.errors += 1
+        return None
+
+    async def download_image(self, url):
+        """Download an image from a URL and return its bytes, or None on failure"""
+        entry = self._image_cache.get(url)
+        if entry is not None and entry.fresh:
+            self._image_cache.hits += 1
+            return entry.value
+
+        self.requests += 1
+        self.in_flight += 1
+        try:
+            session = await self._get_session()
+            headers = entry.validators() if entry is not None else {}
+            async with session.get(url, headers=headers) as response:
+                if response.status == 304 and entry is not None:
+                    self._image_cache.revalidated += 1
+                    self._image_cache.refresh(entry)
+                    return entry.value
+
+                self._image_cache.misses += 1
+                if response.status != 200:
+                    self._image_cache.pop(url)
+                    logger.error(f"Error downloading image. Status: {response.status}, URL: {url}")
+                    self.errors += 1
+                    return None
+
+                content = await response.read()
+                self._image_cache.put(
+                    url,
+                    content,
+                    etag=response.headers.get("ETag"),
+                    last_modified=response.headers.get("Last-Modified"),
+                    size=len(content)
+                )
+                return content
+        except aiohttp.ClientConnectorError:
+            logger.error(f"Failed to connect to image server at {url}. The service may be down.")
+        except aiohttp.ClientError as e:
+            logger.error(f"HTTP client error when downloading image: {str(e)}")
+        except asyncio.TimeoutError:
+            logger.error(f"Timeout when downloading image from {url}")
+        except Exception as e:
+            logger.error(f"Error downloading image from {url}: {str(e)}")
+        finally:
+            self.in_flight -= 1
+
+        self.errors += 1
+        return None
+
+    async def fetch_json(self, url, headers=None):
+        """GET a JSON document through the shared session, e.g. the voting slot schedule"""
+        session = await self._get_session()
+        async with session.get(self.resolve_url(url), headers=headers) as response:
+            response.raise_for_status()
+            return await response.json()
+
+    def invalidate(self, voter_id):
+        """Forget the cached photo URL and image bytes of a voter"""
+        entry = self._voter_cache.pop(voter_id)
+        if entry is not None:
+            self._image_cache.pop(entry.value)
+        return entry is not None
+
+    def stats(self):
+        """Return connection pool configuration, occupancy, cache and request counters"""
+        connector = self._session.connector if self._session is not None else None
+        # aiohttp does not expose pool occupancy publicly
+        acquired = len(getattr(connector, "_acquired", ())) if connector else 0
+        idle = sum(len(conns) for conns in getattr(connector, "_conns", {}).values()) if connector else 0
+
+        return {
+            "base_url": self.base_url,
+            "pool_size": self.pool_size,
+            "pool_per_host": self.pool_per_host,
+            "connections_in_use": acquired,
+            "connections_idle": idle,
+            "connections_created": self.connections_created,
+            "connections_reused": self.connections_reused,
+            "requests": self.requests,
+            "in_flight": self.in_flight,
+            "errors": self.errors,
+            "voter_cache": self._voter_cache.stats(),
+            "image_cache": self._image_cache.stats()
+        }
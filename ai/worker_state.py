@@ -0,0 +1,107 @@
+"""
+State shared between the pre-forked API workers.
+
+Each worker keeps its own caches and background jobs, while a client's next request
+can be accepted by any worker. Two small file-based channels in a shared directory
+keep the workers consistent:
+
+- An append-only invalidation log. The worker handling /api/cache/invalidate appends
+  the voter ID, and every other worker drops its cached data for that voter when it
+  next polls the log.
+- One JSON status file per enrollment job, rewritten atomically while the job runs,
+  so a status poll answered by another worker still finds the job.
+"""
+import json
+import logging
+import os
+import re
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+JOB_ID_PATTERN = re.compile(r"[0-9a-f]{32}")
+
+
+class InvalidationLog:
+    """Append-only log of invalidated voter IDs, read by every worker"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._offset = 0
+
+    def reset(self):
+        """Start an empty log; called by the parent process before it forks the workers"""
+        with open(self.path, "w"):
+            pass
+        self._offset = 0
+
+    def publish(self, voter_id):
+        """Record that a voter's cached data has to be dropped by every worker"""
+        line = json.dumps({"voter_id": voter_id, "pid": os.getpid()}) + "\n"
+        # A single O_APPEND write of one short line is never interleaved with other writers
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line.encode("utf-8"))
+        finally:
+            os.close(fd)
+
+    def poll(self):
+        """
+        Read the invalidations other processes recorded since the last poll
+
+        Returns:
+            List of voter IDs
+        """
+        try:
+            size = self.path.stat().st_size
+        except FileNotFoundError:
+            return []
+        if size < self._offset:
+            # The log was reset
+            self._offset = 0
+        if size == self._offset:
+            return []
+
+        with open(self.path, "rb") as f:
+            f.seek(self._offset)
+            data = f.read(size - self._offset)
+        # A line still being written is left for the next poll
+        end = data.rfind(b"\n") + 1
+        self._offset += end
+
+        voter_ids = []
+        for line in data[:end].splitlines():
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get("pid") != os.getpid():
+                voter_ids.append(record["voter_id"])
+        return voter_ids
+
+
+def write_job_status(directory, job_id, status):
+    """Atomically store the JSON status of a background job"""
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    tmp_path = directory / f"{job_id}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "w") as f:
+            json.dump(status, f)
+        os.replace(tmp_path, directory / f"{job_id}.json")
+    except Exception as e:
+        logger.error(f"Error writing status of job {job_id}: {e}")
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+
+def read_job_status(directory, job_id):
+    """Return the stored status of a background job, or None if there is none"""
+    if not JOB_ID_PATTERN.fullmatch(job_id):
+        return None
+    try:
+        with open(Path(directory) / f"{job_id}.json") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None